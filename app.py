@@ -8,16 +8,14 @@ import os
 import time
 import sys
 import re
-from typing import Dict, List, Any, Optional
-import requests
+import threading
+from typing import Callable, Dict, List, Any, Optional
 from flask import Flask, request, jsonify
 from loguru import logger
 from dotenv import load_dotenv
 
 # Imports para recordatorios
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from apscheduler.triggers.cron import CronTrigger
 import pytz
 import atexit
 from supabase import create_client, Client
@@ -26,6 +24,17 @@ from supabase import create_client, Client
 import knowledge_base
 import reminder_utils
 import db_utils
+import gemini_utils
+import knowledge_index
+import local_supabase
+from message_queue import MessageQueue, SenderLocks
+from dedup_cache import TTLDedupCache, WebhookDeduplicator
+from green_api import AsyncGreenApiClient, GreenApiClient
+from outbound_dispatcher import OutboundDispatcher, ReminderBatcher, PRIORITY_INTERACTIVE, PRIORITY_REMINDER
+from reminder_jobs import ReminderJobRegistry
+from reminder_engine import ReminderHeapEngine
+from reminder_record import ReminderRecord
+from user_cache import ConversationCache, ReminderCache
 
 # Load environment variables
 load_dotenv()
@@ -37,11 +46,95 @@ app = Flask(__name__)
 # Get API credentials from environment variables
 GREEN_API_ID = os.environ.get("GREEN_API_ID")
 GREEN_API_TOKEN = os.environ.get("GREEN_API_TOKEN")
+# URL base de Green API (p. ej. http://127.0.0.1:8090 con scripts/fake_green_api.py)
+GREEN_API_BASE_URL = os.environ.get("GREEN_API_BASE_URL", "https://api.green-api.com")
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 
 # Supabase configuration
+# SUPABASE_URL=sqlite:///epigen.db usa el sustituto local sobre SQLite (local_supabase.py)
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY")
+SUPABASE_LOCAL = local_supabase.is_local_url(SUPABASE_URL)
+
+# Webhook processing configuration
+# Con WEBHOOK_ASYNC_MODE=true el webhook encola el mensaje y responde de inmediato.
+# WEBHOOK_WORKERS es el número de carriles: un remitente siempre cae en el mismo carril
+WEBHOOK_ASYNC_MODE = os.environ.get("WEBHOOK_ASYNC_MODE", "false").lower() in ("1", "true", "yes")
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 1000))
+
+# Conocimiento en el prompt: "full" (todo el conocimiento) o "retrieval" (solo las secciones relevantes)
+KNOWLEDGE_MODE = os.environ.get("KNOWLEDGE_MODE", "full").lower()
+KNOWLEDGE_TOP_K = int(os.environ.get("KNOWLEDGE_TOP_K", 4))
+
+# Streaming: las respuestas de IA se envían por párrafos a medida que Gemini las genera
+GEMINI_STREAMING = os.environ.get("GEMINI_STREAMING", "false").lower() in ("1", "true", "yes")
+STREAM_MIN_CHUNK_CHARS = int(os.environ.get("STREAM_MIN_CHUNK_CHARS", 300))
+
+# Caché de contexto de Gemini para el prompt estático (~47 KB de conocimiento)
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_CACHE_TTL = float(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", 3600))
+
+# Deduplicación de reentregas por idMessage ("memory" o "supabase" para compartir entre workers)
+WEBHOOK_DEDUP_BACKEND = os.environ.get("WEBHOOK_DEDUP_BACKEND", "memory").lower()
+WEBHOOK_DEDUP_TTL = float(os.environ.get("WEBHOOK_DEDUP_TTL", 3600))
+WEBHOOK_DEDUP_MAX_SIZE = int(os.environ.get("WEBHOOK_DEDUP_MAX_SIZE", 10000))
+WEBHOOK_DEDUP_PRUNE_INTERVAL = float(os.environ.get("WEBHOOK_DEDUP_PRUNE_INTERVAL", 600))
+
+# Escritura diferida de chat_history: los mensajes se anotan en un journal local y se
+# insertan por lotes cada CHAT_WRITE_BEHIND_FLUSH_MS o al juntar CHAT_WRITE_BEHIND_BATCH
+CHAT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+CHAT_WRITE_BEHIND_JOURNAL = os.environ.get("CHAT_WRITE_BEHIND_JOURNAL", "chat_journal.jsonl")
+CHAT_WRITE_BEHIND_FLUSH_MS = float(os.environ.get("CHAT_WRITE_BEHIND_FLUSH_MS", 200))
+CHAT_WRITE_BEHIND_BATCH = int(os.environ.get("CHAT_WRITE_BEHIND_BATCH", 50))
+CHAT_WRITE_BEHIND_FSYNC = os.environ.get("CHAT_WRITE_BEHIND_FSYNC", "false").lower() in ("1", "true", "yes")
+CHAT_WRITE_BEHIND_MAX_PENDING = int(os.environ.get("CHAT_WRITE_BEHIND_MAX_PENDING", 10000))
+CHAT_WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get("CHAT_WRITE_BEHIND_MAX_ATTEMPTS", 5))
+
+# Caché en memoria del historial reciente por usuario (LRU con TTL)
+HISTORY_CACHE = os.environ.get("HISTORY_CACHE", "false").lower() in ("1", "true", "yes")
+HISTORY_CACHE_USERS = int(os.environ.get("HISTORY_CACHE_USERS", 1000))
+HISTORY_CACHE_MESSAGES = int(os.environ.get("HISTORY_CACHE_MESSAGES", 50))
+HISTORY_CACHE_MAX_CHARS = int(os.environ.get("HISTORY_CACHE_MAX_CHARS", 5_000_000))
+HISTORY_CACHE_TTL = float(os.environ.get("HISTORY_CACHE_TTL", 600))
+
+# Caché de recordatorios activos por usuario, actualizada por cada escritura (write-through)
+REMINDER_CACHE = os.environ.get("REMINDER_CACHE", "false").lower() in ("1", "true", "yes")
+REMINDER_CACHE_USERS = int(os.environ.get("REMINDER_CACHE_USERS", 5000))
+REMINDER_CACHE_TTL = float(os.environ.get("REMINDER_CACHE_TTL", 600))
+
+# Motor de recordatorios: "apscheduler" (un job por recordatorio) o "heap"
+# (montículo de registros compactos con disparo por lotes, reminder_engine.py)
+REMINDER_ENGINE = os.environ.get("REMINDER_ENGINE", "apscheduler").lower()
+REMINDER_ENGINE_WORKERS = int(os.environ.get("REMINDER_ENGINE_WORKERS", 10))
+
+# Carga de recordatorios al arrancar: filas por página y si se hace en segundo plano
+# (el servidor atiende peticiones mientras el scheduler se llena)
+REMINDER_LOAD_PAGE_SIZE = int(os.environ.get("REMINDER_LOAD_PAGE_SIZE", 1000))
+REMINDER_LOAD_BACKGROUND = os.environ.get("REMINDER_LOAD_BACKGROUND", "false").lower() in ("1", "true", "yes")
+
+# Cliente de Green API: conexiones keep-alive, timeouts (segundos) y reintentos ante 429/5xx
+GREEN_API_POOL_SIZE = int(os.environ.get("GREEN_API_POOL_SIZE", 20))
+GREEN_API_CONNECT_TIMEOUT = float(os.environ.get("GREEN_API_CONNECT_TIMEOUT", 5))
+GREEN_API_READ_TIMEOUT = float(os.environ.get("GREEN_API_READ_TIMEOUT", 30))
+GREEN_API_MAX_RETRIES = int(os.environ.get("GREEN_API_MAX_RETRIES", 3))
+# Peticiones simultáneas del cliente asíncrono (asgi_app.py)
+GREEN_API_MAX_IN_FLIGHT = int(os.environ.get("GREEN_API_MAX_IN_FLIGHT", 50))
+
+# Cola de envíos salientes con límite de ritmo: respuestas antes que recordatorios
+OUTBOUND_DISPATCHER = os.environ.get("OUTBOUND_DISPATCHER", "false").lower() in ("1", "true", "yes")
+OUTBOUND_RATE = float(os.environ.get("OUTBOUND_RATE", 5))
+OUTBOUND_BURST = int(os.environ.get("OUTBOUND_BURST", 10))
+OUTBOUND_WORKERS = int(os.environ.get("OUTBOUND_WORKERS", 4))
+OUTBOUND_MAX_BACKLOG = int(os.environ.get("OUTBOUND_MAX_BACKLOG", 10000))
+OUTBOUND_MAX_DELAY = float(os.environ.get("OUTBOUND_MAX_DELAY", 600))
+
+# Suavizado de picos de recordatorios: los que vencen en la misma ventana (segundos)
+# se envían repartidos en el margen de jitter en vez de todos a la vez
+REMINDER_SMOOTHING = os.environ.get("REMINDER_SMOOTHING", "false").lower() in ("1", "true", "yes")
+REMINDER_SMOOTHING_WINDOW = float(os.environ.get("REMINDER_SMOOTHING_WINDOW", 1))
+REMINDER_JITTER_BUDGET = float(os.environ.get("REMINDER_JITTER_BUDGET", 30))
+REMINDER_SMOOTHING_MIN_RATE = float(os.environ.get("REMINDER_SMOOTHING_MIN_RATE", 10))
 
 logger.info(f"GREEN_API_ID={GREEN_API_ID}, GREEN_API_TOKEN={GREEN_API_TOKEN}")
 logger.info(f"SUPABASE_URL={SUPABASE_URL}")
@@ -51,7 +144,7 @@ if not GREEN_API_ID or not GREEN_API_TOKEN:
     logger.warning("WhatsApp API credentials not set. Webhook will not be able to send messages.")
 if not GOOGLE_API_KEY:
     logger.warning("Google API key not set. AI responses will not work.")
-if not SUPABASE_URL or not SUPABASE_ANON_KEY:
+if not SUPABASE_LOCAL and (not SUPABASE_URL or not SUPABASE_ANON_KEY):
     logger.warning("Supabase credentials not set. Reminders will not work.")
 
 # Configure logging
@@ -59,23 +152,140 @@ logger.remove()
 logger.add(sys.stdout, level="INFO")
 
 # ==================== INITIALIZATION ====================
+# Initialize Green API client (shared by replies and reminders)
+GREEN_API_CLIENT_OPTIONS = {
+    "base_url": GREEN_API_BASE_URL,
+    "pool_size": GREEN_API_POOL_SIZE,
+    "connect_timeout": GREEN_API_CONNECT_TIMEOUT,
+    "read_timeout": GREEN_API_READ_TIMEOUT,
+    "max_retries": GREEN_API_MAX_RETRIES
+}
+green_api_client = GreenApiClient(GREEN_API_ID, GREEN_API_TOKEN, **GREEN_API_CLIENT_OPTIONS)
+# Cliente asíncrono: lo crea y arranca asgi_app.py en su event loop
+green_api_async: Optional[AsyncGreenApiClient] = None
+
+# Initialize outbound dispatcher (send function defined below)
+outbound_dispatcher = None
+if OUTBOUND_DISPATCHER:
+    outbound_dispatcher = OutboundDispatcher(
+        lambda recipient, message: deliver_whatsapp_message(recipient, message),
+        rate_per_second=OUTBOUND_RATE,
+        burst=OUTBOUND_BURST,
+        num_workers=OUTBOUND_WORKERS,
+        max_backlog=OUTBOUND_MAX_BACKLOG,
+        max_delay_seconds=OUTBOUND_MAX_DELAY
+    )
+    outbound_dispatcher.start()
+    atexit.register(outbound_dispatcher.stop)
+
+# Initialize reminder batcher (releases into dispatch_reminder, defined below)
+reminder_batcher = None
+if REMINDER_SMOOTHING:
+    reminder_batcher = ReminderBatcher(
+        lambda user_phone, message: dispatch_reminder(user_phone, message),
+        window_seconds=REMINDER_SMOOTHING_WINDOW,
+        jitter_budget_seconds=REMINDER_JITTER_BUDGET,
+        min_rate=REMINDER_SMOOTHING_MIN_RATE
+    )
+    reminder_batcher.start()
+    # Registrado después del dispatcher: atexit lo detiene antes, y su último lote aún entra en la cola
+    atexit.register(reminder_batcher.stop)
+
 # Initialize Supabase client
 supabase: Client = None
-if SUPABASE_URL and SUPABASE_ANON_KEY:
+if SUPABASE_LOCAL:
+    supabase = local_supabase.create_client(SUPABASE_URL)
+    logger.info(f"Using local SQLite stand-in for Supabase: {supabase.path}")
+elif SUPABASE_URL and SUPABASE_ANON_KEY:
     supabase = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
 
+# Initialize webhook deduplication
+webhook_dedup = WebhookDeduplicator(
+    TTLDedupCache(ttl_seconds=WEBHOOK_DEDUP_TTL, max_size=WEBHOOK_DEDUP_MAX_SIZE),
+    supabase=supabase if WEBHOOK_DEDUP_BACKEND == "supabase" else None,
+    prune_interval_seconds=WEBHOOK_DEDUP_PRUNE_INTERVAL
+)
+
+# Initialize chat write-behind buffer
+chat_write_buffer: Optional[db_utils.ChatWriteBuffer] = None
+if CHAT_WRITE_BEHIND and supabase:
+    chat_write_buffer = db_utils.ChatWriteBuffer(
+        supabase,
+        CHAT_WRITE_BEHIND_JOURNAL,
+        flush_interval_ms=CHAT_WRITE_BEHIND_FLUSH_MS,
+        max_batch=CHAT_WRITE_BEHIND_BATCH,
+        fsync=CHAT_WRITE_BEHIND_FSYNC,
+        max_attempts=CHAT_WRITE_BEHIND_MAX_ATTEMPTS,
+        max_pending=CHAT_WRITE_BEHIND_MAX_PENDING
+    )
+    chat_write_buffer.start()
+    db_utils.enable_write_behind(chat_write_buffer)
+    atexit.register(lambda: chat_write_buffer.stop())
+
+# Initialize per-user history cache
+history_cache: Optional[ConversationCache] = None
+if HISTORY_CACHE:
+    history_cache = ConversationCache(
+        max_users=HISTORY_CACHE_USERS,
+        max_messages=HISTORY_CACHE_MESSAGES,
+        ttl_seconds=HISTORY_CACHE_TTL,
+        max_total_chars=HISTORY_CACHE_MAX_CHARS
+    )
+    db_utils.enable_history_cache(history_cache)
+
+# Initialize per-user reminder cache
+reminder_cache: Optional[ReminderCache] = None
+if REMINDER_CACHE:
+    reminder_cache = ReminderCache(max_users=REMINDER_CACHE_USERS, ttl_seconds=REMINDER_CACHE_TTL)
+    db_utils.enable_reminder_cache(reminder_cache)
+
+# Initialize Gemini context cache
+gemini_context_cache: Optional[gemini_utils.ContextCache] = None
+if GEMINI_CONTEXT_CACHE:
+    gemini_context_cache = gemini_utils.ContextCache(ttl_seconds=GEMINI_CONTEXT_CACHE_TTL)
+
 # Initialize scheduler
 scheduler = BackgroundScheduler(timezone=pytz.timezone('America/Mexico_City'))
 scheduler.start()
 
+# Jobs de recordatorios indexados por (usuario, ID) y por usuario
+if REMINDER_ENGINE == "heap":
+    reminder_jobs = ReminderHeapEngine(workers=REMINDER_ENGINE_WORKERS)
+    reminder_jobs.start()
+    atexit.register(reminder_jobs.stop)
+else:
+    reminder_jobs = ReminderJobRegistry(scheduler)
+
 # Ensure scheduler shuts down properly
 atexit.register(lambda: scheduler.shutdown())
 
 # ==================== RECORDATORIO FUNCIONES MEJORADAS ====================
 
 def send_reminder(user_phone: str, message: str):
-    """Enviar un mensaje de recordatorio"""
+    """Enviar un mensaje de recordatorio (job del scheduler)"""
+    if reminder_batcher:
+        # Se agrupa con los que vencen a la vez y se libera repartido en el margen de jitter
+        reminder_batcher.submit(user_phone, message)
+        return None
+    return dispatch_reminder(user_phone, message)
+
+def dispatch_reminder(user_phone: str, message: str):
+    """Enviar ya un recordatorio. Con OUTBOUND_DISPATCHER solo lo encola y devuelve
+    el Future del envío (None si se descartó)"""
     try:
+        if outbound_dispatcher:
+            # Prioridad baja y sin esperar: el hilo que lo libera queda libre enseguida
+            queued = outbound_dispatcher.submit(user_phone, message, PRIORITY_REMINDER)
+            if queued:
+                logger.info(f"Reminder queued for {user_phone}: {message}")
+            return queued
+        
+        if green_api_async and green_api_async.started:
+            # Desde el event loop de asgi_app: el hilo del scheduler no espera la respuesta
+            future = green_api_async.send_message_threadsafe(user_phone, message)
+            logger.info(f"Reminder submitted to async client for {user_phone}: {message}")
+            return future
+        
         send_result = send_whatsapp_message(user_phone, f"{message}")
         logger.info(f"Reminder sent to {user_phone}: {message}")
         return send_result
@@ -83,6 +293,54 @@ def send_reminder(user_phone: str, message: str):
         logger.error(f"Error sending reminder to {user_phone}: {str(e)}")
         return None
 
+def schedule_reminder(record: ReminderRecord) -> bool:
+    """Registrar en el scheduler el job de un recordatorio guardado"""
+    try:
+        trigger = record.trigger()
+        if trigger is None:
+            logger.warning(f"Reminder {record.id} has no valid schedule")
+            return False
+        reminder_jobs.add(record.user_phone, record.id, record.reminder_type, send_reminder, trigger, record.job_args())
+        return True
+    except Exception as e:
+        logger.error(f"Error scheduling reminder {record.id}: {str(e)}")
+        return False
+
+def schedule_reminders(records: List[ReminderRecord]) -> int:
+    """Registrar los jobs de varios recordatorios. Devuelve cuántos se programaron"""
+    return sum(1 for record in records if schedule_reminder(record))
+
+def create_times_reminders(user_phone: str, reminder_type: str, message: str, times: List[str],
+                           names: Callable[[str], tuple]) -> List[str]:
+    """Crear un recordatorio por horario con un solo insert y registrar sus jobs.
+    names(time_str) devuelve (display_name, nickname). Devuelve los display_name creados"""
+    reminders = []
+    for time_str in times:
+        try:
+            hour, minute = map(int, time_str.split(':'))
+        except ValueError as e:
+            logger.error(f"Error creating reminder at {time_str}: {str(e)}")
+            continue
+        
+        display_name, nickname = names(time_str)
+        reminders.append({
+            "user_phone": user_phone,
+            "reminder_type": reminder_type,
+            "message": message,
+            "display_name": display_name,
+            "cron_expression": f"{minute} {hour} * * *",
+            "nickname": nickname
+        })
+    
+    if not reminders:
+        return []
+    
+    reminder_ids = db_utils.save_reminders_supabase(supabase, reminders)
+    
+    created = [(reminder_id, reminder) for reminder_id, reminder in zip(reminder_ids, reminders) if reminder_id]
+    schedule_reminders([ReminderRecord.from_row(dict(reminder, id=reminder_id)) for reminder_id, reminder in created])
+    return [reminder["display_name"] for _, reminder in created]
+
 def modify_existing_reminder(user_phone: str, modification_info: dict):
     """NUEVA FUNCIÓN: Modificar recordatorios existentes"""
     try:
@@ -137,49 +395,15 @@ def update_reminder_to_times(user_phone: str, reminder: dict, new_times: List[st
         db_utils.deactivate_reminder_supabase(supabase, user_phone, reminder["id"])
         
         # Eliminar job del scheduler
-        try:
-            for job in scheduler.get_jobs():
-                if f"_{user_phone}_{reminder['id']}" in job.id:
-                    scheduler.remove_job(job.id)
-        except:
-            pass
+        reminder_jobs.remove(user_phone, reminder["id"])
         
-        # Crear nuevos recordatorios para cada horario
-        created_count = 0
-        created_names = []
-        
-        for time_str in new_times:
-            try:
-                hour, minute = map(int, time_str.split(':'))
-                
-                # Crear nombre único para cada hora
-                base_name = reminder.get("nickname", reminder["reminder_type"])
-                time_display_name = f"{base_name} ({time_str})"
-                
-                new_reminder_id = db_utils.save_reminder_supabase(
-                    supabase=supabase,
-                    user_phone=user_phone,
-                    reminder_type=reminder["reminder_type"],
-                    message=reminder["message"],
-                    display_name=time_display_name,
-                    cron_expression=f"{minute} {hour} * * *",
-                    nickname=f"{base_name} {time_str}"
-                )
-                
-                if new_reminder_id:
-                    scheduler.add_job(
-                        func=send_reminder,
-                        trigger=CronTrigger(hour=hour, minute=minute),
-                        args=[user_phone, reminder["message"]],
-                        id=f"{reminder['reminder_type']}_{user_phone}_{new_reminder_id}",
-                        replace_existing=True
-                    )
-                    created_count += 1
-                    created_names.append(time_display_name)
-                    
-            except Exception as e:
-                logger.error(f"Error creating reminder at {time_str}: {str(e)}")
-                continue
+        # Crear nuevos recordatorios para cada horario (un solo insert)
+        base_name = reminder.get("nickname", reminder["reminder_type"])
+        created_names = create_times_reminders(
+            user_phone, reminder["reminder_type"], reminder["message"], new_times,
+            lambda time_str: (f"{base_name} ({time_str})", f"{base_name} {time_str}")
+        )
+        created_count = len(created_names)
         
         if created_count > 0:
             times_text = ", ".join(new_times)
@@ -199,12 +423,7 @@ def update_reminder_to_interval(user_phone: str, reminder: dict, new_interval: f
         db_utils.deactivate_reminder_supabase(supabase, user_phone, reminder["id"])
         
         # Eliminar job del scheduler
-        try:
-            for job in scheduler.get_jobs():
-                if f"_{user_phone}_{reminder['id']}" in job.id:
-                    scheduler.remove_job(job.id)
-        except:
-            pass
+        reminder_jobs.remove(user_phone, reminder["id"])
         
         # Crear nuevo recordatorio con intervalo
         base_name = reminder.get("nickname", reminder["reminder_type"])
@@ -220,13 +439,8 @@ def update_reminder_to_interval(user_phone: str, reminder: dict, new_interval: f
         )
         
         if new_reminder_id:
-            scheduler.add_job(
-                func=send_reminder,
-                trigger=IntervalTrigger(minutes=new_interval),
-                args=[user_phone, reminder["message"]],
-                id=f"{reminder['reminder_type']}_{user_phone}_{new_reminder_id}",
-                replace_existing=True
-            )
+            schedule_reminder(ReminderRecord(new_reminder_id, user_phone, reminder["reminder_type"],
+                                             reminder["message"], interval_minutes=new_interval))
             
             freq_text = reminder_utils.format_interval_text(new_interval)
             emoji = reminder_utils.REMINDER_EMOJIS.get(reminder["reminder_type"], "🔔")
@@ -240,38 +454,11 @@ def update_reminder_to_interval(user_phone: str, reminder: dict, new_interval: f
 
 def create_timed_supplement_reminder(sender: str, supplement_name: str, times: List[str]) -> str:
     """Crear recordatorio de suplemento con horarios específicos"""
-    created_count = 0
-    created_names = []
-    
-    for time_str in times:
-        try:
-            hour, minute = map(int, time_str.split(':'))
-            time_display_name = f"{supplement_name} ({time_str})"
-            
-            reminder_id = db_utils.save_reminder_supabase(
-                supabase=supabase,
-                user_phone=sender,
-                reminder_type="supplement",
-                message=f"💊 Es hora de tomar tu {supplement_name}",
-                display_name=time_display_name,
-                cron_expression=f"{minute} {hour} * * *",
-                nickname=f"{supplement_name} {time_str}"
-            )
-            
-            if reminder_id:
-                scheduler.add_job(
-                    func=send_reminder,
-                    trigger=CronTrigger(hour=hour, minute=minute),
-                    args=[sender, f"💊 Es hora de tomar tu {supplement_name}"],
-                    id=f"supplement_{sender}_{reminder_id}",
-                    replace_existing=True
-                )
-                created_count += 1
-                created_names.append(time_display_name)
-                
-        except Exception as e:
-            logger.error(f"Error creating reminder at {time_str}: {str(e)}")
-            continue
+    created_names = create_times_reminders(
+        sender, "supplement", f"💊 Es hora de tomar tu {supplement_name}", times,
+        lambda time_str: (f"{supplement_name} ({time_str})", f"{supplement_name} {time_str}")
+    )
+    created_count = len(created_names)
     
     if created_count > 0:
         times_text = ", ".join(times)
@@ -295,13 +482,8 @@ def create_interval_supplement_reminder(sender: str, supplement_name: str, inter
     )
     
     if reminder_id:
-        scheduler.add_job(
-            func=send_reminder,
-            trigger=IntervalTrigger(minutes=interval_minutes),
-            args=[sender, f"💊 Es hora de tomar tu {supplement_name}"],
-            id=f"supplement_{sender}_{reminder_id}",
-            replace_existing=True
-        )
+        schedule_reminder(ReminderRecord(reminder_id, sender, "supplement", f"💊 Es hora de tomar tu {supplement_name}",
+                                         interval_minutes=interval_minutes))
         
         freq_text = reminder_utils.format_interval_text(interval_minutes)
         return f"✅ ¡Listo! Recordatorio para *{supplement_name}* configurado {freq_text}.\n\n💊 Te recordaré tomarlo regularmente.\n\n🔍 Recordatorio: *{display_name}*"
@@ -358,13 +540,8 @@ def create_intelligent_reminder(user_phone: str, reminder_info: dict):
                 )
             
             if reminder_id:
-                scheduler.add_job(
-                    func=send_reminder,
-                    trigger=IntervalTrigger(minutes=interval_minutes),
-                    args=[user_phone, message],
-                    id=f"{reminder_type}_{user_phone}_{reminder_id}",
-                    replace_existing=True
-                )
+                schedule_reminder(ReminderRecord(reminder_id, user_phone, reminder_type, message,
+                                                 interval_minutes=interval_minutes))
                 
                 emoji = reminder_utils.REMINDER_EMOJIS.get(reminder_type, "🔔")
                 freq_text = reminder_utils.format_interval_text(interval_minutes)
@@ -384,56 +561,15 @@ def create_intelligent_reminder(user_phone: str, reminder_info: dict):
             times = reminder_info["times"]
             logger.info(f"Creating {reminder_type} reminder with specific times: {times}")
             
-            created_count = 0
-            created_names = []
+            def names(time_str: str) -> tuple:
+                if reminder_type == "supplement" and reminder_info.get("supplement_name"):
+                    return f"{reminder_info['supplement_name']} ({time_str})", f"{reminder_info['supplement_name']} {time_str}"
+                base_name = display_name.split(" (")[0]
+                return f"{base_name} ({time_str})", None
             
-            for time_str in times:
-                try:
-                    hour, minute = map(int, time_str.split(':'))
-                    
-                    if reminder_type == "supplement" and reminder_info.get("supplement_name"):
-                        time_display_name = f"{reminder_info['supplement_name']} ({time_str})"
-                        nickname = f"{reminder_info['supplement_name']} {time_str}"
-                    else:
-                        base_name = display_name.split(" (")[0]
-                        time_display_name = f"{base_name} ({time_str})"
-                        nickname = None
-                    
-                    # Llamada a la función save_reminder_supabase sin pasar nickname si es None
-                    if nickname:
-                        reminder_id = db_utils.save_reminder_supabase(
-                            supabase=supabase,
-                            user_phone=user_phone,
-                            reminder_type=reminder_type,
-                            message=message,
-                            display_name=time_display_name,
-                            cron_expression=f"{minute} {hour} * * *",
-                            nickname=nickname
-                        )
-                    else:
-                        reminder_id = db_utils.save_reminder_supabase(
-                            supabase=supabase,
-                            user_phone=user_phone,
-                            reminder_type=reminder_type,
-                            message=message,
-                            display_name=time_display_name,
-                            cron_expression=f"{minute} {hour} * * *"
-                        )
-                    
-                    if reminder_id:
-                        scheduler.add_job(
-                            func=send_reminder,
-                            trigger=CronTrigger(hour=hour, minute=minute),
-                            args=[user_phone, message],
-                            id=f"{reminder_type}_{user_phone}_{reminder_id}",
-                            replace_existing=True
-                        )
-                        created_count += 1
-                        created_names.append(time_display_name)
-                        
-                except Exception as e:
-                    logger.error(f"Error creating reminder at {time_str}: {str(e)}")
-                    continue
+            # Todos los horarios en un solo insert
+            created_names = create_times_reminders(user_phone, reminder_type, message, times, names)
+            created_count = len(created_names)
             
             if created_count > 0:
                 emoji = reminder_utils.REMINDER_EMOJIS.get(reminder_type, "🔔")
@@ -470,52 +606,18 @@ def list_user_reminders_intelligent(user_phone: str):
         
         # Agrupar recordatorios por tipo para mejor visualización
         reminder_groups = {}
-        for i, reminder in enumerate(reminders, 1):
-            reminder_type = reminder["reminder_type"]
-            if reminder_type not in reminder_groups:
-                reminder_groups[reminder_type] = []
-            reminder_groups[reminder_type].append(reminder)
+        for reminder in reminders:
+            record = ReminderRecord.from_row(reminder)
+            reminder_groups.setdefault(record.reminder_type, []).append(record)
         
         # Mostrar recordatorios organizados por tipo
         count = 1
         for reminder_type, group in reminder_groups.items():
             emoji = reminder_utils.REMINDER_EMOJIS.get(reminder_type, "🔔")
             
-            for reminder in group:
-                # MODIFICACIÓN: Obtener nombre descriptivo del recordatorio
-                # Priorizar: nickname > display_name > tipo capitalizado
-                display_name = reminder.get("nickname", "")
-                if not display_name or display_name == "None":
-                    display_name = reminder.get("display_name", "")
-                if not display_name or display_name == "None":
-                    # Fallback a un nombre basado en el tipo
-                    if reminder_type == "water":
-                        display_name = "Agua"
-                    elif reminder_type == "supplement":
-                        display_name = "Suplemento"
-                    elif reminder_type == "sleep":
-                        display_name = "Dormir"
-                    elif reminder_type == "meditation":
-                        display_name = "Meditación"
-                    elif reminder_type == "exercise":
-                        display_name = "Ejercicio"
-                    else:
-                        display_name = reminder_type.capitalize()
-                
-                if reminder["interval_minutes"]:
-                    interval = float(reminder["interval_minutes"])
-                    freq_text = reminder_utils.format_interval_text(interval)
-                    response += f"{count}. {emoji} {display_name}: {freq_text} (ID: {reminder['id']})\n"
-                else:
-                    # Extraer hora del cron si está disponible
-                    time_str = "horario específico"
-                    if reminder["cron_expression"]:
-                        parts = reminder["cron_expression"].split()
-                        if len(parts) >= 2:
-                            minute, hour = parts[0], parts[1]
-                            time_str = f"{hour}:{minute.zfill(2)}"
-                    
-                    response += f"{count}. {emoji} {display_name}: {time_str} (ID: {reminder['id']})\n"
+            for record in group:
+                # Nombre: nickname > display_name > tipo
+                response += f"{count}. {emoji} {record.label()}: {record.schedule_text()} (ID: {record.id})\n"
                 count += 1
         
         response += "\n💡 Para detener todos los recordatorios, escribe: */borrar_todo*"
@@ -528,8 +630,76 @@ def list_user_reminders_intelligent(user_phone: str):
 
 # ==================== MESSAGE PROCESSING MEJORADO ====================
 
-def process_message(sender: str, message_text: str) -> str:
-    """VERSIÓN MEJORADA: Procesamiento de mensajes con mejor detección"""
+def detect_message_intent(sender: str, message_text: str):
+    """Detectar la intención de un mensaje (sin comandos). Devuelve (intención, datos)"""
+    # 2. Consultas sobre recordatorios existentes
+    if reminder_utils.parse_reminder_query(message_text, sender):
+        logger.info("DETECTED REMINDER QUERY")
+        return "reminder_query", None
+    
+    # 3. Eliminación de recordatorio específico
+    reminder_id_to_remove = reminder_utils.parse_reminder_removal(message_text, sender)
+    if reminder_id_to_remove is not None:
+        logger.info(f"DETECTED REMINDER REMOVAL - ID {reminder_id_to_remove}")
+        return "reminder_removal", reminder_id_to_remove
+    
+    # 4. NUEVA: Modificación de recordatorios
+    modification_info = reminder_utils.parse_reminder_modification(message_text, sender)
+    if modification_info:
+        logger.info("DETECTED REMINDER MODIFICATION")
+        return "reminder_modification", modification_info
+    
+    # 5. Solicitudes de información sobre productos
+    if (reminder_utils.is_information_request(message_text) or 
+        reminder_utils.is_specific_product_request(message_text)):
+        logger.info("DETECTED INFORMATION REQUEST")
+        return "information", None
+    
+    # 6. Creación de recordatorios explícitos
+    reminder_info = reminder_utils.parse_reminder_request(message_text, sender)
+    if reminder_info and reminder_info.get("detected"):
+        logger.info("DETECTED EXPLICIT REMINDER REQUEST")
+        return "reminder_request", reminder_info
+    
+    # 7. Conversación normal
+    logger.info("Processing as normal conversation")
+    return "conversation", None
+
+# Intenciones que se responden con el modelo de IA
+AI_INTENTS = ("information", "conversation")
+
+def handle_reminder_intent(sender: str, intent: str, payload) -> str:
+    """Responder a las intenciones de recordatorios detectadas en lenguaje natural"""
+    if intent == "reminder_query":
+        return list_user_reminders_intelligent(sender)
+    
+    if intent == "reminder_removal":
+        reminder_id_to_remove = payload
+        success = db_utils.deactivate_reminder_supabase(supabase, sender, reminder_id_to_remove)
+        
+        if success:
+            # Detener job en scheduler
+            if reminder_jobs.remove(sender, reminder_id_to_remove):
+                logger.info(f"Removed scheduler job for reminder ID {reminder_id_to_remove}")
+            
+            return f"✅ Recordatorio #{reminder_id_to_remove} eliminado correctamente."
+        else:
+            return f"❌ No pude eliminar el recordatorio con ID {reminder_id_to_remove}. ¿Seguro que es correcto?"
+    
+    if intent == "reminder_modification":
+        return modify_existing_reminder(sender, payload)
+    
+    if intent == "reminder_request":
+        return create_intelligent_reminder(sender, payload)
+    
+    raise ValueError(f"Unknown reminder intent: {intent}")
+
+# Aviso que sigue a una respuesta en streaming cortada a la mitad
+STREAM_INTERRUPTED_MESSAGE = "Perdón, mi respuesta se cortó. Si necesitas el resto, vuelve a preguntarme."
+
+def process_message(sender: str, message_text: str, on_chunk: Optional[Callable[[str], Any]] = None) -> str:
+    """VERSIÓN MEJORADA: Procesamiento de mensajes con mejor detección.
+    Con `on_chunk` las respuestas de IA se entregan por párrafos mientras se generan."""
     try:
         logger.info(f"Processing IMPROVED message from {sender}: '{message_text}'")
         
@@ -538,6 +708,10 @@ def process_message(sender: str, message_text: str) -> str:
             logger.info("Processing as manual command")
             return handle_reminder_command(sender, message_text)
         
+        # Estadísticas y recordatorios se leen en paralelo con el historial; solo
+        # se esperan si la respuesta es de IA
+        pending_context = db_utils.start_user_context(supabase, sender)
+        
         # Obtener historial de chat
         chat_history = db_utils.get_chat_history_from_supabase(supabase, sender, limit=20)
         if not chat_history:
@@ -547,116 +721,53 @@ def process_message(sender: str, message_text: str) -> str:
         user_message_id = db_utils.save_message_to_supabase(supabase, sender, "user", message_text)
         logger.info(f"User message saved with ID: {user_message_id}")
         
-        # 2. Consultas sobre recordatorios existentes
-        if reminder_utils.parse_reminder_query(message_text, sender):
-            logger.info("DETECTED REMINDER QUERY")
-            response = list_user_reminders_intelligent(sender)
-            db_utils.save_message_to_supabase(supabase, sender, "assistant", response)
-            return response
+        intent, payload = detect_message_intent(sender, message_text)
         
-        # 3. Eliminación de recordatorio específico
-        reminder_id_to_remove = reminder_utils.parse_reminder_removal(message_text, sender)
-        if reminder_id_to_remove is not None:
-            logger.info(f"DETECTED REMINDER REMOVAL - ID {reminder_id_to_remove}")
-            success = db_utils.deactivate_reminder_supabase(supabase, sender, reminder_id_to_remove)
-            
-            if success:
-                # Detener job en scheduler
-                try:
-                    for job in scheduler.get_jobs():
-                        if f"_{sender}_{reminder_id_to_remove}" in job.id:
-                            scheduler.remove_job(job.id)
-                            logger.info(f"Removed scheduler job for reminder ID {reminder_id_to_remove}")
-                except Exception as e:
-                    logger.error(f"Error removing scheduler job: {str(e)}")
-                
-                response = f"✅ Recordatorio #{reminder_id_to_remove} eliminado correctamente."
-            else:
-                response = f"❌ No pude eliminar el recordatorio con ID {reminder_id_to_remove}. ¿Seguro que es correcto?"
-            
-            db_utils.save_message_to_supabase(supabase, sender, "assistant", response)
-            return response
-        
-        # 4. NUEVA: Modificación de recordatorios
-        modification_info = reminder_utils.parse_reminder_modification(message_text, sender)
-        if modification_info:
-            logger.info("DETECTED REMINDER MODIFICATION")
-            response = modify_existing_reminder(sender, modification_info)
-            db_utils.save_message_to_supabase(supabase, sender, "assistant", response)
-            return response
-        
-        # 5. Solicitudes de información sobre productos
-        if (reminder_utils.is_information_request(message_text) or 
-            reminder_utils.is_specific_product_request(message_text)):
-            logger.info("DETECTED INFORMATION REQUEST")
-            
+        if intent in AI_INTENTS:
             current_history = chat_history.copy()
             current_history.append({"role": "user", "content": message_text})
             
-            response = generate_ai_response_with_context(current_history, message_text, sender)
-            db_utils.save_message_to_supabase(supabase, sender, "assistant", response)
-            return response
-        
-        # 6. Creación de recordatorios explícitos
-        reminder_info = reminder_utils.parse_reminder_request(message_text, sender)
-        if reminder_info and reminder_info.get("detected"):
-            logger.info("DETECTED EXPLICIT REMINDER REQUEST")
-            response = create_intelligent_reminder(sender, reminder_info)
-            db_utils.save_message_to_supabase(supabase, sender, "assistant", response)
-            return response
-        
-        # 7. Conversación normal
-        logger.info("Processing as normal conversation")
-        current_history = chat_history.copy()
-        current_history.append({"role": "user", "content": message_text})
+            user_context = pending_context.result()
+            response = generate_ai_response_with_context(current_history, message_text, sender, on_chunk=on_chunk,
+                                                         user_stats=user_context.user_stats,
+                                                         active_reminders=user_context.active_reminders)
+        else:
+            pending_context.cancel()
+            response = handle_reminder_intent(sender, intent, payload)
         
-        response = generate_ai_response_with_context(current_history, message_text, sender)
         db_utils.save_message_to_supabase(supabase, sender, "assistant", response)
         return response
         
+    except gemini_utils.StreamInterrupted as e:
+        # Se guarda lo que el usuario sí recibió y se le avisa del corte
+        logger.error(f"Streaming interrupted for {sender}: {str(e)}")
+        db_utils.save_message_to_supabase(supabase, sender, "assistant", e.delivered_text)
+        return STREAM_INTERRUPTED_MESSAGE
+    
     except Exception as e:
         logger.error(f"Error in IMPROVED message processing: {str(e)}")
         return "Lo siento, tuve un problema procesando tu mensaje. Por favor intenta de nuevo."
 
+# ==================== GEMINI ====================
 
-
-
-def generate_ai_response_with_context(chat_history: List[Dict[str, str]], user_message: str, user_phone: str) -> str:
-    """Generate a response using the Google Gemini model with enhanced context."""
-    import google.generativeai as genai
+def get_generation_model():
+    """Modelo de Gemini a usar y si el prompt estático ya está en el caché de contexto"""
+    # Con recuperación el conocimiento cambia en cada turno, no hay prompt estático que cachear
+    if gemini_context_cache and KNOWLEDGE_MODE != "retrieval":
+        model = gemini_context_cache.get_model(GOOGLE_API_KEY, knowledge_base.get_static_system_message())
+        if model is not None:
+            return model, True
     
-    genai.configure(api_key=GOOGLE_API_KEY)
-    
-    generation_config = {
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "top_k": 0,
-        "max_output_tokens": 1000,
-    }
-    
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    ]
+    return gemini_utils.get_model(GOOGLE_API_KEY), False
 
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash-preview-05-20", 
-        generation_config=generation_config,
-        safety_settings=safety_settings,
-    )
-    
+def build_gemini_history(chat_history: List[Dict[str, str]], user_stats: Dict[str, Any], active_reminders: List[Dict[str, Any]], static_prompt_cached: bool = False) -> List[Dict[str, Any]]:
+    """Formatear el historial para Gemini con el mensaje del sistema personalizado"""
     # Format conversation history
     formatted_history = []
     for message in chat_history:
         role = "user" if message["role"] == "user" else "model"
         formatted_history.append({"role": role, "parts": [message["content"]]})
     
-    # Obtener estadísticas del usuario para personalización
-    user_stats = db_utils.get_user_stats(supabase, user_phone)
-    active_reminders = db_utils.get_user_reminders_supabase(supabase, user_phone)
-    
     user_context = ""
     if user_stats.get("total_messages", 0) > 5:
         user_context = f"Este usuario ha tenido {user_stats['total_messages']} mensajes contigo, así que ya te conoce."
@@ -666,19 +777,81 @@ def generate_ai_response_with_context(chat_history: List[Dict[str, str]], user_m
         reminder_types = [r['reminder_type'] for r in active_reminders]
         reminders_context = f"Este usuario tiene {len(active_reminders)} recordatorios activos: {', '.join(reminder_types)}"
     
-    # Obtener el mensaje del sistema desde el módulo de knowledge_base
-    system_message = knowledge_base.get_system_message(
-        user_context=user_context,
-        reminders_context=reminders_context
-    )
+    if static_prompt_cached:
+        # El prompt estático ya va en el caché; solo se envía el contexto del usuario
+        system_message = knowledge_base.get_user_context_message(
+            user_context=user_context,
+            reminders_context=reminders_context
+        )
+    elif KNOWLEDGE_MODE == "retrieval":
+        # Solo las secciones de conocimiento relevantes para los últimos mensajes del usuario
+        recent_user_messages = [m["content"] for m in chat_history if m["role"] == "user"][-2:]
+        system_message = knowledge_base.get_system_message(
+            user_context=user_context,
+            reminders_context=reminders_context,
+            knowledge=knowledge_index.build_knowledge_context(" ".join(recent_user_messages), KNOWLEDGE_TOP_K)
+        )
+    else:
+        # Obtener el mensaje del sistema desde el módulo de knowledge_base
+        system_message = knowledge_base.get_system_message(
+            user_context=user_context,
+            reminders_context=reminders_context
+        )
+    
+    if system_message:
+        formatted_history.insert(0, {"role": "model", "parts": [system_message]})
+    return formatted_history
+
+def generate_ai_response_with_context(chat_history: List[Dict[str, str]], user_message: str, user_phone: str,
+                                      on_chunk: Optional[Callable[[str], Any]] = None,
+                                      user_stats: Optional[Dict[str, Any]] = None,
+                                      active_reminders: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Generate a response using the Google Gemini model with enhanced context.
+    If `on_chunk` is given, the response is streamed and each paragraph-sized chunk is passed to it in order.
+    Stats and reminders already loaded by the caller are reused instead of queried again."""
+    model, static_prompt_cached = get_generation_model()
     
-    formatted_history.insert(0, {"role": "model", "parts": [system_message]})
+    # Obtener estadísticas del usuario para personalización
+    if user_stats is None:
+        user_stats = db_utils.get_user_stats_rpc(supabase, user_phone)
+    if active_reminders is None:
+        active_reminders = db_utils.get_user_reminders_supabase(supabase, user_phone)
+    
+    formatted_history = build_gemini_history(chat_history, user_stats, active_reminders, static_prompt_cached)
     
     # Generate response
     chat = model.start_chat(history=formatted_history)
-    response = chat.send_message(user_message)
     
-    return response.text
+    if on_chunk is None:
+        response = chat.send_message(user_message)
+        return response.text
+    
+    started = time.monotonic()
+    chunker = gemini_utils.ParagraphChunker(STREAM_MIN_CHUNK_CHARS)
+    parts = []
+    delivered = []
+    try:
+        for stream_chunk in chat.send_message(user_message, stream=True):
+            text = stream_chunk.text
+            parts.append(text)
+            for paragraph in chunker.feed(text):
+                if not delivered:
+                    logger.info(f"First streamed chunk for {user_phone} after {time.monotonic() - started:.2f}s")
+                on_chunk(paragraph)
+                delivered.append(paragraph)
+        
+        remainder = chunker.flush()
+        if remainder:
+            on_chunk(remainder)
+            delivered.append(remainder)
+    except Exception as e:
+        if not delivered:
+            raise
+        # El usuario ya recibió parte de la respuesta: el llamador decide cómo cerrarla
+        raise gemini_utils.StreamInterrupted("\n\n".join(delivered), e) from e
+    
+    logger.info(f"Streamed response to {user_phone} in {len(delivered)} chunks ({time.monotonic() - started:.2f}s)")
+    return "".join(parts)
 
 def handle_reminder_command(sender: str, command: str) -> str:
     """VERSIÓN MEJORADA: Comandos con mejor parsing de horarios"""
@@ -746,12 +919,7 @@ Ahora puedes decir naturalmente:
             success = db_utils.deactivate_reminder_supabase(supabase, sender, reminder_id)
             
             if success:
-                try:
-                    for job in scheduler.get_jobs():
-                        if f"_{sender}_{reminder_id}" in job.id:
-                            scheduler.remove_job(job.id)
-                except:
-                    pass
+                reminder_jobs.remove(sender, reminder_id)
                 return f"✅ Recordatorio #{reminder_id} eliminado correctamente."
             else:
                 return f"❌ No encontré el recordatorio con ID {reminder_id}."
@@ -765,9 +933,7 @@ Ahora puedes decir naturalmente:
         count = db_utils.deactivate_all_reminders_supabase(supabase, sender)
         
         # Eliminar todos los jobs del scheduler
-        for job in scheduler.get_jobs():
-            if sender in job.id:
-                scheduler.remove_job(job.id)
+        reminder_jobs.remove_user(sender)
         
         return f"✅ Se han eliminado {count} recordatorios."
     
@@ -815,57 +981,38 @@ Ahora puedes decir naturalmente:
     else:
         return "❌ Comando no reconocido. Usa */ayuda* para ver comandos disponibles."
 
+# Progreso de la carga de recordatorios al arrancar (expuesto en /health)
+reminder_load_status = {"state": "pending", "loaded": 0, "scheduled": 0, "seconds": 0.0}
+
 def load_and_schedule_reminders():
-    """Cargar y programar todos los recordatorios desde Supabase con soporte decimal"""
+    """Cargar y programar los recordatorios activos desde Supabase, página a página"""
+    started = time.time()
+    reminder_load_status.update(state="loading", loaded=0, scheduled=0, seconds=0.0)
+    
     try:
-        reminders = db_utils.load_reminders_supabase(supabase)
-        scheduled_count = 0
-        
-        for reminder in reminders:
-            try:
-                user_phone = reminder["user_phone"]
-                reminder_type = reminder["reminder_type"]
-                message = reminder["message"]
-                reminder_id = reminder["id"]
-                
-                if reminder["interval_minutes"]:
-                    interval_minutes = float(reminder["interval_minutes"])  # Convertir a float
-                    
-                    scheduler.add_job(
-                        func=send_reminder,
-                        trigger=IntervalTrigger(minutes=interval_minutes),
-                        args=[user_phone, message],
-                        id=f"{reminder_type}_{user_phone}_{reminder_id}",
-                        replace_existing=True
-                    )
-                    scheduled_count += 1
-                    logger.info(f"Scheduled interval reminder: {interval_minutes} minutes")
-                    
-                elif reminder["cron_expression"]:
-                    parts = reminder["cron_expression"].split()
-                    if len(parts) >= 2:
-                        minute, hour = int(parts[0]), int(parts[1])
-                        
-                        scheduler.add_job(
-                            func=send_reminder,
-                            trigger=CronTrigger(minute=minute, hour=hour),
-                            args=[user_phone, message],
-                            id=f"{reminder_type}_{user_phone}_{reminder_id}",
-                            replace_existing=True
-                        )
-                        scheduled_count += 1
-                        logger.info(f"Scheduled cron reminder: {hour}:{minute:02d}")
-                        
-            except Exception as e:
-                logger.error(f"Error scheduling reminder {reminder.get('id', 'unknown')}: {str(e)}")
-                continue
+        for page in db_utils.iter_active_reminder_pages(supabase, page_size=REMINDER_LOAD_PAGE_SIZE):
+            records = []
+            for reminder in page:
+                try:
+                    records.append(ReminderRecord.from_row(reminder))
+                except Exception as e:
+                    logger.error(f"Error reading reminder {reminder.get('id', 'unknown')}: {str(e)}")
+            
+            reminder_load_status["loaded"] += len(page)
+            reminder_load_status["scheduled"] += schedule_reminders(records)
+            reminder_load_status["seconds"] = round(time.time() - started, 1)
+            logger.info(f"Reminder load progress: {reminder_load_status['loaded']} loaded, "
+                        f"{reminder_load_status['scheduled']} scheduled ({reminder_load_status['seconds']}s)")
         
-        logger.info(f"Successfully scheduled {scheduled_count} reminders from Supabase")
-        return scheduled_count
+        reminder_load_status["state"] = "done"
+        logger.info(f"Successfully scheduled {reminder_load_status['scheduled']} reminders from Supabase")
         
     except Exception as e:
+        reminder_load_status["state"] = "failed"
         logger.error(f"Error loading reminders from Supabase: {str(e)}")
-        return 0
+    
+    reminder_load_status["seconds"] = round(time.time() - started, 1)
+    return reminder_load_status["scheduled"]
 
 def initialize_system():
     """Inicializar sistema completo"""
@@ -880,12 +1027,16 @@ def initialize_system():
         chat_test = supabase.table("chat_history").select("count", count="exact").execute()
         
         logger.info(f"Connected to Supabase successfully")
+        db_utils.schema.detect(supabase)
         logger.info(f"Reminders in DB: {reminders_test.count}")
         logger.info(f"Chat messages in DB: {chat_test.count}")
         
-        scheduled_count = load_and_schedule_reminders()
-        
-        logger.info(f"System initialized successfully. Scheduled {scheduled_count} reminders.")
+        if REMINDER_LOAD_BACKGROUND:
+            threading.Thread(target=load_and_schedule_reminders, name="reminder-loader", daemon=True).start()
+            logger.info("System initialized successfully. Loading reminders in background.")
+        else:
+            scheduled_count = load_and_schedule_reminders()
+            logger.info(f"System initialized successfully. Scheduled {scheduled_count} reminders.")
         logger.info("ULTRA-FLEXIBLE reminder parsing with DECIMAL support enabled!")
         return True
         
@@ -895,55 +1046,183 @@ def initialize_system():
 
 # ==================== WHATSAPP INTEGRATION ====================
 
+def green_api_url(method: str) -> str:
+    """URL de un método de Green API para la instancia configurada"""
+    return green_api_client.url(method)
+
 def send_whatsapp_message(recipient: str, message: str) -> Optional[Dict[str, Any]]:
-    url = f"https://api.green-api.com/waInstance{GREEN_API_ID}/sendMessage/{GREEN_API_TOKEN}"
+    """Enviar una respuesta; con OUTBOUND_DISPATCHER pasa por la cola con prioridad alta"""
+    if outbound_dispatcher:
+        return outbound_dispatcher.send(recipient, message, PRIORITY_INTERACTIVE)
+    return deliver_whatsapp_message(recipient, message)
+
+def deliver_whatsapp_message(recipient: str, message: str) -> Optional[Dict[str, Any]]:
+    # Sesión compartida con keep-alive, timeouts y reintentos (green_api.py)
+    response_data = green_api_client.send_message(recipient, message)
     
-    payload = {
-        "chatId": f"{recipient}@c.us",
-        "message": message
-    }
+    if response_data is None:
+        return None
+    if response_data.get("idMessage"):
+        logger.info(f"Message sent to {recipient}: {message[:50]}...")
+    else:
+        logger.error(f"Error sending message: {response_data}")
     
-    try:
-        response = requests.post(url, json=payload)
-        response_data = response.json()
-        
-        if response.status_code == 200 and response_data.get("idMessage"):
-            logger.info(f"Message sent to {recipient}: {message[:50]}...")
-        else:
-            logger.error(f"Error sending message: {response_data}")
-        
-        return response_data
+    return response_data
+
+def handle_incoming_message(sender: str, message_text: str):
+    """Procesar un mensaje entrante y enviar la respuesta por WhatsApp"""
+    # En modo streaming los párrafos se envían en orden desde este mismo hilo
+    streamed_chunks = []
+    streamed_results = []
+    def deliver_chunk(chunk: str):
+        streamed_results.append(send_whatsapp_message(sender, chunk))
+        streamed_chunks.append(chunk)
     
-    except Exception as e:
-        logger.error(f"Exception when sending message: {str(e)}")
-        return None
+    ai_response = process_message(sender, message_text, on_chunk=deliver_chunk if GEMINI_STREAMING else None)
+    logger.info(f"Generated response: {ai_response[:100]}...")
+    
+    # Si el streaming se cortó, ai_response es el aviso de seguimiento y aún no se envió
+    if gemini_utils.delivered_in_chunks(ai_response, streamed_chunks):
+        logger.info(f"Response already delivered in {len(streamed_results)} streamed chunks")
+        return streamed_results[-1]
+    
+    send_result = send_whatsapp_message(sender, ai_response)
+    logger.info(f"Send result: {send_result}")
+    return send_result
+
+# ==================== MESSAGE QUEUE ====================
+
+# Locks por remitente para el modo síncrono: los mensajes de un mismo usuario
+# nunca se procesan en paralelo (historial y recordatorios sin carreras)
+sender_locks = SenderLocks()
+
+message_queue: Optional[MessageQueue] = None
+if WEBHOOK_ASYNC_MODE:
+    message_queue = MessageQueue(handle_incoming_message, num_workers=WEBHOOK_WORKERS, max_size=WEBHOOK_QUEUE_SIZE)
+    message_queue.start()
+    atexit.register(lambda: message_queue.stop())
 
 # ==================== ROUTE HANDLERS ====================
+# Los payloads se construyen en funciones compartidas con el punto de entrada ASGI (asgi_app.py)
+
+HOME_INFO = {
+    "status": "online",
+    "message": "Epigen WhatsApp webhook server with ULTRA-FLEXIBLE intelligent reminders and DECIMAL support",
+    "version": "8.0.0",
+    "features": [
+        "AI Chat with Persistent History", 
+        "ULTRA-FLEXIBLE Reminder Detection", 
+        "DECIMAL Interval Support",
+        "Smart Reminder Queries",
+        "Natural Language Processing",
+        "Manual Reminder Commands",
+        "Supabase Integration",
+        "Multiple Reminder Types",
+        "Better Intent Detection",
+        "User-Friendly Reminder Names",
+        "Modular Code Structure",
+        "Reminder Modification Support",
+        "AM/PM Time Format Support",
+        "Expression Time Detection",
+        "Improved Natural Language Understanding"
+    ]
+}
+
+def parse_incoming_text_message(data: Dict[str, Any]):
+    """Extraer (idMessage, remitente, texto) de un webhook de mensaje de texto entrante, o None"""
+    if data.get("typeWebhook") != "incomingMessageReceived":
+        return None
+    
+    message_data = data.get("messageData", {})
+    if message_data.get("typeMessage") != "textMessage":
+        return None
+    
+    sender = data["senderData"]["sender"].split("@")[0]
+    message_text = message_data["textMessageData"]["textMessage"]
+    return data.get("idMessage"), sender, message_text
+
+def build_health_info(supabase_stats: Dict[str, Any]) -> Dict[str, Any]:
+    green_api_status = "configured" if GREEN_API_ID and GREEN_API_TOKEN else "not configured"
+    google_api_status = "configured" if GOOGLE_API_KEY else "not configured"
+    supabase_status = "configured" if supabase else "not configured"
+    
+    return {
+        "status": "healthy",
+        "timestamp": time.time(),
+        "services": {
+            "green_api": green_api_status,
+            "google_ai": google_api_status,
+            "supabase": supabase_status
+        },
+        "scheduled_jobs": reminder_jobs.count(),
+        "reminder_engine": reminder_jobs.get_metrics(),
+        "reminder_load": dict(reminder_load_status),
+        "green_api": green_api_client.get_metrics(),
+        "green_api_async": green_api_async.get_metrics() if green_api_async else {"enabled": False},
+        "outbound": outbound_dispatcher.get_metrics() if outbound_dispatcher else {"enabled": False},
+        "reminder_smoothing": reminder_batcher.get_metrics() if reminder_batcher else {"enabled": False},
+        "message_queue": message_queue.get_metrics() if message_queue else {"enabled": False},
+        "webhook_dedup": webhook_dedup.get_metrics(),
+        "chat_write_behind": chat_write_buffer.get_metrics() if chat_write_buffer else {"enabled": False},
+        "history_cache": history_cache.get_metrics() if history_cache else {"enabled": False},
+        "reminder_cache": reminder_cache.get_metrics() if reminder_cache else {"enabled": False},
+        "schema_capabilities": db_utils.schema.as_dict(),
+        "gemini_models": gemini_utils.get_registry_stats(),
+        "gemini_context_cache": gemini_context_cache.get_stats() if gemini_context_cache else {"enabled": False},
+        "supabase_stats": supabase_stats,
+        "features": {
+            "ultra_flexible_reminders": True,
+            "decimal_interval_support": True,
+            "intelligent_queries": True,
+            "persistent_chat": True,
+            "manual_commands": True,
+            "natural_language_processing": True,
+            "multiple_reminder_types": True,
+            "better_intent_detection": True,
+            "friendly_reminder_names": True,
+            "modular_code_structure": True,
+            "reminder_modification": True,
+            "am_pm_time_support": True,
+            "expression_time_detection": True
+        }
+    }
+
+# Columnas mostradas en /active_reminders
+ACTIVE_REMINDERS_COLUMNS = "user_phone, nickname, reminder_type, message, interval_minutes, is_active, created_at"
+
+def build_active_reminders_info(reminder_rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "status": "success",
+        "reminders_in_db": len(reminder_rows),
+        "active_jobs": reminder_jobs.count(),
+        "jobs": reminder_jobs.next_runs(10),
+        "reminders": [
+            {
+                "user": r["user_phone"],
+                "display_name": r.get("nickname", "Sin nombre"),
+                "type": r["reminder_type"],
+                "message": r["message"][:50] + "..." if len(r["message"]) > 50 else r["message"],
+                "interval": r["interval_minutes"],
+                "active": r["is_active"],
+                "created": r["created_at"]
+            } for r in reminder_rows[:10]
+        ]
+    }
+
+def build_chat_stats_info(phone: str, stats: Dict[str, Any], recent_messages: List[Dict[str, str]], active_reminders: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "status": "success",
+        "user_phone": phone,
+        "stats": stats,
+        "recent_messages_count": len(recent_messages),
+        "active_reminders_count": len(active_reminders),
+        "reminders": [r["reminder_type"] for r in active_reminders],
+        "reminder_names": [r.get("nickname", "Sin nombre") for r in active_reminders]
+    }
 
 @app.route('/', methods=['GET'])
 def home():
-    return jsonify({
-        "status": "online",
-        "message": "Epigen WhatsApp webhook server with ULTRA-FLEXIBLE intelligent reminders and DECIMAL support",
-        "version": "8.0.0",
-        "features": [
-            "AI Chat with Persistent History", 
-            "ULTRA-FLEXIBLE Reminder Detection", 
-            "DECIMAL Interval Support",
-            "Smart Reminder Queries",
-            "Natural Language Processing",
-            "Manual Reminder Commands",
-            "Supabase Integration",
-            "Multiple Reminder Types",
-            "Better Intent Detection",
-            "User-Friendly Reminder Names",
-            "Modular Code Structure",
-            "Reminder Modification Support",
-            "AM/PM Time Format Support",
-            "Expression Time Detection",
-            "Improved Natural Language Understanding"
-        ]
-    }), 200
+    return jsonify(HOME_INFO), 200
 
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
@@ -954,22 +1233,31 @@ def webhook():
         return jsonify({"status": "webhook is active"}), 200
     
     try:
-        raw_data = request.get_data(as_text=True)
         data = request.get_json()
         
-        if data.get("typeWebhook") == "incomingMessageReceived":
-            message_data = data.get("messageData", {})
+        incoming = parse_incoming_text_message(data)
+        if incoming:
+            id_message, sender, message_text = incoming
             
-            if message_data.get("typeMessage") == "textMessage":
-                sender = data["senderData"]["sender"].split("@")[0]
-                message_text = message_data["textMessageData"]["textMessage"]
-                logger.info(f"Received message from {sender}: {message_text}")
-                
-                ai_response = process_message(sender, message_text)
-                logger.info(f"Generated response: {ai_response[:100]}...")
-                
-                send_result = send_whatsapp_message(sender, ai_response)
-                logger.info(f"Send result: {send_result}")
+            if webhook_dedup.is_duplicate(id_message):
+                logger.info(f"Duplicate webhook delivery ignored: {id_message}")
+                return jsonify({"status": "duplicate ignored"}), 200
+            
+            logger.info(f"Received message from {sender}: {message_text}")
+            
+            if message_queue:
+                if not message_queue.submit(sender, message_text):
+                    webhook_dedup.release(id_message)
+                    return jsonify({"status": "error", "message": "queue full"}), 503
+                return jsonify({"status": "message queued"}), 200
+            
+            try:
+                with sender_locks.hold(sender):
+                    handle_incoming_message(sender, message_text)
+            except Exception:
+                # Permitir que el reintento de Green API se procese
+                webhook_dedup.release(id_message)
+                raise
                 
         return jsonify({"status": "message processed"}), 200
     
@@ -979,10 +1267,6 @@ def webhook():
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    green_api_status = "configured" if GREEN_API_ID and GREEN_API_TOKEN else "not configured"
-    google_api_status = "configured" if GOOGLE_API_KEY else "not configured"
-    supabase_status = "configured" if supabase else "not configured"
-    
     supabase_stats = {}
     if supabase:
         try:
@@ -1000,31 +1284,16 @@ def health_check():
                 "error": str(e)
             }
     
+    return jsonify(build_health_info(supabase_stats)), 200
+
+@app.route('/queue_stats', methods=['GET'])
+def get_queue_stats():
+    if not message_queue:
+        return jsonify({"status": "disabled", "message": "Set WEBHOOK_ASYNC_MODE=true to enable the message queue"}), 200
+    
     return jsonify({
-        "status": "healthy",
-        "timestamp": time.time(),
-        "services": {
-            "green_api": green_api_status,
-            "google_ai": google_api_status,
-            "supabase": supabase_status
-        },
-        "scheduled_jobs": len(scheduler.get_jobs()) if scheduler else 0,
-        "supabase_stats": supabase_stats,
-        "features": {
-            "ultra_flexible_reminders": True,
-            "decimal_interval_support": True,
-            "intelligent_queries": True,
-            "persistent_chat": True,
-            "manual_commands": True,
-            "natural_language_processing": True,
-            "multiple_reminder_types": True,
-            "better_intent_detection": True,
-            "friendly_reminder_names": True,
-            "modular_code_structure": True,
-            "reminder_modification": True,
-            "am_pm_time_support": True,
-            "expression_time_detection": True
-        }
+        "status": "success",
+        "metrics": message_queue.get_metrics()
     }), 200
 
 @app.route('/active_reminders', methods=['GET'])
@@ -1033,28 +1302,9 @@ def get_active_reminders():
         if not supabase:
             return jsonify({"status": "error", "message": "Supabase not configured"}), 500
             
-        result = supabase.table("reminders").select("user_phone, nickname, reminder_type, message, interval_minutes, is_active, created_at").order("created_at", desc=True).limit(20).execute()
-        
-        jobs = scheduler.get_jobs()
-        active_jobs = [{"id": job.id, "next_run": str(job.next_run_time)} for job in jobs]
+        result = supabase.table("reminders").select(ACTIVE_REMINDERS_COLUMNS).order("created_at", desc=True).limit(20).execute()
         
-        return jsonify({
-            "status": "success",
-            "reminders_in_db": len(result.data) if result.data else 0,
-            "active_jobs": len(active_jobs),
-            "jobs": active_jobs[:10],
-            "reminders": [
-                {
-                    "user": r["user_phone"],
-                    "display_name": r.get("nickname", "Sin nombre"),
-                    "type": r["reminder_type"],
-                    "message": r["message"][:50] + "..." if len(r["message"]) > 50 else r["message"],
-                    "interval": r["interval_minutes"],
-                    "active": r["is_active"],
-                    "created": r["created_at"]
-                } for r in (result.data[:10] if result.data else [])
-            ]
-        }), 200
+        return jsonify(build_active_reminders_info(result.data or [])), 200
         
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -1062,19 +1312,11 @@ def get_active_reminders():
 @app.route('/chat_stats/<phone>', methods=['GET'])
 def get_chat_stats(phone):
     try:
-        stats = db_utils.get_user_stats(supabase, phone)
+        stats = db_utils.get_user_stats_rpc(supabase, phone)
         recent_messages = db_utils.get_chat_history_from_supabase(supabase, phone, limit=5)
         active_reminders = db_utils.get_user_reminders_supabase(supabase, phone)
         
-        return jsonify({
-            "status": "success",
-            "user_phone": phone,
-            "stats": stats,
-            "recent_messages_count": len(recent_messages),
-            "active_reminders_count": len(active_reminders),
-            "reminders": [r["reminder_type"] for r in active_reminders],
-            "reminder_names": [r.get("nickname", "Sin nombre") for r in active_reminders]
-        }), 200
+        return jsonify(build_chat_stats_info(phone, stats, recent_messages, active_reminders)), 200
         
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -0,0 +1,318 @@
+"""
+Punto de entrada ASGI nativo del servidor del webhook.
+Sirve las mismas rutas que app.py (/webhook, /health, /active_reminders,
+/chat_stats/<phone>, ...) con handlers asíncronos. Green API, Gemini y las
+lecturas/escrituras de Supabase del camino conversacional usan clientes
+asíncronos, así que una petición esperando a la red no ocupa un hilo.
+
+La lógica de negocio (detección de intención, recordatorios, scheduler) se
+reutiliza de app.py; las ramas de recordatorios, poco frecuentes, se ejecutan
+en el threadpool.
+
+Ejecutar con: uvicorn asgi_app:app --host 0.0.0.0 --port 7860
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from supabase import AsyncClient, acreate_client
+
+import app as webhook_app
+import db_utils
+import gemini_utils
+import local_supabase
+from green_api import AsyncGreenApiClient
+from message_queue import AsyncSenderLocks
+
+# ==================== ASYNC CLIENTS ====================
+
+async_supabase: Optional[AsyncClient] = None
+green_api: Optional[AsyncGreenApiClient] = None
+sender_locks = AsyncSenderLocks()
+
+# ==================== WHATSAPP INTEGRATION ====================
+
+async def send_whatsapp_message_async(recipient: str, message: str) -> Optional[Dict[str, Any]]:
+    if webhook_app.outbound_dispatcher:
+        # Misma cola y límite de ritmo que los recordatorios, con prioridad alta
+        return await asyncio.wrap_future(webhook_app.outbound_dispatcher.submit(recipient, message))
+
+    # Keep-alive, reintentos y peticiones en vuelo acotadas (green_api.py)
+    response_data = await green_api.send_message(recipient, message)
+
+    if response_data is None:
+        return None
+    if response_data.get("idMessage"):
+        logger.info(f"Message sent to {recipient}: {message[:50]}...")
+    else:
+        logger.error(f"Error sending message: {response_data}")
+
+    return response_data
+
+# ==================== MESSAGE PROCESSING ====================
+
+async def generate_ai_response_with_context_async(chat_history: List[Dict[str, str]], user_message: str, user_phone: str,
+                                                  on_chunk: Optional[Callable[[str], Awaitable[Any]]] = None,
+                                                  user_stats: Optional[Dict[str, Any]] = None,
+                                                  active_reminders: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Versión asíncrona de generate_ai_response_with_context"""
+    if webhook_app.gemini_context_cache:
+        # Crear o renovar el caché de contexto es una llamada bloqueante
+        model, static_prompt_cached = await asyncio.to_thread(webhook_app.get_generation_model)
+    else:
+        model, static_prompt_cached = webhook_app.get_generation_model()
+
+    if user_stats is None or active_reminders is None:
+        user_stats, active_reminders = await asyncio.gather(
+            db_utils.get_user_stats_rpc_async(async_supabase, user_phone),
+            db_utils.get_user_reminders_supabase_async(async_supabase, user_phone)
+        )
+
+    formatted_history = webhook_app.build_gemini_history(chat_history, user_stats, active_reminders, static_prompt_cached)
+
+    chat = model.start_chat(history=formatted_history)
+
+    if on_chunk is None:
+        response = await chat.send_message_async(user_message)
+        return response.text
+
+    chunker = gemini_utils.ParagraphChunker(webhook_app.STREAM_MIN_CHUNK_CHARS)
+    parts = []
+    delivered = []
+    try:
+        async for stream_chunk in await chat.send_message_async(user_message, stream=True):
+            text = stream_chunk.text
+            parts.append(text)
+            for paragraph in chunker.feed(text):
+                await on_chunk(paragraph)
+                delivered.append(paragraph)
+
+        remainder = chunker.flush()
+        if remainder:
+            await on_chunk(remainder)
+            delivered.append(remainder)
+    except Exception as e:
+        if not delivered:
+            raise
+        raise gemini_utils.StreamInterrupted("\n\n".join(delivered), e) from e
+
+    return "".join(parts)
+
+async def process_message_async(sender: str, message_text: str,
+                                on_chunk: Optional[Callable[[str], Awaitable[Any]]] = None) -> str:
+    """Versión asíncrona de process_message con las mismas ramas"""
+    try:
+        logger.info(f"Processing message (async) from {sender}: '{message_text}'")
+
+        # 1. Comandos manuales (prioridad máxima)
+        if message_text.lower().startswith('/'):
+            logger.info("Processing as manual command")
+            return await asyncio.to_thread(webhook_app.handle_reminder_command, sender, message_text)
+
+        # Estadísticas y recordatorios en paralelo con el historial; se cancelan si no es para la IA
+        context_task = asyncio.create_task(db_utils.load_user_context_async(async_supabase, sender))
+
+        chat_history = await db_utils.get_chat_history_from_supabase_async(async_supabase, sender, limit=20)
+        if not chat_history:
+            chat_history = await asyncio.to_thread(db_utils.initialize_user_chat, webhook_app.supabase, sender)
+
+        user_message_id = await db_utils.save_message_to_supabase_async(async_supabase, sender, "user", message_text)
+        logger.info(f"User message saved with ID: {user_message_id}")
+
+        intent, payload = webhook_app.detect_message_intent(sender, message_text)
+
+        if intent in webhook_app.AI_INTENTS:
+            current_history = chat_history.copy()
+            current_history.append({"role": "user", "content": message_text})
+
+            user_context = await context_task
+            response = await generate_ai_response_with_context_async(current_history, message_text, sender, on_chunk=on_chunk,
+                                                                     user_stats=user_context.user_stats,
+                                                                     active_reminders=user_context.active_reminders)
+        else:
+            context_task.cancel()
+            response = await asyncio.to_thread(webhook_app.handle_reminder_intent, sender, intent, payload)
+
+        await db_utils.save_message_to_supabase_async(async_supabase, sender, "assistant", response)
+        return response
+
+    except gemini_utils.StreamInterrupted as e:
+        logger.error(f"Streaming interrupted for {sender}: {str(e)}")
+        await db_utils.save_message_to_supabase_async(async_supabase, sender, "assistant", e.delivered_text)
+        return webhook_app.STREAM_INTERRUPTED_MESSAGE
+
+    except Exception as e:
+        logger.error(f"Error in async message processing: {str(e)}")
+        return "Lo siento, tuve un problema procesando tu mensaje. Por favor intenta de nuevo."
+
+async def handle_incoming_message_async(sender: str, message_text: str):
+    """Procesar un mensaje entrante y enviar la respuesta, en orden por remitente"""
+    streamed_chunks = []
+    streamed_results = []
+    async def deliver_chunk(chunk: str):
+        streamed_results.append(await send_whatsapp_message_async(sender, chunk))
+        streamed_chunks.append(chunk)
+
+    async with sender_locks.hold(sender):
+        ai_response = await process_message_async(sender, message_text, on_chunk=deliver_chunk if webhook_app.GEMINI_STREAMING else None)
+        logger.info(f"Generated response: {ai_response[:100]}...")
+
+        # Si el streaming se cortó, ai_response es el aviso de seguimiento y aún no se envió
+        if gemini_utils.delivered_in_chunks(ai_response, streamed_chunks):
+            logger.info(f"Response already delivered in {len(streamed_results)} streamed chunks")
+            return streamed_results[-1]
+
+        send_result = await send_whatsapp_message_async(sender, ai_response)
+        logger.info(f"Send result: {send_result}")
+        return send_result
+
+async def is_duplicate_delivery(id_message: Optional[str]) -> bool:
+    # El backend compartido hace una petición bloqueante a Supabase
+    if webhook_app.webhook_dedup.supabase:
+        return await asyncio.to_thread(webhook_app.webhook_dedup.is_duplicate, id_message)
+    return webhook_app.webhook_dedup.is_duplicate(id_message)
+
+# ==================== ROUTE HANDLERS ====================
+
+async def home(request: Request):
+    return JSONResponse(webhook_app.HOME_INFO)
+
+async def webhook(request: Request):
+    logger.info(f"Webhook called with method: {request.method}")
+
+    if request.method == 'GET':
+        logger.info("Received webhook verification request")
+        return JSONResponse({"status": "webhook is active"})
+
+    try:
+        data = await request.json()
+
+        incoming = webhook_app.parse_incoming_text_message(data)
+        if incoming:
+            id_message, sender, message_text = incoming
+
+            if await is_duplicate_delivery(id_message):
+                logger.info(f"Duplicate webhook delivery ignored: {id_message}")
+                return JSONResponse({"status": "duplicate ignored"})
+
+            logger.info(f"Received message from {sender}: {message_text}")
+
+            if webhook_app.message_queue:
+                if not webhook_app.message_queue.submit(sender, message_text):
+                    await asyncio.to_thread(webhook_app.webhook_dedup.release, id_message)
+                    return JSONResponse({"status": "error", "message": "queue full"}, status_code=503)
+                return JSONResponse({"status": "message queued"})
+
+            try:
+                await handle_incoming_message_async(sender, message_text)
+            except Exception:
+                # Permitir que el reintento de Green API se procese
+                await asyncio.to_thread(webhook_app.webhook_dedup.release, id_message)
+                raise
+
+        return JSONResponse({"status": "message processed"})
+
+    except Exception as e:
+        logger.error(f"Error processing webhook: {str(e)}", exc_info=True)
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+async def health_check(request: Request):
+    supabase_stats = {}
+    if async_supabase:
+        try:
+            reminders_result, messages_result = await asyncio.gather(
+                async_supabase.table("reminders").select("count", count="exact").execute(),
+                async_supabase.table("chat_history").select("count", count="exact").execute()
+            )
+
+            supabase_stats = {
+                "total_reminders": reminders_result.count,
+                "total_messages": messages_result.count,
+                "connection": "healthy"
+            }
+        except Exception as e:
+            supabase_stats = {
+                "connection": "error",
+                "error": str(e)
+            }
+
+    return JSONResponse(webhook_app.build_health_info(supabase_stats))
+
+async def get_queue_stats(request: Request):
+    if not webhook_app.message_queue:
+        return JSONResponse({"status": "disabled", "message": "Set WEBHOOK_ASYNC_MODE=true to enable the message queue"})
+
+    return JSONResponse({
+        "status": "success",
+        "metrics": webhook_app.message_queue.get_metrics()
+    })
+
+async def get_active_reminders(request: Request):
+    try:
+        if not async_supabase:
+            return JSONResponse({"status": "error", "message": "Supabase not configured"}, status_code=500)
+
+        result = await async_supabase.table("reminders").select(webhook_app.ACTIVE_REMINDERS_COLUMNS).order("created_at", desc=True).limit(20).execute()
+
+        return JSONResponse(webhook_app.build_active_reminders_info(result.data or []))
+
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+async def get_chat_stats(request: Request):
+    phone = request.path_params["phone"]
+    try:
+        stats, recent_messages, active_reminders = await asyncio.gather(
+            db_utils.get_user_stats_rpc_async(async_supabase, phone),
+            db_utils.get_chat_history_from_supabase_async(async_supabase, phone, limit=5),
+            db_utils.get_user_reminders_supabase_async(async_supabase, phone)
+        )
+
+        return JSONResponse(webhook_app.build_chat_stats_info(phone, stats, recent_messages, active_reminders))
+
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+# ==================== LIFESPAN ====================
+
+@asynccontextmanager
+async def lifespan(starlette_app: Starlette):
+    global async_supabase, green_api
+
+    green_api = AsyncGreenApiClient(webhook_app.GREEN_API_ID, webhook_app.GREEN_API_TOKEN,
+                                    max_in_flight=webhook_app.GREEN_API_MAX_IN_FLIGHT,
+                                    **webhook_app.GREEN_API_CLIENT_OPTIONS)
+    await green_api.start()
+    # Los recordatorios del scheduler también salen por este event loop
+    webhook_app.green_api_async = green_api
+    if webhook_app.SUPABASE_LOCAL:
+        async_supabase = local_supabase.AsyncLocalSupabaseClient(webhook_app.supabase)
+    elif webhook_app.SUPABASE_URL and webhook_app.SUPABASE_ANON_KEY:
+        async_supabase = await acreate_client(webhook_app.SUPABASE_URL, webhook_app.SUPABASE_ANON_KEY)
+
+    # Cargar recordatorios igual que `python app.py`
+    await asyncio.to_thread(webhook_app.initialize_system)
+
+    try:
+        yield
+    finally:
+        webhook_app.green_api_async = None
+        await green_api.aclose()
+
+app = Starlette(
+    routes=[
+        Route('/', home, methods=['GET']),
+        Route('/webhook', webhook, methods=['GET', 'POST']),
+        Route('/health', health_check, methods=['GET']),
+        Route('/queue_stats', get_queue_stats, methods=['GET']),
+        Route('/active_reminders', get_active_reminders, methods=['GET']),
+        Route('/chat_stats/{phone}', get_chat_stats, methods=['GET']),
+    ],
+    lifespan=lifespan
+)
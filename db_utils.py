@@ -3,54 +3,221 @@ Módulo para manejar las interacciones con la base de datos Supabase.
 Contiene funciones para chat, recordatorios y otras operaciones de persistencia.
 """
 
+import asyncio
+import json
+import os
+import re
+import threading
 import time
-from typing import Dict, List, Any, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Any, Optional
 from loguru import logger
-from supabase import Client
+from supabase import AsyncClient, Client
+
+from reminder_record import REMINDER_RECORD_COLUMNS
+from user_cache import ConversationCache, ReminderCache
+
+# ==================== SQL FUNCTIONS (RPC) ====================
+
+# Funciones SQL de migrations/ con su migración; si una no está instalada se usa
+# la versión anterior con varias consultas
+RPC_MIGRATIONS = {
+    "get_user_stats": "002_user_stats.sql",
+    "insert_chat_message": "003_chat_message_order.sql",
+    "insert_chat_messages": "004_chat_message_batch.sql",
+}
+
+# Códigos de PostgREST/Postgres para "la función no existe"
+_MISSING_FUNCTION_CODES = {"PGRST202", "42883"}
+
+_missing_rpcs = set()
+
+def rpc_available(function: str) -> bool:
+    return function not in _missing_rpcs
+
+def _handle_missing_rpc(function: str, error: Exception) -> bool:
+    """Devuelve True (y deja de llamar al RPC) si el error indica que la función no existe"""
+    if getattr(error, "code", None) not in _MISSING_FUNCTION_CODES:
+        return False
+    _missing_rpcs.add(function)
+    logger.warning(f"{function} SQL function not found, using fallback queries (apply migrations/{RPC_MIGRATIONS[function]})")
+    return True
+
+# ==================== SCHEMA CAPABILITIES ====================
+
+# Códigos de PostgREST/Postgres para "la columna no existe"
+_MISSING_COLUMN_CODES = {"PGRST204", "42703"}
+_MISSING_COLUMN_RE = re.compile(r"'(\w+)' column")
+
+class SchemaCapabilities:
+    """Columnas opcionales de la base, comprobadas una vez por proceso (al arrancar o en
+    el primer uso) en lugar de en cada escritura. Un error transitorio no se cachea."""
+
+    OPTIONAL_COLUMNS = {
+        "reminders": ("nickname", "display_name"),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns: Dict[tuple, bool] = {}
+
+    def detect(self, supabase: Client):
+        """Comprobar todas las columnas opcionales (llamado desde initialize_system)"""
+        for table, columns in self.OPTIONAL_COLUMNS.items():
+            for column in columns:
+                self.has_column(supabase, table, column)
+        logger.info(f"Schema capabilities: {self.as_dict()}")
+
+    def has_column(self, supabase: Client, table: str, column: str) -> bool:
+        key = (table, column)
+        known = self._columns.get(key)
+        if known is not None:
+            return known
+
+        with self._lock:
+            if key not in self._columns:
+                exists = self._probe(supabase, table, column)
+                if exists is None:
+                    # No se pudo comprobar: mantener el comportamiento anterior (usarla)
+                    return True
+                self._columns[key] = exists
+            return self._columns[key]
+
+    def mark_missing(self, table: str, column: str):
+        with self._lock:
+            self._columns[(table, column)] = False
+        logger.warning(f"Column {table}.{column} not found, writes will skip it")
+
+    def _probe(self, supabase: Client, table: str, column: str) -> Optional[bool]:
+        try:
+            supabase.table(table).select(column).limit(1).execute()
+            return True
+        except Exception as e:
+            if getattr(e, "code", None) in _MISSING_COLUMN_CODES:
+                logger.warning(f"Column {table}.{column} not found, writes will skip it")
+                return False
+            logger.warning(f"Could not check column {table}.{column}: {str(e)}")
+            return None
+
+    def as_dict(self) -> Dict[str, bool]:
+        with self._lock:
+            flags = {f"{table}.{column}": exists for (table, column), exists in self._columns.items()}
+        flags.update({f"rpc.{function}": rpc_available(function) for function in RPC_MIGRATIONS})
+        return flags
+
+schema = SchemaCapabilities()
+
+def _missing_column(error: Exception) -> Optional[str]:
+    """Nombre de la columna si el error de un insert es por una columna inexistente"""
+    if getattr(error, "code", None) not in _MISSING_COLUMN_CODES:
+        return None
+    match = _MISSING_COLUMN_RE.search(getattr(error, "message", None) or str(error))
+    return match.group(1) if match else None
 
 # ==================== CHAT HISTORY FUNCTIONS ====================
 
+def _new_session_id(user_phone: str) -> str:
+    return f"session_{user_phone}_{int(time.time())}"
+
+def _insert_chat_message_params(user_phone: str, role: str, content: str, session_id: str = None) -> Dict[str, Any]:
+    return {
+        "p_user_phone": user_phone,
+        "p_role": role,
+        "p_content": content,
+        "p_session_id": session_id or _new_session_id(user_phone)
+    }
+
+def _saved_message_id(user_phone: str, role: str, content: str, result) -> Optional[int]:
+    if result.data:
+        logger.info(f"Message saved for {user_phone}: {role} - {content[:50]}...")
+        return result.data[0]["id"]
+    logger.error(f"Failed to save message: {result}")
+    return None
+
+# Valor devuelto por save_message_to_supabase cuando el mensaje quedó en el journal de
+# escritura diferida: aún no tiene id de chat_history
+MESSAGE_QUEUED = "queued"
+
+def _queue_message(user_phone: str, role: str, content: str, session_id: str = None):
+    return MESSAGE_QUEUED if _write_buffer.append(user_phone, role, content, session_id) is not None else None
+
 def save_message_to_supabase(supabase: Client, user_phone: str, role: str, content: str, session_id: str = None):
-    """Guardar mensaje en el historial de Supabase"""
+    """Guardar mensaje en el historial de Supabase. Devuelve el id de chat_history, None si
+    falló o, con escritura diferida activa, MESSAGE_QUEUED (solo se anotó en el journal local)"""
     if not supabase:
         logger.error("Supabase not initialized")
         return None
-        
+    if _write_buffer:
+        message_id = _queue_message(user_phone, role, content, session_id)
+    else:
+        message_id = _insert_message(supabase, user_phone, role, content, session_id)
+    _update_history_cache(user_phone, role, content, message_id)
+    return message_id
+
+def _insert_message(supabase: Client, user_phone: str, role: str, content: str, session_id: str = None):
+    """Insertar un mensaje con una sola llamada (insert_chat_message)"""
     try:
-        result = supabase.table("chat_history").select("message_order").eq("user_phone", user_phone).order("message_order", desc=True).limit(1).execute()
-        
-        next_order = 1
-        if result.data:
-            next_order = result.data[0]["message_order"] + 1
-        
-        message_data = {
-            "user_phone": user_phone,
-            "role": role,
-            "content": content,
-            "message_order": next_order,
-            "session_id": session_id or f"session_{user_phone}_{int(time.time())}"
-        }
-        
-        insert_result = supabase.table("chat_history").insert(message_data).execute()
-        
-        if insert_result.data:
-            logger.info(f"Message saved for {user_phone}: {role} - {content[:50]}...")
-            return insert_result.data[0]["id"]
-        else:
-            logger.error(f"Failed to save message: {insert_result}")
-            return None
-            
+        return _insert_message_or_raise(supabase, user_phone, role, content, session_id)
     except Exception as e:
         logger.error(f"Error saving message to Supabase: {str(e)}")
         return None
 
+def _insert_message_or_raise(supabase: Client, user_phone: str, role: str, content: str, session_id: str = None):
+    """Como _insert_message, pero propaga el error de Supabase en lugar de devolver None"""
+    if rpc_available("insert_chat_message"):
+        try:
+            result = supabase.rpc("insert_chat_message", _insert_chat_message_params(user_phone, role, content, session_id)).execute()
+            return _saved_message_id(user_phone, role, content, result)
+        except Exception as e:
+            if not _handle_missing_rpc("insert_chat_message", e):
+                raise
+    return _save_message_legacy(supabase, user_phone, role, content, session_id)
+
+def _save_message_legacy(supabase: Client, user_phone: str, role: str, content: str, session_id: str = None):
+    """Leer el último message_order e insertar (dos llamadas, sin la migración 003). Propaga los errores"""
+    result = supabase.table("chat_history").select("message_order").eq("user_phone", user_phone).order("message_order", desc=True).limit(1).execute()
+    
+    next_order = 1
+    if result.data:
+        next_order = result.data[0]["message_order"] + 1
+    
+    message_data = {
+        "user_phone": user_phone,
+        "role": role,
+        "content": content,
+        "message_order": next_order,
+        "session_id": session_id or _new_session_id(user_phone)
+    }
+    
+    insert_result = supabase.table("chat_history").insert(message_data).execute()
+    return _saved_message_id(user_phone, role, content, insert_result)
+
+def _is_rejection(error: Exception) -> bool:
+    """True si Postgres/PostgREST respondió con un código de error (la fila fue rechazada),
+    False si no hubo respuesta (red caída, timeout): reintentar más tarde puede funcionar"""
+    return getattr(error, "code", None) is not None
+
 def get_chat_history_from_supabase(supabase: Client, user_phone: str, limit: int = 20):
-    """Obtener historial de chat desde Supabase"""
+    """Obtener historial de chat (de la caché si está activa, si no desde Supabase)"""
     if not supabase:
         return []
+    if _history_cache:
+        cached = _history_cache.get(user_phone, limit)
+        if cached is not None:
+            return cached
         
+    token = _history_cache.begin_load(user_phone) if _history_cache else None
+    history = None
     try:
-        result = supabase.table("chat_history").select("role, content, timestamp, message_order").eq("user_phone", user_phone).order("message_order", desc=True).limit(limit).execute()
+        for attempt in range(HISTORY_READ_ATTEMPTS):
+            pending = _write_buffer.pending_for(user_phone) if _write_buffer else []
+            result = supabase.table("chat_history").select("role, content, timestamp, message_order").eq("user_phone", user_phone).order("message_order", desc=True).limit(limit).execute()
+            if not _write_buffer or not _write_buffer.flushed_during_read(pending):
+                break
+        else:
+            pending = _write_buffer.pending_for(user_phone)
         
         if result.data:
             messages = result.data[::-1]
@@ -62,14 +229,20 @@ def get_chat_history_from_supabase(supabase: Client, user_phone: str, limit: int
                 })
             
             logger.info(f"Loaded {len(formatted_history)} messages for {user_phone}")
-            return formatted_history
         else:
             logger.info(f"No chat history found for {user_phone}")
-            return []
+            formatted_history = []
+        
+        history = merge_pending_messages(formatted_history, pending, limit)
+        return history
             
     except Exception as e:
         logger.error(f"Error loading chat history from Supabase: {str(e)}")
         return []
+    finally:
+        if _history_cache:
+            # Menos filas que el límite: la caché tiene todo el historial del usuario
+            _history_cache.finish_load(user_phone, token, history, complete=history is not None and len(history) < limit)
 
 def initialize_user_chat(supabase: Client, user_phone: str):
     """Inicializar chat para nuevo usuario"""
@@ -85,25 +258,55 @@ def initialize_user_chat(supabase: Client, user_phone: str):
     else:
         return existing_history
 
+def _user_stats_queries(supabase: Client, user_phone: str):
+    """Las tres consultas de estadísticas como callables independientes"""
+    return [
+        lambda: supabase.table("chat_history").select("id", count="exact").eq("user_phone", user_phone).execute(),
+        lambda: supabase.table("chat_history").select("created_at").eq("user_phone", user_phone).order("message_order", desc=False).limit(1).execute(),
+        lambda: supabase.table("chat_history").select("created_at").eq("user_phone", user_phone).order("message_order", desc=True).limit(1).execute()
+    ]
+
+def _build_user_stats(message_count_result, first_message_result, last_message_result) -> Dict[str, Any]:
+    return {
+        "total_messages": message_count_result.count or 0,
+        "first_interaction": first_message_result.data[0]["created_at"] if first_message_result.data else None,
+        "last_interaction": last_message_result.data[0]["created_at"] if last_message_result.data else None
+    }
+
 def get_user_stats(supabase: Client, user_phone: str):
     """Obtener estadísticas del usuario"""
     if not supabase:
         return {}
         
     try:
-        message_count_result = supabase.table("chat_history").select("id", count="exact").eq("user_phone", user_phone).execute()
-        first_message_result = supabase.table("chat_history").select("created_at").eq("user_phone", user_phone).order("message_order", desc=False).limit(1).execute()
-        last_message_result = supabase.table("chat_history").select("created_at").eq("user_phone", user_phone).order("message_order", desc=True).limit(1).execute()
-        
-        stats = {
-            "total_messages": message_count_result.count or 0,
-            "first_interaction": first_message_result.data[0]["created_at"] if first_message_result.data else None,
-            "last_interaction": last_message_result.data[0]["created_at"] if last_message_result.data else None
-        }
+        return _build_user_stats(*[query() for query in _user_stats_queries(supabase, user_phone)])
         
-        return stats
+    except Exception as e:
+        logger.error(f"Error getting user stats: {str(e)}")
+        return {}
+
+def _build_user_stats_from_rpc(rpc_result) -> Dict[str, Any]:
+    row = rpc_result.data[0] if rpc_result.data else {}
+    return {
+        "total_messages": row.get("total_messages") or 0,
+        "first_interaction": row.get("first_interaction"),
+        "last_interaction": row.get("last_interaction")
+    }
+
+def get_user_stats_rpc(supabase: Client, user_phone: str):
+    """Obtener estadísticas del usuario con una sola consulta (mismo formato que get_user_stats)"""
+    if not supabase:
+        return {}
+    if not rpc_available("get_user_stats"):
+        return get_user_stats(supabase, user_phone)
+        
+    try:
+        result = supabase.rpc("get_user_stats", {"p_user_phone": user_phone}).execute()
+        return _build_user_stats_from_rpc(result)
         
     except Exception as e:
+        if _handle_missing_rpc("get_user_stats", e):
+            return get_user_stats(supabase, user_phone)
         logger.error(f"Error getting user stats: {str(e)}")
         return {}
 
@@ -165,6 +368,53 @@ def get_user_stats(supabase: Client, user_phone: str):
 #        logger.error(f"Data attempted to save: {data if 'data' in locals() else 'N/A'}")
 #        return None
 
+def _build_reminder_row(supabase: Client, user_phone: str, reminder_type: str, message: str,
+                        display_name: str = "", interval_minutes: float = None,
+                        cron_expression: str = None, nickname: str = None) -> Optional[Dict[str, Any]]:
+    """Fila para la tabla reminders, o None si el intervalo no es válido"""
+    # Convertir a float y validar
+    if interval_minutes is not None:
+        interval_minutes = float(interval_minutes)
+        # Validar que el intervalo sea razonable
+        if interval_minutes <= 0:
+            logger.error(f"Invalid interval_minutes: {interval_minutes}")
+            return None
+        # Redondear a 2 decimales para evitar problemas de precisión
+        interval_minutes = round(interval_minutes, 2)
+    
+    # Preparar datos básicos
+    data = {
+        "user_phone": user_phone,
+        "reminder_type": reminder_type,
+        "message": message,
+        "interval_minutes": interval_minutes,
+        "cron_expression": cron_expression,
+        "is_active": True,
+        "timezone": "America/Mexico_City"
+    }
+    
+    # Añadir nickname y display_name si las columnas existen (comprobado una vez por proceso)
+    if nickname and schema.has_column(supabase, "reminders", "nickname"):
+        data["nickname"] = nickname
+    if display_name and schema.has_column(supabase, "reminders", "display_name"):
+        data["display_name"] = display_name
+    
+    return data
+
+def _insert_reminder_rows(supabase: Client, rows: List[Dict[str, Any]]):
+    """Insertar filas de recordatorios en una sola llamada; si una columna opcional
+    desapareció después de comprobarla, se reintenta sin ella"""
+    try:
+        return supabase.table("reminders").insert(rows).execute()
+    except Exception as insert_error:
+        column = _missing_column(insert_error)
+        if column not in ("nickname", "display_name") or not any(column in row for row in rows):
+            raise
+        schema.mark_missing("reminders", column)
+        for row in rows:
+            row.pop(column, None)
+        return supabase.table("reminders").insert(rows).execute()
+
 def save_reminder_supabase(supabase: Client, user_phone: str, reminder_type: str, message: str, 
                           display_name: str = "", interval_minutes: float = None, 
                           cron_expression: str = None, nickname: str = None):
@@ -174,47 +424,20 @@ def save_reminder_supabase(supabase: Client, user_phone: str, reminder_type: str
         return None
         
     try:
-        # Convertir a float y validar
-        if interval_minutes is not None:
-            interval_minutes = float(interval_minutes)
-            # Validar que el intervalo sea razonable
-            if interval_minutes <= 0:
-                logger.error(f"Invalid interval_minutes: {interval_minutes}")
-                return None
-            # Redondear a 2 decimales para evitar problemas de precisión
-            interval_minutes = round(interval_minutes, 2)
-        
-        # Preparar datos básicos
-        data = {
-            "user_phone": user_phone,
-            "reminder_type": reminder_type,
-            "message": message,
-            "interval_minutes": interval_minutes,
-            "cron_expression": cron_expression,
-            "is_active": True,
-            "timezone": "America/Mexico_City"
-        }
-        
-        # Añadir nickname si se proporciona
-        if nickname:
-            data["nickname"] = nickname
-        
-        # Intentar añadir display_name si la columna existe
-        if display_name:
-            try:
-                # Comprobar si la columna display_name existe
-                check_column = supabase.table("reminders").select("count(*)").limit(1).execute()
-                data["display_name"] = display_name
-            except Exception as column_error:
-                logger.warning(f"display_name column might not exist, continuing without it: {column_error}")
+        data = _build_reminder_row(supabase, user_phone, reminder_type, message, display_name,
+                                   interval_minutes, cron_expression, nickname)
+        if data is None:
+            return None
         
-        logger.info(f"Attempting to save reminder with interval_minutes: {interval_minutes} (type: {type(interval_minutes)})")
+        logger.info(f"Attempting to save reminder with interval_minutes: {data['interval_minutes']} (type: {type(data['interval_minutes'])})")
         logger.info(f"Reminder data: {data}")
         
-        result = supabase.table("reminders").insert(data).execute()
+        result = _insert_reminder_rows(supabase, [data])
         
         if result.data:
-            logger.info(f"Reminder saved successfully for {user_phone}: {reminder_type} - {interval_minutes} minutes")
+            logger.info(f"Reminder saved successfully for {user_phone}: {reminder_type} - {data['interval_minutes']} minutes")
+            if _reminder_cache:
+                _reminder_cache.add(user_phone, result.data[0])
             return result.data[0]["id"]
         else:
             logger.error(f"Failed to save reminder - Supabase response: {result}")
@@ -223,8 +446,57 @@ def save_reminder_supabase(supabase: Client, user_phone: str, reminder_type: str
     except Exception as e:
         logger.error(f"Error saving reminder to Supabase: {str(e)}")
         logger.error(f"Data attempted to save: {data if 'data' in locals() else 'N/A'}")
+        if _reminder_cache:
+            # El insert pudo haberse aplicado aunque la respuesta fallara
+            _reminder_cache.invalidate(user_phone)
         return None
 
+def save_reminders_supabase(supabase: Client, reminders: List[Dict[str, Any]]) -> List[Optional[int]]:
+    """Guardar varios recordatorios (p. ej. uno por horario) con un solo insert.
+    Cada elemento lleva los mismos argumentos que save_reminder_supabase.
+    Devuelve los IDs en el mismo orden (None para los recordatorios no válidos)."""
+    if not supabase:
+        logger.error("Supabase not initialized")
+        return [None] * len(reminders)
+    
+    user_phones = {reminder["user_phone"] for reminder in reminders}
+    try:
+        rows = [_build_reminder_row(supabase, **reminder) for reminder in reminders]
+        valid_rows = [row for row in rows if row is not None]
+        if not valid_rows:
+            return [None] * len(reminders)
+        
+        # PostgREST exige las mismas claves en todas las filas de un insert múltiple
+        columns = {column for row in valid_rows for column in row}
+        for row in valid_rows:
+            for column in columns:
+                row.setdefault(column, None)
+        
+        result = _insert_reminder_rows(supabase, valid_rows)
+        
+        if not result.data or len(result.data) != len(valid_rows):
+            logger.error(f"Failed to save {len(valid_rows)} reminders - Supabase response: {result}")
+            if _reminder_cache:
+                for user_phone in user_phones:
+                    _reminder_cache.invalidate(user_phone)
+            return [None] * len(reminders)
+        
+        logger.info(f"Saved {len(result.data)} reminders in one insert for {', '.join(sorted(user_phones))}")
+        if _reminder_cache:
+            for saved in result.data:
+                _reminder_cache.add(saved["user_phone"], saved)
+        
+        # PostgREST devuelve las filas insertadas en el orden enviado
+        saved_ids = iter([saved["id"] for saved in result.data])
+        return [next(saved_ids) if row is not None else None for row in rows]
+            
+    except Exception as e:
+        logger.error(f"Error saving reminders to Supabase: {str(e)}")
+        if _reminder_cache:
+            for user_phone in user_phones:
+                _reminder_cache.invalidate(user_phone)
+        return [None] * len(reminders)
+
 #def get_user_reminders_supabase(supabase: Client, user_phone: str):
 #    """Obtener recordatorios de un usuario específico"""
 #    if not supabase:
@@ -243,24 +515,34 @@ def save_reminder_supabase(supabase: Client, user_phone: str, reminder_type: str
 #        return []
 
 def get_user_reminders_supabase(supabase: Client, user_phone: str):
-    """Obtener recordatorios activos de un usuario específico"""
+    """Obtener recordatorios activos de un usuario específico (de la caché si está activa)"""
     if not supabase:
         return []
+    if _reminder_cache:
+        cached = _reminder_cache.get(user_phone)
+        if cached is not None:
+            return cached
         
+    token = _reminder_cache.begin_load(user_phone) if _reminder_cache else None
+    reminders = None
     try:
         # Verificación explícita de que solo se obtienen recordatorios activos
         result = supabase.table("reminders").select("*").eq("user_phone", user_phone).eq("is_active", True).execute()
         
         if result.data:
             logger.info(f"Found {len(result.data)} active reminders for {user_phone}")
-            return result.data
+            reminders = result.data
         else:
             logger.info(f"No active reminders found for {user_phone}")
-            return []
+            reminders = []
+        return reminders
             
     except Exception as e:
         logger.error(f"Error getting user reminders: {str(e)}")
         return []
+    finally:
+        if _reminder_cache:
+            _reminder_cache.finish_load(user_phone, token, reminders)
 
 def deactivate_reminder_supabase(supabase: Client, user_phone: str, reminder_id: int):
     """Desactivar un recordatorio específico por ID"""
@@ -273,13 +555,20 @@ def deactivate_reminder_supabase(supabase: Client, user_phone: str, reminder_id:
         
         if result.data and len(result.data) > 0:
             logger.info(f"Deactivated reminder ID {reminder_id} for {user_phone}")
+            if _reminder_cache:
+                _reminder_cache.remove(user_phone, reminder_id)
             return True
         else:
             logger.warning(f"No reminder found to deactivate with ID {reminder_id} for {user_phone}")
+            if _reminder_cache:
+                # La caché mostraba un recordatorio que la base no tiene
+                _reminder_cache.invalidate(user_phone)
             return False
             
     except Exception as e:
         logger.error(f"Error deactivating reminder: {str(e)}")
+        if _reminder_cache:
+            _reminder_cache.invalidate(user_phone)
         return False
 
 def deactivate_all_reminders_supabase(supabase: Client, user_phone: str):
@@ -292,27 +581,721 @@ def deactivate_all_reminders_supabase(supabase: Client, user_phone: str):
         
         count = len(result.data) if result.data else 0
         logger.info(f"Deactivated {count} reminders for {user_phone}")
+        if _reminder_cache:
+            _reminder_cache.remove_all(user_phone)
         return count
             
     except Exception as e:
         logger.error(f"Error deactivating all reminders: {str(e)}")
+        if _reminder_cache:
+            _reminder_cache.invalidate(user_phone)
         return 0
 
+def _reminder_record_columns(supabase: Client) -> str:
+    """Columnas de ReminderRecord, sin las opcionales que no existen en la tabla"""
+    optional = SchemaCapabilities.OPTIONAL_COLUMNS["reminders"]
+    return ", ".join(column for column in REMINDER_RECORD_COLUMNS
+                     if column not in optional or schema.has_column(supabase, "reminders", column))
+
+def iter_active_reminder_pages(supabase: Client, page_size: int = 1000, columns: Optional[str] = None,
+                               retries: int = 3) -> Iterator[List[Dict[str, Any]]]:
+    """Recorrer los recordatorios activos por páginas ordenadas por id (keyset:
+    cada página pide id > último id visto, sin OFFSET ni límite de filas de PostgREST).
+    Por defecto solo pide las columnas de ReminderRecord. Si una página sigue fallando
+    tras `retries` intentos se propaga el error: una carga a medias no debe pasar por completa"""
+    if not supabase:
+        return
+
+    columns = columns or _reminder_record_columns(supabase)
+    last_id = None
+    while True:
+        for attempt in range(retries):
+            try:
+                query = supabase.table("reminders").select(columns).eq("is_active", True)
+                if last_id is not None:
+                    query = query.gt("id", last_id)
+                rows = query.order("id").limit(page_size).execute().data or []
+                break
+            except Exception as e:
+                logger.warning(f"Error loading reminders after id {last_id} (attempt {attempt + 1}/{retries}): {str(e)}")
+                if attempt + 1 == retries:
+                    logger.error(f"Giving up loading reminders after id {last_id}")
+                    raise
+                time.sleep(2 ** attempt)
+
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
 def load_reminders_supabase(supabase: Client):
     """Cargar todos los recordatorios activos desde Supabase"""
+    try:
+        reminders = [row for page in iter_active_reminder_pages(supabase, columns="*") for row in page]
+    except Exception as e:
+        logger.error(f"Error loading reminders from Supabase: {str(e)}")
+        return []
+    
+    if reminders:
+        logger.info(f"Loaded {len(reminders)} active reminders from Supabase")
+    else:
+        logger.info("No active reminders found in Supabase")
+    return reminders
+
+# ==================== CHAT WRITE-BEHIND ====================
+
+class ChatWriteBuffer:
+    """Escritura diferida de chat_history.
+    Cada mensaje se anota en un journal local (JSON lines) antes de devolver el control
+    y un hilo lo inserta en Supabase por lotes cada flush_interval_ms o al juntar
+    max_batch mensajes. Al arrancar se reenvía lo que quedó en el journal tras una caída.
+
+    El journal se escribe en segmentos de segment_size mensajes (<journal>.000001, ...)
+    y <journal>.checkpoint guarda la secuencia del último mensaje confirmado: tras cada
+    lote solo se actualiza el checkpoint y se borran los segmentos ya confirmados, sin
+    reescribir lo pendiente. Un mensaje que Supabase rechaza max_attempts veces pasa a
+    <journal>.dead para no bloquear a los demás. Con max_pending mensajes sin confirmar,
+    append() no acepta más y devuelve None, como un guardado fallido."""
+
+    def __init__(self, supabase: Client, journal_path: str, flush_interval_ms: float = 200,
+                 max_batch: int = 50, fsync: bool = False, max_backoff_seconds: float = 30.0,
+                 max_attempts: int = 5, max_pending: int = 10000, segment_size: int = 1000):
+        self.supabase = supabase
+        self.journal_path = journal_path
+        self.checkpoint_path = f"{journal_path}.checkpoint"
+        self.dead_letter_path = f"{journal_path}.dead"
+        self.flush_interval = max(0.01, float(flush_interval_ms) / 1000)
+        self.max_batch = max(1, int(max_batch))
+        self.fsync = fsync
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_attempts = max(1, int(max_attempts))
+        self.max_pending = max(self.max_batch, int(max_pending))
+        self.segment_size = max(1, int(segment_size))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending: List[Dict[str, Any]] = []
+        self._journal = None
+        self._thread = None
+        self._running = False
+        self._next_seq = 1
+        self._consecutive_failures = 0
+
+        # Segmentos cerrados (ruta, última secuencia) y segmento activo
+        self._segments: List[tuple] = []
+        self._segment_index = 0
+        self._segment_path = None
+        self._segment_count = 0
+        self._segment_last_seq = 0
+
+        # Secuencia del último mensaje retirado del buffer (insertado o descartado) y
+        # última secuencia del lote que se está insertando (0 si no hay ninguno)
+        self._flushed_seq = 0
+        self._inflight_seq = 0
+
+        # Métricas
+        self._appended = 0
+        self._flushed = 0
+        self._batches = 0
+        self._failures = 0
+        self._recovered = 0
+        self._dropped = 0
+        self._dead_lettered = 0
+        self._last_flush_ms = 0.0
+        self._last_error = None
+
+    def start(self):
+        """Recuperar el journal pendiente y arrancar el hilo de volcado"""
+        with self._lock:
+            if self._running:
+                return
+            self._recover()
+            self._open_segment()
+            self._running = True
+            obsolete = self._take_flushed_segments()
+        self._remove_files(obsolete)
+
+        self._thread = threading.Thread(target=self._flush_loop, name="chat-write-behind", daemon=True)
+        self._thread.start()
+        logger.info(f"Chat write-behind started (journal: {self.journal_path}, every {self.flush_interval * 1000:.0f} ms or {self.max_batch} rows)")
+
+    def stop(self, timeout: float = 10.0):
+        """Detener el hilo y volcar lo pendiente; lo que no se pueda escribir queda en el journal"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self.flush()
+
+        with self._lock:
+            self._journal.close()
+            self._journal = None
+        logger.info(f"Chat write-behind stopped ({len(self._pending)} messages left in journal)")
+
+    def append(self, user_phone: str, role: str, content: str, session_id: str = None) -> Optional[int]:
+        """Anotar un mensaje en el journal. Devuelve su número de secuencia local,
+        o None si el buffer está lleno (Supabase lleva demasiado tiempo sin aceptar escrituras)"""
+        entry = {
+            "user_phone": user_phone,
+            "role": role,
+            "content": content,
+            "session_id": session_id or _new_session_id(user_phone)
+        }
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._dropped += 1
+                entry = None
+            else:
+                entry["seq"] = self._next_seq
+                self._next_seq += 1
+                self._write_journal([entry])
+                self._pending.append(entry)
+                self._appended += 1
+                self._segment_count += 1
+                self._segment_last_seq = entry["seq"]
+                if self._segment_count >= self.segment_size:
+                    self._rotate_segment()
+            batch_ready = len(self._pending) >= self.max_batch
+
+        if entry is None:
+            logger.error(f"Chat write-behind full ({self.max_pending} pending), message from {user_phone} not saved")
+            return None
+        if batch_ready:
+            self._wakeup.set()
+        return entry["seq"]
+
+    def pending_for(self, user_phone: str) -> List[Dict[str, Any]]:
+        """Mensajes del usuario todavía no confirmados en Supabase, en orden"""
+        with self._lock:
+            return [entry for entry in self._pending if entry["user_phone"] == user_phone]
+
+    def flushed_during_read(self, pending: List[Dict[str, Any]]) -> bool:
+        """True si algún mensaje de `pending` (tomado con pending_for justo antes de leer
+        chat_history) se confirmó o se está confirmando: la lectura pudo incluirlo o no.
+        Si es False, la lectura y `pending` no se solapan y basta con concatenarlos."""
+        if not pending:
+            return False
+        first_seq = pending[0]["seq"]
+        with self._lock:
+            return self._flushed_seq >= first_seq or self._inflight_seq >= first_seq
+
+    def flush(self) -> int:
+        """Insertar en Supabase todo lo pendiente, en orden. Devuelve los mensajes escritos"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[:self.max_batch]
+                    if batch:
+                        self._inflight_seq = batch[-1]["seq"]
+                if not batch:
+                    break
+
+                start = time.monotonic()
+                inserted, rejected, error = self._insert_batch(batch)
+                dead = None
+                with self._lock:
+                    if inserted:
+                        # Solo este hilo retira entradas y append() añade al final
+                        del self._pending[:inserted]
+                        self._flushed_seq = batch[inserted - 1]["seq"]
+                        self._flushed += inserted
+                        self._batches += 1
+                        self._last_flush_ms = (time.monotonic() - start) * 1000
+                    if inserted < len(batch):
+                        self._failures += 1
+                        self._last_error = error
+                        head = batch[inserted]
+                        if rejected:
+                            head["attempts"] = head.get("attempts", 0) + 1
+                            if head["attempts"] >= self.max_attempts:
+                                del self._pending[0]
+                                self._flushed_seq = head["seq"]
+                                self._dead_lettered += 1
+                                dead = head
+                    self._inflight_seq = 0
+                written += inserted
+
+                if dead:
+                    self._write_dead_letter(dead, error)
+                if inserted or dead:
+                    self._write_checkpoint()
+                if inserted < len(batch) and not dead:
+                    self._consecutive_failures += 1
+                    break
+                self._consecutive_failures = 0
+
+            with self._lock:
+                if not self._pending and self._segment_count and self._journal is not None:
+                    # Todo confirmado: cerrar el segmento activo para poder borrarlo
+                    self._rotate_segment()
+                obsolete = self._take_flushed_segments()
+            self._remove_files(obsolete)
+        return written
+
+    def _insert_batch(self, batch: List[Dict[str, Any]]) -> tuple:
+        """Insertar un lote. Devuelve (mensajes del principio escritos, si Supabase rechazó
+        el siguiente, error)"""
+        rows = [{key: entry[key] for key in ("user_phone", "role", "content", "session_id")} for entry in batch]
+
+        if rpc_available("insert_chat_messages"):
+            try:
+                self.supabase.rpc("insert_chat_messages", {"p_messages": rows}).execute()
+                return len(batch), False, None
+            except Exception as e:
+                if not _handle_missing_rpc("insert_chat_messages", e):
+                    logger.error(f"Error flushing {len(batch)} chat messages: {str(e)}")
+                    if not _is_rejection(e) or len(batch) == 1:
+                        return 0, _is_rejection(e), str(e)
+                    # El lote se deshizo entero: fila a fila para aislar el mensaje rechazado
+
+        # Un insert por mensaje, parando en el primer fallo
+        for count, row in enumerate(rows):
+            try:
+                message_id = _insert_message_or_raise(self.supabase, row["user_phone"], row["role"], row["content"], row["session_id"])
+            except Exception as e:
+                logger.error(f"Error flushing chat message for {row['user_phone']}: {str(e)}")
+                return count, _is_rejection(e), str(e)
+            if message_id is None:
+                return count, True, f"insert returned no row for {row['user_phone']}"
+        return len(rows), False, None
+
+    def _flush_loop(self):
+        while self._running:
+            delay = self.flush_interval
+            if self._consecutive_failures:
+                delay = min(self.max_backoff_seconds, self.flush_interval * 2 ** self._consecutive_failures)
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Unexpected error in chat write-behind: {str(e)}")
+
+    # --- journal ---
+    def _write_journal(self, entries: List[Dict[str, Any]]):
+        for entry in entries:
+            self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _open_segment(self):
+        self._segment_index += 1
+        self._segment_path = f"{self.journal_path}.{self._segment_index:06d}"
+        self._segment_count = 0
+        self._segment_last_seq = 0
+        self._journal = open(self._segment_path, "a", encoding="utf-8")
+
+    def _rotate_segment(self):
+        """Cerrar el segmento activo y abrir el siguiente (llamar con _lock tomado)"""
+        self._journal.close()
+        self._segments.append((self._segment_path, self._segment_last_seq))
+        self._open_segment()
+
+    def _take_flushed_segments(self) -> List[str]:
+        """Quitar de la lista los segmentos cerrados ya confirmados (llamar con _lock tomado)"""
+        obsolete = [path for path, last_seq in self._segments if last_seq <= self._flushed_seq]
+        self._segments = [(path, last_seq) for path, last_seq in self._segments if last_seq > self._flushed_seq]
+        return obsolete
+
+    @staticmethod
+    def _remove_files(paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove chat journal segment {path}: {str(e)}")
+
+    def _write_checkpoint(self):
+        """Guardar la secuencia del último mensaje retirado (escritura atómica, tamaño fijo)"""
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as tmp:
+            tmp.write(str(self._flushed_seq))
+            tmp.flush()
+            if self.fsync:
+                os.fsync(tmp.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _write_dead_letter(self, entry: Dict[str, Any], error: Optional[str]):
+        logger.error(f"Chat message {entry['seq']} for {entry['user_phone']} rejected {entry['attempts']} times, moved to {self.dead_letter_path}: {error}")
+        with open(self.dead_letter_path, "a", encoding="utf-8") as dead:
+            dead.write(json.dumps(dict(entry, error=error), ensure_ascii=False) + "\n")
+
+    def _journal_segments(self) -> List[str]:
+        """Segmentos existentes en orden; el journal de un solo archivo de versiones anteriores va primero"""
+        directory = os.path.dirname(self.journal_path) or "."
+        prefix = os.path.basename(self.journal_path) + "."
+        numbered = sorted(name for name in os.listdir(directory)
+                          if name.startswith(prefix) and name[len(prefix):].isdigit())
+        if numbered:
+            self._segment_index = int(numbered[-1][len(prefix):])
+        paths = [os.path.join(directory, name) for name in numbered]
+        if os.path.exists(self.journal_path):
+            paths.insert(0, self.journal_path)
+        return paths
+
+    def _recover(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as checkpoint:
+                self._flushed_seq = int(checkpoint.read().strip() or 0)
+
+        for path in self._journal_segments():
+            last_seq = 0
+            with open(path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Última línea a medio escribir durante una caída
+                        logger.warning(f"Skipping corrupt chat journal line: {line[:80]!r}")
+                        continue
+                    seq = entry.get("seq", 0)
+                    last_seq = max(last_seq, seq)
+                    if seq > self._flushed_seq:
+                        self._pending.append(entry)
+            self._segments.append((path, last_seq))
+            self._next_seq = max(self._next_seq, last_seq + 1)
+        self._next_seq = max(self._next_seq, self._flushed_seq + 1)
+
+        self._recovered = len(self._pending)
+        if self._recovered:
+            logger.info(f"Recovered {self._recovered} unsent chat messages from {self.journal_path}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._running,
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "appended": self._appended,
+                "flushed": self._flushed,
+                "batches": self._batches,
+                "failures": self._failures,
+                "dropped": self._dropped,
+                "dead_lettered": self._dead_lettered,
+                "recovered": self._recovered,
+                "journal_segments": len(self._segments) + (1 if self._journal is not None else 0),
+                "last_flush_ms": round(self._last_flush_ms, 2),
+                "last_error": self._last_error,
+                "journal_path": self.journal_path
+            }
+
+
+_write_buffer: Optional[ChatWriteBuffer] = None
+
+def enable_write_behind(buffer: Optional[ChatWriteBuffer]):
+    """Enviar los guardados de mensajes a un ChatWriteBuffer (None lo desactiva)"""
+    global _write_buffer
+    _write_buffer = buffer
+
+# Lecturas del historial si un lote del usuario se confirma mientras se lee; tras el último
+# intento lo que ya salió del buffer se da por incluido en la lectura
+HISTORY_READ_ATTEMPTS = 3
+
+def merge_pending_messages(history: List[Dict[str, str]], pending: List[Dict[str, Any]], limit: int) -> List[Dict[str, str]]:
+    """Añadir al historial leído de Supabase los mensajes aún en el buffer.
+    `pending` debe ser disjunto de la lectura (ver ChatWriteBuffer.flushed_during_read):
+    los mensajes se comparan por secuencia, no por contenido, así que dos turnos
+    iguales seguidos ("gracias" / "De nada") se conservan."""
+    merged = history + [{"role": entry["role"], "content": entry["content"]} for entry in pending]
+    return merged[-limit:] if limit else merged
+
+# ==================== USER CACHES ====================
+
+_history_cache: Optional[ConversationCache] = None
+
+def enable_history_cache(cache: Optional[ConversationCache]):
+    """Servir el historial reciente desde una ConversationCache (None la desactiva)"""
+    global _history_cache
+    _history_cache = cache
+
+_reminder_cache: Optional[ReminderCache] = None
+
+def enable_reminder_cache(cache: Optional[ReminderCache]):
+    """Servir los recordatorios activos desde una ReminderCache (None la desactiva)"""
+    global _reminder_cache
+    _reminder_cache = cache
+
+def _update_history_cache(user_phone: str, role: str, content: str, message_id):
+    if not _history_cache:
+        return
+    if message_id is None:
+        # No sabemos qué quedó en Supabase: la próxima lectura irá a la base
+        _history_cache.invalidate(user_phone)
+    else:
+        _history_cache.append(user_phone, role, content)
+
+# ==================== MESSAGE CONTEXT ====================
+
+# Pool para lanzar en paralelo las lecturas del contexto de un mensaje
+_read_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="supabase-read")
+
+@dataclass
+class UserContext:
+    """Estadísticas y recordatorios activos que personalizan una respuesta de IA"""
+    user_stats: Dict[str, Any] = field(default_factory=dict)
+    active_reminders: List[Dict[str, Any]] = field(default_factory=list)
+
+class PendingUserContext:
+    """Lecturas de UserContext ya lanzadas en _read_pool; result() espera a que terminen"""
+    
+    def __init__(self, reminders_future: Optional[Future] = None, stats_futures: Optional[List[Future]] = None,
+                 from_rpc: bool = False):
+        self._reminders_future = reminders_future
+        self._stats_futures = stats_futures or []
+        self._from_rpc = from_rpc
+    
+    def result(self) -> UserContext:
+        if self._reminders_future is None:
+            return UserContext()
+        
+        if self._from_rpc:
+            user_stats = self._stats_futures[0].result()
+        else:
+            try:
+                user_stats = _build_user_stats(*[future.result() for future in self._stats_futures])
+            except Exception as e:
+                logger.error(f"Error getting user stats: {str(e)}")
+                user_stats = {}
+        
+        return UserContext(user_stats=user_stats, active_reminders=self._reminders_future.result())
+    
+    def cancel(self):
+        """Descartar las lecturas (p. ej. el mensaje resultó no ser para la IA)"""
+        for future in [self._reminders_future, *self._stats_futures]:
+            if future is not None:
+                future.cancel()
+
+def start_user_context(supabase: Client, user_phone: str) -> PendingUserContext:
+    """Lanzar en paralelo las consultas de estadísticas y recordatorios sin esperarlas,
+    para solaparlas con otras lecturas del mensaje (como el historial)"""
+    if not supabase:
+        return PendingUserContext()
+    
+    reminders_future = _read_pool.submit(get_user_reminders_supabase, supabase, user_phone)
+    
+    if rpc_available("get_user_stats"):
+        return PendingUserContext(reminders_future, [_read_pool.submit(get_user_stats_rpc, supabase, user_phone)],
+                                  from_rpc=True)
+    
+    stats_futures = [_read_pool.submit(query) for query in _user_stats_queries(supabase, user_phone)]
+    return PendingUserContext(reminders_future, stats_futures)
+
+def load_user_context(supabase: Client, user_phone: str) -> UserContext:
+    """Cargar estadísticas y recordatorios con las consultas en paralelo.
+    Solo hace falta para las respuestas de IA; la latencia queda acotada por la
+    consulta más lenta en lugar de la suma."""
+    return start_user_context(supabase, user_phone).result()
+
+# ==================== WEBHOOK DEDUP FUNCTIONS ====================
+
+def claim_webhook_message(supabase: Client, id_message: str) -> Optional[bool]:
+    """Registrar un idMessage procesado. True si es nuevo, False si ya existía, None si hubo error"""
+    if not supabase:
+        return None
+        
+    try:
+        # ignore_duplicates devuelve filas solo cuando la inserción ocurrió realmente
+        result = supabase.table("processed_webhooks").upsert(
+            {"id_message": id_message},
+            on_conflict="id_message",
+            ignore_duplicates=True
+        ).execute()
+        
+        return bool(result.data)
+        
+    except Exception as e:
+        logger.error(f"Error claiming webhook message {id_message}: {str(e)}")
+        return None
+
+def release_webhook_message(supabase: Client, id_message: str):
+    """Eliminar un idMessage registrado para permitir que se vuelva a procesar"""
+    if not supabase:
+        return False
+        
+    try:
+        supabase.table("processed_webhooks").delete().eq("id_message", id_message).execute()
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error releasing webhook message {id_message}: {str(e)}")
+        return False
+
+def prune_webhook_messages(supabase: Client, older_than_seconds: float) -> Optional[int]:
+    """Eliminar los idMessage registrados hace más de `older_than_seconds`. Devuelve cuántos, o None si hubo error"""
+    if not supabase:
+        return None
+        
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than_seconds)
+        result = supabase.table("processed_webhooks").delete().lt("created_at", cutoff.isoformat()).execute()
+        return len(result.data or [])
+        
+    except Exception as e:
+        logger.error(f"Error pruning processed webhooks: {str(e)}")
+        return None
+
+# ==================== ASYNC FUNCTIONS ====================
+# Equivalentes asíncronos usados por el punto de entrada ASGI (asgi_app.py)
+
+async def save_message_to_supabase_async(supabase: AsyncClient, user_phone: str, role: str, content: str, session_id: str = None):
+    """Guardar mensaje en el historial de Supabase (cliente asíncrono, mismos valores de retorno)"""
+    if not supabase:
+        logger.error("Supabase not initialized")
+        return None
+    if _write_buffer:
+        message_id = _queue_message(user_phone, role, content, session_id)
+    else:
+        message_id = await _insert_message_async(supabase, user_phone, role, content, session_id)
+    _update_history_cache(user_phone, role, content, message_id)
+    return message_id
+
+async def _insert_message_async(supabase: AsyncClient, user_phone: str, role: str, content: str, session_id: str = None):
+    if not rpc_available("insert_chat_message"):
+        return await _save_message_legacy_async(supabase, user_phone, role, content, session_id)
+        
+    try:
+        result = await supabase.rpc("insert_chat_message", _insert_chat_message_params(user_phone, role, content, session_id)).execute()
+        return _saved_message_id(user_phone, role, content, result)
+            
+    except Exception as e:
+        if _handle_missing_rpc("insert_chat_message", e):
+            return await _save_message_legacy_async(supabase, user_phone, role, content, session_id)
+        logger.error(f"Error saving message to Supabase: {str(e)}")
+        return None
+
+async def _save_message_legacy_async(supabase: AsyncClient, user_phone: str, role: str, content: str, session_id: str = None):
+    try:
+        result = await supabase.table("chat_history").select("message_order").eq("user_phone", user_phone).order("message_order", desc=True).limit(1).execute()
+        
+        next_order = 1
+        if result.data:
+            next_order = result.data[0]["message_order"] + 1
+        
+        message_data = {
+            "user_phone": user_phone,
+            "role": role,
+            "content": content,
+            "message_order": next_order,
+            "session_id": session_id or _new_session_id(user_phone)
+        }
+        
+        insert_result = await supabase.table("chat_history").insert(message_data).execute()
+        return _saved_message_id(user_phone, role, content, insert_result)
+            
+    except Exception as e:
+        logger.error(f"Error saving message to Supabase: {str(e)}")
+        return None
+
+async def get_chat_history_from_supabase_async(supabase: AsyncClient, user_phone: str, limit: int = 20):
+    """Obtener historial de chat (caché o Supabase con el cliente asíncrono)"""
     if not supabase:
         return []
+    if _history_cache:
+        cached = _history_cache.get(user_phone, limit)
+        if cached is not None:
+            return cached
         
+    token = _history_cache.begin_load(user_phone) if _history_cache else None
+    history = None
     try:
-        result = supabase.table("reminders").select("*").eq("is_active", True).execute()
+        for attempt in range(HISTORY_READ_ATTEMPTS):
+            pending = _write_buffer.pending_for(user_phone) if _write_buffer else []
+            result = await supabase.table("chat_history").select("role, content, timestamp, message_order").eq("user_phone", user_phone).order("message_order", desc=True).limit(limit).execute()
+            if not _write_buffer or not _write_buffer.flushed_during_read(pending):
+                break
+        else:
+            pending = _write_buffer.pending_for(user_phone)
         
         if result.data:
-            logger.info(f"Loaded {len(result.data)} active reminders from Supabase")
-            return result.data
+            formatted_history = [{"role": msg["role"], "content": msg["content"]} for msg in result.data[::-1]]
+            logger.info(f"Loaded {len(formatted_history)} messages for {user_phone}")
         else:
-            logger.info("No active reminders found in Supabase")
-            return []
+            logger.info(f"No chat history found for {user_phone}")
+            formatted_history = []
+        
+        history = merge_pending_messages(formatted_history, pending, limit)
+        return history
             
     except Exception as e:
-        logger.error(f"Error loading reminders from Supabase: {str(e)}")
+        logger.error(f"Error loading chat history from Supabase: {str(e)}")
         return []
+    finally:
+        if _history_cache:
+            # Menos filas que el límite: la caché tiene todo el historial del usuario
+            _history_cache.finish_load(user_phone, token, history, complete=history is not None and len(history) < limit)
+
+async def get_user_stats_async(supabase: AsyncClient, user_phone: str):
+    """Obtener estadísticas del usuario (cliente asíncrono, consultas en paralelo)"""
+    if not supabase:
+        return {}
+        
+    try:
+        results = await asyncio.gather(*[query() for query in _user_stats_queries(supabase, user_phone)])
+        return _build_user_stats(*results)
+        
+    except Exception as e:
+        logger.error(f"Error getting user stats: {str(e)}")
+        return {}
+
+async def get_user_stats_rpc_async(supabase: AsyncClient, user_phone: str):
+    """Versión asíncrona de get_user_stats_rpc"""
+    if not supabase:
+        return {}
+    if not rpc_available("get_user_stats"):
+        return await get_user_stats_async(supabase, user_phone)
+        
+    try:
+        result = await supabase.rpc("get_user_stats", {"p_user_phone": user_phone}).execute()
+        return _build_user_stats_from_rpc(result)
+        
+    except Exception as e:
+        if _handle_missing_rpc("get_user_stats", e):
+            return await get_user_stats_async(supabase, user_phone)
+        logger.error(f"Error getting user stats: {str(e)}")
+        return {}
+
+async def get_user_reminders_supabase_async(supabase: AsyncClient, user_phone: str):
+    """Obtener recordatorios activos de un usuario específico (caché o cliente asíncrono)"""
+    if not supabase:
+        return []
+    if _reminder_cache:
+        cached = _reminder_cache.get(user_phone)
+        if cached is not None:
+            return cached
+        
+    token = _reminder_cache.begin_load(user_phone) if _reminder_cache else None
+    reminders = None
+    try:
+        result = await supabase.table("reminders").select("*").eq("user_phone", user_phone).eq("is_active", True).execute()
+        
+        if result.data:
+            logger.info(f"Found {len(result.data)} active reminders for {user_phone}")
+            reminders = result.data
+        else:
+            logger.info(f"No active reminders found for {user_phone}")
+            reminders = []
+        return reminders
+            
+    except Exception as e:
+        logger.error(f"Error getting user reminders: {str(e)}")
+        return []
+    finally:
+        if _reminder_cache:
+            _reminder_cache.finish_load(user_phone, token, reminders)
+
+async def load_user_context_async(supabase: AsyncClient, user_phone: str) -> UserContext:
+    """Versión asíncrona de load_user_context"""
+    if not supabase:
+        return UserContext()
+    
+    user_stats, active_reminders = await asyncio.gather(
+        get_user_stats_rpc_async(supabase, user_phone),
+        get_user_reminders_supabase_async(supabase, user_phone)
+    )
+    return UserContext(user_stats=user_stats, active_reminders=active_reminders)
@@ -0,0 +1,133 @@
+"""
+Módulo para descartar reentregas del webhook de Green API.
+Green API reintenta cuando el webhook tarda demasiado; cada reintento trae el
+mismo idMessage. Se guarda una caché TTL acotada en memoria y, opcionalmente,
+una tabla compartida en Supabase para que varios workers/máquinas coincidan.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from loguru import logger
+from supabase import Client
+
+import db_utils
+
+
+class TTLDedupCache:
+    """Conjunto acotado de claves con expiración (LRU por orden de inserción)"""
+
+    def __init__(self, ttl_seconds: float = 3600, max_size: int = 10000):
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_size = max(1, int(max_size))
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_if_absent(self, key: str) -> bool:
+        """Registrar la clave. Devuelve False si ya estaba registrada y vigente"""
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is not None and expires_at > now:
+                return False
+
+            self._entries[key] = now + self.ttl_seconds
+            self._entries.move_to_end(key)
+            self._evict(now)
+            return True
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _evict(self, now: float):
+        # Las entradas más antiguas están al principio
+        while self._entries:
+            oldest_key, expires_at = next(iter(self._entries.items()))
+            if expires_at <= now or len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            else:
+                break
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class WebhookDeduplicator:
+    """Deduplicación por idMessage: memoria local primero, Supabase como backend compartido opcional"""
+
+    def __init__(self, cache: TTLDedupCache, supabase: Client = None, prune_interval_seconds: float = 600):
+        self.cache = cache
+        self.supabase = supabase
+        # La tabla compartida conserva cada idMessage tanto como la caché local (su TTL)
+        self.prune_interval_seconds = min(float(prune_interval_seconds), cache.ttl_seconds)
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+        self._duplicates = 0
+        self._accepted = 0
+        self._pruned = 0
+
+    def is_duplicate(self, id_message: Optional[str]) -> bool:
+        """Marcar el mensaje como visto. Devuelve True si ya se había recibido"""
+        if not id_message:
+            return False
+
+        if not self.cache.add_if_absent(id_message):
+            self._count(duplicate=True)
+            return True
+
+        if self.supabase:
+            self._prune_shared()
+            claimed = db_utils.claim_webhook_message(self.supabase, id_message)
+            # Si el backend compartido falla (None) se procesa igualmente
+            if claimed is False:
+                # Lo procesa otro worker: no recordarlo aquí, por si falla y lo libera
+                self.cache.discard(id_message)
+                self._count(duplicate=True)
+                return True
+
+        self._count(duplicate=False)
+        return False
+
+    def release(self, id_message: Optional[str]):
+        """Olvidar un mensaje cuyo procesamiento falló para que el reintento se procese"""
+        if not id_message:
+            return
+        self.cache.discard(id_message)
+        if self.supabase:
+            db_utils.release_webhook_message(self.supabase, id_message)
+
+    def _prune_shared(self):
+        """Borrar de la tabla compartida los idMessage más viejos que el TTL, como mucho una vez por intervalo"""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_prune:
+                return
+            self._next_prune = now + self.prune_interval_seconds
+
+        pruned = db_utils.prune_webhook_messages(self.supabase, self.cache.ttl_seconds)
+        if pruned:
+            logger.info(f"Pruned {pruned} processed webhooks older than {self.cache.ttl_seconds:.0f}s")
+            with self._lock:
+                self._pruned += pruned
+
+    def _count(self, duplicate: bool):
+        with self._lock:
+            if duplicate:
+                self._duplicates += 1
+            else:
+                self._accepted += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "supabase" if self.supabase else "memory",
+                "cached_ids": len(self.cache),
+                "ttl_seconds": self.cache.ttl_seconds,
+                "max_size": self.cache.max_size,
+                "accepted": self._accepted,
+                "duplicates": self._duplicates,
+                "pruned": self._pruned
+            }
@@ -0,0 +1,307 @@
+"""
+Módulo para manejar el cliente de Google Gemini.
+Los modelos se crean una sola vez por proceso (por nombre y configuración) y se
+reutilizan en cada mensaje junto con el transporte configurado por genai.
+También gestiona el caché de contexto de Gemini para el prompt estático.
+"""
+
+import datetime
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+# ==================== CONFIGURACIÓN DEL MODELO ====================
+
+GEMINI_MODEL_NAME = "gemini-2.5-flash-preview-05-20"
+
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 0,
+    "max_output_tokens": 1000,
+}
+
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+# ==================== REGISTRO DE MODELOS ====================
+
+_lock = threading.Lock()
+_configured_api_key: Optional[str] = None
+_models: Dict[tuple, Any] = {}
+
+
+def _configure(api_key: str):
+    """Configurar genai solo cuando cambia la API key (configure() reinicia los clientes)"""
+    global _configured_api_key
+    import google.generativeai as genai
+
+    if _configured_api_key != api_key:
+        genai.configure(api_key=api_key)
+        _configured_api_key = api_key
+        _models.clear()
+        logger.info("Gemini client configured")
+
+
+def _model_key(model_name: str, generation_config: Dict[str, Any], safety_settings: List[Dict[str, str]]) -> tuple:
+    return (
+        model_name,
+        json.dumps(generation_config, sort_keys=True),
+        json.dumps(safety_settings, sort_keys=True)
+    )
+
+
+def get_model(api_key: str, model_name: str = GEMINI_MODEL_NAME,
+              generation_config: Dict[str, Any] = None,
+              safety_settings: List[Dict[str, str]] = None):
+    """Obtener (o crear la primera vez) el GenerativeModel para un nombre y configuración"""
+    import google.generativeai as genai
+
+    generation_config = generation_config if generation_config is not None else GEMINI_GENERATION_CONFIG
+    safety_settings = safety_settings if safety_settings is not None else GEMINI_SAFETY_SETTINGS
+    key = _model_key(model_name, generation_config, safety_settings)
+
+    model = _models.get(key) if _configured_api_key == api_key else None
+    if model is not None:
+        return model
+
+    with _lock:
+        _configure(api_key)
+        model = _models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                generation_config=generation_config,
+                safety_settings=safety_settings,
+            )
+            _models[key] = model
+            logger.info(f"Created Gemini model {model_name} ({len(_models)} cached)")
+        return model
+
+
+def clear_models():
+    """Descartar los modelos cacheados (p. ej. tras cambiar la configuración)"""
+    with _lock:
+        _models.clear()
+
+
+def get_registry_stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "configured": _configured_api_key is not None,
+            "cached_models": len(_models),
+            "models": sorted({key[0] for key in _models})
+        }
+
+
+# ==================== CACHÉ DE CONTEXTO ====================
+
+class ContextCache:
+    """Prompt estático subido una vez como cached content de Gemini, renovado antes de expirar.
+    Si el caché no está disponible devuelve None y el llamador envía el prompt completo."""
+
+    def __init__(self, ttl_seconds: float = 3600, refresh_margin_seconds: float = 300,
+                 retry_after_seconds: float = 600):
+        self.ttl_seconds = float(ttl_seconds)
+        self.refresh_margin_seconds = min(float(refresh_margin_seconds), self.ttl_seconds / 2)
+        self.retry_after_seconds = float(retry_after_seconds)
+        self._lock = threading.Lock()
+        self._cached_content = None
+        self._model = None
+        self._fingerprint = None
+        self._expires_at = 0.0
+        self._disabled_until = 0.0
+        self._refresh_retry_at = 0.0
+        self._refreshing = False
+
+        # Métricas
+        self._hits = 0
+        self._creations = 0
+        self._refreshes = 0
+        self._failures = 0
+        self._last_error = None
+
+    def get_model(self, api_key: str, system_instruction: str, model_name: str = GEMINI_MODEL_NAME,
+                  generation_config: Dict[str, Any] = None,
+                  safety_settings: List[Dict[str, str]] = None):
+        """Modelo ligado al contenido en caché, o None si hay que usar el prompt completo.
+        Solo un hilo renueva o crea el caché, y lo hace fuera del lock; mientras tanto
+        los demás usan el caché aún vigente o, si ya expiró, el prompt completo."""
+        generation_config = generation_config if generation_config is not None else GEMINI_GENERATION_CONFIG
+        safety_settings = safety_settings if safety_settings is not None else GEMINI_SAFETY_SETTINGS
+        fingerprint = hashlib.sha256(f"{model_name}\n{system_instruction}".encode("utf-8")).hexdigest()
+
+        with self._lock:
+            now = time.time()
+            if now < self._disabled_until:
+                return None
+
+            valid = self._fingerprint == fingerprint and now < self._expires_at
+            if valid and (now < self._expires_at - self.refresh_margin_seconds or now < self._refresh_retry_at):
+                self._hits += 1
+                return self._model
+
+            if self._refreshing:
+                if valid:
+                    self._hits += 1
+                    return self._model
+                return None
+
+            self._refreshing = True
+            current = self._cached_content if valid else None
+            previous = self._cached_content
+
+        try:
+            cached_content, model = self._refresh_or_create(api_key, system_instruction, model_name,
+                                                            generation_config, safety_settings, current)
+        except Exception as e:
+            with self._lock:
+                self._refreshing = False
+                self._failures += 1
+                self._last_error = str(e)
+                failed_at = time.time()
+                if self._fingerprint == fingerprint and failed_at < self._expires_at:
+                    # El caché actual sigue vigente: se usa y la renovación se reintenta más adelante
+                    self._refresh_retry_at = failed_at + min(self.retry_after_seconds, self.refresh_margin_seconds / 4)
+                    self._hits += 1
+                    model = self._model
+                else:
+                    self._disabled_until = failed_at + self.retry_after_seconds
+                    model = None
+            if model is not None:
+                logger.warning(f"Could not refresh Gemini context cache, using the current one until it expires: {str(e)}")
+                return model
+            logger.warning(f"Gemini context cache unavailable, sending full prompt for {self.retry_after_seconds:.0f}s: {str(e)}")
+            return None
+
+        with self._lock:
+            self._refreshing = False
+            if cached_content is current:
+                self._refreshes += 1
+            else:
+                self._creations += 1
+                self._cached_content = cached_content
+                self._model = model
+                self._fingerprint = fingerprint
+            self._expires_at = now + self.ttl_seconds
+            self._hits += 1
+            model = self._model
+
+        if previous is not None and previous is not cached_content:
+            try:
+                previous.delete()
+            except Exception as e:
+                logger.warning(f"Could not delete previous Gemini context cache: {str(e)}")
+        return model
+
+    def _refresh_or_create(self, api_key, system_instruction, model_name, generation_config,
+                           safety_settings, current):
+        """Extender el TTL de `current` (contenido vigente con el mismo prompt) o crear uno nuevo.
+        Devuelve (cached_content, modelo); el modelo es None si solo se extendió el TTL.
+        Hace las llamadas de red y no toca el estado compartido."""
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        with _lock:
+            _configure(api_key)
+
+        ttl = datetime.timedelta(seconds=self.ttl_seconds)
+
+        # Mismo contenido todavía vigente: solo extender el TTL
+        if current is not None:
+            try:
+                current.update(ttl=ttl)
+                logger.info(f"Gemini context cache {current.name} extended for {self.ttl_seconds:.0f}s")
+                return current, None
+            except Exception as e:
+                logger.warning(f"Could not extend Gemini context cache, recreating it: {str(e)}")
+
+        cached_content = caching.CachedContent.create(
+            model=model_name,
+            display_name="epigen-system-prompt",
+            system_instruction=system_instruction,
+            ttl=ttl
+        )
+        model = genai.GenerativeModel.from_cached_content(
+            cached_content=cached_content,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+        )
+        logger.info(f"Gemini context cache created: {cached_content.name} (ttl {self.ttl_seconds:.0f}s)")
+        return cached_content, model
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            return {
+                "enabled": True,
+                "active": self._cached_content is not None and now < self._expires_at,
+                "name": self._cached_content.name if self._cached_content is not None else None,
+                "expires_in_seconds": round(max(0.0, self._expires_at - now), 1),
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "creations": self._creations,
+                "refreshes": self._refreshes,
+                "failures": self._failures,
+                "refreshing": self._refreshing,
+                "fallback_active": now < self._disabled_until,
+                "last_error": self._last_error
+            }
+
+
+# ==================== STREAMING ====================
+
+class ParagraphChunker:
+    """Agrupa el texto que llega en streaming en trozos de párrafos completos.
+    Solo corta en saltos de párrafo y nunca emite un trozo menor que min_chars
+    (salvo el último), para no partir el formato de WhatsApp."""
+
+    def __init__(self, min_chars: int = 300):
+        self.min_chars = max(1, int(min_chars))
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Añadir texto recibido y devolver los trozos ya listos para enviar"""
+        self._buffer += text
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            chunk, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:].lstrip("\n")
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def flush(self) -> Optional[str]:
+        """Lo que quede al terminar la generación"""
+        chunk, self._buffer = self._buffer.strip(), ""
+        return chunk or None
+
+    def _find_cut(self) -> Optional[int]:
+        # Primer salto de párrafo a partir del cual el trozo alcanza el mínimo;
+        # el párrafo siguiente debe haber empezado para saber que el actual terminó
+        index = self._buffer.find("\n\n", self.min_chars)
+        if index == -1 or not self._buffer[index:].strip():
+            return None
+        return index
+
+
+class StreamInterrupted(Exception):
+    """La generación en streaming falló después de entregar parte de la respuesta"""
+
+    def __init__(self, delivered_text: str, cause: Exception):
+        super().__init__(f"stream failed after {len(delivered_text)} delivered chars: {cause}")
+        self.delivered_text = delivered_text
+
+
+def delivered_in_chunks(text: str, chunks: List[str]) -> bool:
+    """True si `text` ya se envió completo en `chunks` (ParagraphChunker recorta los espacios entre párrafos)"""
+    return bool(chunks) and text.split() == " ".join(chunks).split()
@@ -0,0 +1,261 @@
+"""
+Clientes HTTP compartidos para Green API.
+GreenApiClient usa una sola requests.Session con pool de conexiones keep-alive
+(las respuestas y los recordatorios reutilizan conexiones TLS ya abiertas);
+AsyncGreenApiClient hace lo mismo sobre httpx para el event loop de asgi_app,
+con un semáforo que limita las peticiones en vuelo. Ambos aplican timeouts de
+conexión y lectura, reintentos acotados con backoff y jitter ante 429/5xx y
+errores de conexión, y registran métricas de latencia por llamada.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = "https://api.green-api.com"
+
+# Respuestas que merecen reintento: límite de peticiones y errores del servidor
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class _GreenApiBase:
+    """Configuración, backoff y métricas comunes a los clientes síncrono y asíncrono.
+    No se reintenta tras un timeout de lectura: el mensaje pudo haberse enviado
+    y reintentarlo lo duplicaría."""
+
+    def __init__(self, id_instance: Optional[str], api_token: Optional[str], base_url: str = DEFAULT_BASE_URL,
+                 pool_size: int = 20, connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.id_instance = id_instance
+        self.api_token = api_token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (float(connect_timeout), float(read_timeout))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.pool_size = max(1, int(pool_size))
+
+        # Métricas
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._errors = 0
+        self._retries = 0
+        self._status_counts: Dict[str, int] = {}
+        self._latencies = deque(maxlen=1000)
+
+    def url(self, method: str) -> str:
+        """URL de un método de Green API para la instancia configurada"""
+        return f"{self.base_url}/waInstance{self.id_instance}/{method}/{self.api_token}"
+
+    @staticmethod
+    def message_payload(recipient: str, message: str) -> Dict[str, Any]:
+        return {"chatId": f"{recipient}@c.us", "message": message}
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Backoff exponencial con jitter completo; Retry-After manda si viene en la respuesta"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, started: float, status: str, error: bool = False):
+        latency = time.perf_counter() - started
+        with self._lock:
+            self._calls += 1
+            if error:
+                self._errors += 1
+            self._status_counts[status] = self._status_counts.get(status, 0) + 1
+            self._latencies.append(latency)
+
+    def _record_retry(self):
+        with self._lock:
+            self._retries += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Llamadas, reintentos, errores y latencia de las últimas 1000 llamadas"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            calls, errors, retries = self._calls, self._errors, self._retries
+            status_counts = dict(self._status_counts)
+
+        def percentile(pct: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct))] * 1000, 1)
+
+        return {
+            "calls": calls,
+            "errors": errors,
+            "retries": retries,
+            "status_counts": status_counts,
+            "pool_size": self.pool_size,
+            "latency_p50_ms": percentile(0.50),
+            "latency_p95_ms": percentile(0.95),
+            "latency_max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0
+        }
+
+
+class GreenApiClient(_GreenApiBase):
+    """Cliente síncrono de Green API para una instancia"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def send_message(self, recipient: str, message: str) -> Optional[Dict[str, Any]]:
+        """Enviar un mensaje de texto. Devuelve la respuesta de Green API o None si falló la petición"""
+        return self.post("sendMessage", self.message_payload(recipient, message))
+
+    def post(self, method: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """POST a un método con reintentos. Devuelve el JSON de la última respuesta o None"""
+        url = self.url(method)
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                self._record(started, str(response.status_code))
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    return response.json()
+                retry_after = response.headers.get("Retry-After")
+                logger.warning(f"Green API {method} returned {response.status_code} (attempt {attempt + 1})")
+            except requests.exceptions.ReadTimeout as e:
+                self._record(started, "timeout", error=True)
+                logger.error(f"Green API {method} read timeout, not retrying: {str(e)}")
+                return None
+            except requests.exceptions.ConnectionError as e:
+                self._record(started, "connection_error", error=True)
+                if attempt == self.max_retries:
+                    logger.error(f"Green API {method} connection failed: {str(e)}")
+                    return None
+                logger.warning(f"Green API {method} connection error (attempt {attempt + 1}): {str(e)}")
+            except ValueError as e:
+                # Respuesta sin JSON válido
+                self._record(started, "invalid_json", error=True)
+                logger.error(f"Green API {method} returned invalid JSON: {str(e)}")
+                return None
+            except Exception as e:
+                self._record(started, "exception", error=True)
+                logger.error(f"Exception when calling Green API {method}: {str(e)}")
+                return None
+
+            self._record_retry()
+            time.sleep(self._backoff(attempt, retry_after))
+        return None
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncGreenApiClient(_GreenApiBase):
+    """Cliente asíncrono de Green API (httpx, HTTP/1.1 keep-alive).
+    Como mucho max_in_flight peticiones simultáneas; el resto espera turno en el
+    semáforo, de modo que miles de envíos pueden lanzarse desde un solo event loop.
+    start() debe llamarse dentro del event loop que lo va a usar."""
+
+    def __init__(self, *args, max_in_flight: int = 50, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight = 0
+        self._peak_in_flight = 0
+
+    async def start(self):
+        connect_timeout, read_timeout = self.timeout
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.pool_size)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._loop = asyncio.get_running_loop()
+
+    async def aclose(self):
+        if self._client:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+    @property
+    def started(self) -> bool:
+        return self._client is not None
+
+    async def send_message(self, recipient: str, message: str) -> Optional[Dict[str, Any]]:
+        """Enviar un mensaje de texto. Devuelve la respuesta de Green API (con idMessage) o None"""
+        return await self.post("sendMessage", self.message_payload(recipient, message))
+
+    async def send_many(self, messages: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """Enviar varios (destinatario, mensaje) a la vez, acotados por el semáforo"""
+        return await asyncio.gather(*(self.send_message(recipient, message) for recipient, message in messages))
+
+    def send_message_threadsafe(self, recipient: str, message: str) -> Future:
+        """Programar un envío en el event loop del cliente desde otro hilo (p. ej. el scheduler)"""
+        if self._loop is None:
+            raise RuntimeError("AsyncGreenApiClient not started")
+        return asyncio.run_coroutine_threadsafe(self.send_message(recipient, message), self._loop)
+
+    async def post(self, method: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """POST a un método con reintentos. Devuelve el JSON de la última respuesta o None"""
+        url = self.url(method)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self._semaphore:
+                self._in_flight += 1
+                self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+                started = time.perf_counter()
+                try:
+                    response = await self._client.post(url, json=payload)
+                    self._record(started, str(response.status_code))
+                    if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                        return response.json()
+                    retry_after = response.headers.get("Retry-After")
+                    logger.warning(f"Green API {method} returned {response.status_code} (attempt {attempt + 1})")
+                except httpx.ReadTimeout as e:
+                    self._record(started, "timeout", error=True)
+                    logger.error(f"Green API {method} read timeout, not retrying: {str(e)}")
+                    return None
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    self._record(started, "connection_error", error=True)
+                    if attempt == self.max_retries:
+                        logger.error(f"Green API {method} connection failed: {str(e)}")
+                        return None
+                    logger.warning(f"Green API {method} connection error (attempt {attempt + 1}): {str(e)}")
+                except ValueError as e:
+                    self._record(started, "invalid_json", error=True)
+                    logger.error(f"Green API {method} returned invalid JSON: {str(e)}")
+                    return None
+                except Exception as e:
+                    self._record(started, "exception", error=True)
+                    logger.error(f"Exception when calling Green API {method}: {str(e)}")
+                    return None
+                finally:
+                    self._in_flight -= 1
+
+            # El backoff se espera fuera del semáforo para no bloquear otros envíos
+            self._record_retry()
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+        return None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metrics = super().get_metrics()
+        metrics.update({
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self._in_flight,
+            "peak_in_flight": self._peak_in_flight
+        })
+        return metrics
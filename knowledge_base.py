@@ -1054,11 +1054,32 @@ _«No manejo ese tema, pero lo que puedo decirte en base a lo que se es lo sigui
 - Los recordatorios son una herramienta de apoyo, no reemplazan supervisión médica.
 """
 
-def get_system_message(user_context="", reminders_context=""):
-    """Genera el mensaje del sistema con el contexto actual"""
+def get_system_message(user_context="", reminders_context="", knowledge=None):
+    """Genera el mensaje del sistema con el contexto actual.
+    Si se pasa `knowledge` (secciones recuperadas) reemplaza al conocimiento completo."""
     return system_message_template.format(
         user_context=user_context,
         reminders_context=reminders_context,
-        knowledge_content=knowledge_content,
-        knowledge_product=knowledge_product
+        knowledge_content=knowledge_content if knowledge is None else knowledge,
+        knowledge_product=knowledge_product if knowledge is None else ""
+    )
+
+# Sección de contexto por usuario; con el prompt estático en caché se envía aparte
+user_context_template = """
+# CONTEXTO DEL USUARIO
+{user_context}
+{reminders_context}
+"""
+
+def get_static_system_message():
+    """Mensaje del sistema sin contexto del usuario (apto para el caché de contexto de Gemini)"""
+    return get_system_message()
+
+def get_user_context_message(user_context="", reminders_context=""):
+    """Contexto por usuario que acompaña al prompt estático en caché ("" si no hay contexto)"""
+    if not user_context and not reminders_context:
+        return ""
+    return user_context_template.format(
+        user_context=user_context,
+        reminders_context=reminders_context
     )
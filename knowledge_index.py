@@ -0,0 +1,175 @@
+"""
+Módulo de recuperación sobre la base de conocimiento.
+Al importarse divide knowledge_content y knowledge_product en secciones y las
+indexa con BM25 sobre tokens normalizados en español (sin acentos, sin
+stopwords, con un stemming ligero). En cada turno se inyectan solo las
+secciones más relevantes en lugar de todo el conocimiento.
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional
+
+import knowledge_base
+
+# ==================== NORMALIZACIÓN ====================
+
+SPANISH_STOPWORDS = {
+    "a", "al", "algo", "algun", "alguna", "algunas", "alguno", "algunos", "ante", "antes", "asi",
+    "aun", "cada", "como", "con", "contra", "cual", "cuales", "cuando", "de", "del", "desde",
+    "donde", "dos", "el", "ella", "ellas", "ellos", "en", "entre", "era", "es", "esa", "esas",
+    "ese", "eso", "esos", "esta", "estan", "estas", "este", "esto", "estos", "fue", "ha", "hay",
+    "la", "las", "le", "les", "lo", "los", "mas", "me", "mi", "mis", "muy", "nada", "ni", "no",
+    "nos", "o", "otra", "otro", "para", "pero", "poco", "por", "porque", "puedo", "que", "quien",
+    "se", "sea", "ser", "si", "sin", "sobre", "son", "su", "sus", "tambien", "te", "tengo",
+    "ti", "tu", "tus", "un", "una", "uno", "unos", "unas", "y", "ya", "yo", "https", "com", "sec",
+    "mercadolibre", "hola", "quiero", "puedes", "podria", "debo", "tomar",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SUFFIXES = ("amientos", "imientos", "amiento", "imiento", "aciones", "iciones", "acion", "icion",
+             "mente", "idades", "idad", "ables", "ibles", "able", "ible", "istas", "ista",
+             "osos", "osas", "oso", "osa", "ces", "es", "s")
+
+
+def strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def stem(token: str) -> str:
+    """Stemming ligero: recorta sufijos frecuentes dejando al menos 4 caracteres"""
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            token = token[:-len(suffix)]
+            if suffix == "ces":
+                token += "z"
+            break
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens normalizados: minúsculas, sin acentos, sin stopwords y con stemming"""
+    tokens = _TOKEN_RE.findall(strip_accents(text.lower()))
+    return [stem(t) for t in tokens if t not in SPANISH_STOPWORDS and len(t) > 1]
+
+# ==================== SECCIONES ====================
+
+_HEADER_RE = re.compile(r"^(#{1,6})\s*(.*?)\s*$")
+
+
+def split_sections(text: str, source: str, max_chars: int = 1200) -> List[Dict[str, str]]:
+    """Dividir un texto markdown en secciones por encabezado y en bloques de hasta max_chars"""
+    sections = []
+    headers: List[str] = []
+    blocks: List[str] = []
+    current: List[str] = []
+
+    def flush_block():
+        block = "\n".join(current).strip()
+        current.clear()
+        if block:
+            blocks.append(block)
+
+    def flush_section():
+        flush_block()
+        title = " > ".join(h for h in headers if h) or source
+        chunk = ""
+        for block in blocks:
+            if chunk and len(chunk) + len(block) + 2 > max_chars:
+                sections.append({"source": source, "title": title, "text": chunk})
+                chunk = block
+            else:
+                chunk = f"{chunk}\n\n{block}" if chunk else block
+        if chunk:
+            sections.append({"source": source, "title": title, "text": chunk})
+        blocks.clear()
+
+    for line in text.splitlines():
+        match = _HEADER_RE.match(line)
+        if match:
+            flush_section()
+            level, title = len(match.group(1)), match.group(2).rstrip(":. ")
+            headers[:] = headers[:level - 1] + [""] * max(0, level - 1 - len(headers)) + [title]
+        elif not line.strip():
+            flush_block()
+        else:
+            current.append(line)
+    flush_section()
+
+    return sections
+
+# ==================== ÍNDICE BM25 ====================
+
+# Secciones que se añaden al contexto aunque no aparezcan en el top-k
+PINNED_SECTION_TITLES = {"Datos de Epigen"}
+
+
+class KnowledgeIndex:
+    """Índice BM25 en memoria sobre las secciones de conocimiento"""
+
+    def __init__(self, sections: List[Dict[str, str]], k1: float = 1.5, b: float = 0.75):
+        self.sections = sections
+        self.k1 = k1
+        self.b = b
+        self._term_freqs: List[Counter] = []
+        self._lengths: List[int] = []
+        doc_freqs: Counter = Counter()
+
+        for section in sections:
+            # El título pesa doble: suele nombrar el producto o test
+            tokens = tokenize(section["title"]) * 2 + tokenize(section["text"])
+            freqs = Counter(tokens)
+            self._term_freqs.append(freqs)
+            self._lengths.append(len(tokens))
+            doc_freqs.update(freqs.keys())
+
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        total = len(sections)
+        self._idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in doc_freqs.items()
+        }
+
+    @classmethod
+    def from_knowledge_base(cls, max_chars: int = 1200) -> "KnowledgeIndex":
+        sections = (split_sections(knowledge_base.knowledge_content, "knowledge_content", max_chars) +
+                    split_sections(knowledge_base.knowledge_product, "knowledge_product", max_chars))
+        return cls(sections)
+
+    def score(self, query: str) -> List[float]:
+        query_terms = set(tokenize(query))
+        scores = []
+        for freqs, length in zip(self._term_freqs, self._lengths):
+            score = 0.0
+            for term in query_terms:
+                tf = freqs.get(term)
+                if not tf:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / (self._avg_length or 1))
+                score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def search(self, query: str, top_k: int = 4) -> List[Dict[str, str]]:
+        """Las top_k secciones con puntuación positiva, en orden de relevancia"""
+        scores = self.score(query)
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        return [self.sections[i] for i in ranked[:top_k] if scores[i] > 0]
+
+    def build_context(self, query: str, top_k: int = 4) -> str:
+        """Texto de las secciones relevantes listo para el prompt, en el orden original"""
+        hits = self.search(query, top_k)
+        # Los datos de contacto de Epigen son cortos y se incluyen siempre
+        hits += [s for s in self.sections if s["title"] in PINNED_SECTION_TITLES and s not in hits]
+        hits.sort(key=self.sections.index)
+        return "\n\n".join(f"## {section['title']}\n{section['text']}" for section in hits)
+
+
+# Índice construido al importar el módulo
+KNOWLEDGE_INDEX = KnowledgeIndex.from_knowledge_base()
+
+
+def build_knowledge_context(query: str, top_k: int = 4, index: Optional[KnowledgeIndex] = None) -> str:
+    return (index or KNOWLEDGE_INDEX).build_context(query, top_k)
@@ -0,0 +1,405 @@
+"""
+Sustituto local de Supabase sobre SQLite para pruebas y desarrollo sin red.
+Implementa el subconjunto del cliente de supabase-py que usan db_utils y app.py
+(table().select/insert/update/upsert/delete con eq/gt/order/limit, count="exact"
+y rpc()) sobre el mismo esquema de tablas, incluidas las funciones SQL de
+migrations/.
+
+Uso: SUPABASE_URL=sqlite:///epigen.db (o sqlite:// para una base en memoria)
+"""
+
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_phone TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    message_order INTEGER NOT NULL,
+    session_id TEXT,
+    timestamp TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE UNIQUE INDEX IF NOT EXISTS chat_history_user_phone_order_key ON chat_history (user_phone, message_order);
+
+CREATE TABLE IF NOT EXISTS chat_message_counters (
+    user_phone TEXT PRIMARY KEY,
+    last_order INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS reminders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_phone TEXT NOT NULL,
+    reminder_type TEXT NOT NULL,
+    message TEXT NOT NULL,
+    interval_minutes REAL,
+    cron_expression TEXT,
+    is_active BOOLEAN NOT NULL DEFAULT 1,
+    timezone TEXT,
+    nickname TEXT,
+    display_name TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS processed_webhooks (
+    id_message TEXT PRIMARY KEY,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+"""
+
+# Columnas booleanas (SQLite las guarda como 0/1)
+BOOLEAN_COLUMNS = {"is_active"}
+
+
+class LocalSupabaseError(Exception):
+    """Error con el mismo atributo `code` que postgrest.APIError"""
+
+    def __init__(self, message: str, code: str = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class APIResponse:
+    def __init__(self, data: List[Dict[str, Any]], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+    def __repr__(self):
+        return f"APIResponse(data={self.data!r}, count={self.count!r})"
+
+
+def _to_row(cursor, row) -> Dict[str, Any]:
+    result = {}
+    for column, value in zip((d[0] for d in cursor.description), row):
+        result[column] = bool(value) if column in BOOLEAN_COLUMNS and value is not None else value
+    return result
+
+
+def _column_error(table: str, error: sqlite3.OperationalError) -> Exception:
+    """Traducir columnas inexistentes a los errores de PostgREST/Postgres"""
+    message = str(error)
+    if "has no column named" in message:
+        column = message.rsplit(" ", 1)[-1]
+        return LocalSupabaseError(f"Could not find the '{column}' column of '{table}' in the schema cache", code="PGRST204")
+    if "no such column" in message:
+        column = message.rsplit(" ", 1)[-1]
+        return LocalSupabaseError(f"column {table}.{column} does not exist", code="42703")
+    return error
+
+
+class QueryBuilder:
+    """Constructor de consultas encadenable al estilo de postgrest-py"""
+
+    def __init__(self, client: "LocalSupabaseClient", table: str):
+        self._client = client
+        self._table = table
+        self._operation = "select"
+        self._columns = "*"
+        self._count = None
+        self._payload = None
+        self._filters: List[tuple] = []
+        self._order: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._on_conflict: Optional[str] = None
+        self._ignore_duplicates = False
+
+    # --- operaciones ---
+    def select(self, columns: str = "*", count: str = None):
+        self._operation, self._columns, self._count = "select", columns, count
+        return self
+
+    def insert(self, payload):
+        self._operation, self._payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict: str = None, ignore_duplicates: bool = False):
+        self._operation, self._payload = "upsert", payload
+        self._on_conflict, self._ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, payload: Dict[str, Any]):
+        self._operation, self._payload = "update", payload
+        return self
+
+    def delete(self):
+        self._operation = "delete"
+        return self
+
+    # --- filtros y modificadores ---
+    def eq(self, column: str, value):
+        self._filters.append((column, "=", value))
+        return self
+
+    def neq(self, column: str, value):
+        self._filters.append((column, "!=", value))
+        return self
+
+    def gt(self, column: str, value):
+        self._filters.append((column, ">", value))
+        return self
+
+    def gte(self, column: str, value):
+        self._filters.append((column, ">=", value))
+        return self
+
+    def lt(self, column: str, value):
+        self._filters.append((column, "<", value))
+        return self
+
+    def in_(self, column: str, values):
+        self._filters.append((column, "IN", list(values)))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self._order.append((column, "DESC" if desc else "ASC"))
+        return self
+
+    def limit(self, size: int):
+        self._limit = int(size)
+        return self
+
+    def execute(self) -> APIResponse:
+        return self._client._run(self._execute_sync)
+
+    # --- SQL ---
+    def _where(self):
+        if not self._filters:
+            return "", []
+        clauses, params = [], []
+        for column, op, value in self._filters:
+            if op == "IN":
+                clauses.append(f'"{column}" IN ({", ".join("?" for _ in value) or "NULL"})')
+                params.extend(value)
+            else:
+                clauses.append(f'"{column}" {op} ?')
+                params.append(value)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _execute_sync(self, conn: sqlite3.Connection) -> APIResponse:
+        if self._operation == "select":
+            return self._select(conn)
+        if self._operation in ("insert", "upsert"):
+            return self._insert(conn)
+        if self._operation == "update":
+            return self._update(conn)
+        return self._delete(conn)
+
+    def _select(self, conn):
+        where, params = self._where()
+        count = None
+        if self._count:
+            count = conn.execute(f'SELECT count(*) FROM "{self._table}"{where}', params).fetchone()[0]
+
+        columns = [c.strip() for c in self._columns.split(",")]
+        if columns in (["count"], ["count(*)"]):
+            return APIResponse([{"count": conn.execute(f'SELECT count(*) FROM "{self._table}"{where}', params).fetchone()[0]}], count)
+
+        if columns != ["*"]:
+            # SQLite tomaría un identificador desconocido entre comillas como texto literal
+            existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{self._table}")')}
+            for column in columns:
+                if column not in existing:
+                    raise LocalSupabaseError(f"column {self._table}.{column} does not exist", code="42703")
+        select_list = "*" if columns == ["*"] else ", ".join(f'"{c}"' for c in columns)
+        sql = f'SELECT {select_list} FROM "{self._table}"{where}'
+        if self._order:
+            sql += " ORDER BY " + ", ".join(f'"{c}" {d}' for c, d in self._order)
+        if self._limit is not None:
+            sql += f" LIMIT {self._limit}"
+        try:
+            cursor = conn.execute(sql, params)
+        except sqlite3.OperationalError as e:
+            raise _column_error(self._table, e)
+        return APIResponse([_to_row(cursor, row) for row in cursor.fetchall()], count)
+
+    def _insert(self, conn):
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        inserted = []
+        for row in rows:
+            columns = list(row.keys())
+            column_list = ", ".join(f'"{c}"' for c in columns)
+            sql = f'INSERT INTO "{self._table}" ({column_list}) VALUES ({", ".join("?" for _ in columns)})'
+            conflict = self._on_conflict or "id"
+            if self._operation == "upsert":
+                updates = ", ".join(f'"{c}" = excluded."{c}"' for c in columns if c != conflict)
+                if self._ignore_duplicates or not updates:
+                    sql += f' ON CONFLICT ("{conflict}") DO NOTHING'
+                else:
+                    sql += f' ON CONFLICT ("{conflict}") DO UPDATE SET {updates}'
+            try:
+                cursor = conn.execute(sql, [row[c] for c in columns])
+            except sqlite3.IntegrityError as e:
+                raise LocalSupabaseError(str(e), code="23505")
+            except sqlite3.OperationalError as e:
+                raise _column_error(self._table, e)
+
+            # Sin RETURNING (SQLite < 3.35): releer la fila escrita
+            if cursor.rowcount == 0:
+                continue
+            if self._operation == "upsert" and conflict in row:
+                cursor = conn.execute(f'SELECT * FROM "{self._table}" WHERE "{conflict}" = ?', [row[conflict]])
+            else:
+                cursor = conn.execute(f'SELECT * FROM "{self._table}" WHERE rowid = ?', [cursor.lastrowid])
+            inserted.extend(_to_row(cursor, r) for r in cursor.fetchall())
+        return APIResponse(inserted)
+
+    def _matching_rows(self, conn, where, params):
+        cursor = conn.execute(f'SELECT rowid AS "__rowid", * FROM "{self._table}"{where}', params)
+        return [_to_row(cursor, r) for r in cursor.fetchall()]
+
+    def _update(self, conn):
+        where, params = self._where()
+        rowids = [r["__rowid"] for r in self._matching_rows(conn, where, params)]
+        columns = list(self._payload.keys())
+        sets = ", ".join(f'"{c}" = ?' for c in columns)
+        conn.execute(f'UPDATE "{self._table}" SET {sets}{where}', [self._payload[c] for c in columns] + params)
+        updated = []
+        for rowid in rowids:
+            cursor = conn.execute(f'SELECT * FROM "{self._table}" WHERE rowid = ?', [rowid])
+            updated.extend(_to_row(cursor, r) for r in cursor.fetchall())
+        return APIResponse(updated)
+
+    def _delete(self, conn):
+        where, params = self._where()
+        deleted = self._matching_rows(conn, where, params)
+        conn.execute(f'DELETE FROM "{self._table}"{where}', params)
+        for row in deleted:
+            row.pop("__rowid", None)
+        return APIResponse(deleted)
+
+
+class RPCBuilder:
+    def __init__(self, client: "LocalSupabaseClient", function: Callable, params: Dict[str, Any]):
+        self._client = client
+        self._function = function
+        self._params = params
+
+    def execute(self) -> APIResponse:
+        return self._client._run(lambda conn: APIResponse(self._function(conn, **self._params)))
+
+
+# ==================== FUNCIONES SQL (equivalentes de migrations/) ====================
+
+def _rpc_get_user_stats(conn: sqlite3.Connection, p_user_phone: str) -> List[Dict[str, Any]]:
+    cursor = conn.execute("""
+        SELECT count(*) AS total_messages,
+               (SELECT created_at FROM chat_history WHERE user_phone = :phone ORDER BY message_order ASC LIMIT 1) AS first_interaction,
+               (SELECT created_at FROM chat_history WHERE user_phone = :phone ORDER BY message_order DESC LIMIT 1) AS last_interaction
+        FROM chat_history WHERE user_phone = :phone
+    """, {"phone": p_user_phone})
+    return [_to_row(cursor, row) for row in cursor.fetchall()]
+
+
+def _rpc_insert_chat_message(conn: sqlite3.Connection, p_user_phone: str, p_role: str, p_content: str,
+                             p_session_id: str = None) -> List[Dict[str, Any]]:
+    # Igual que la función de 003: contador por usuario, nunca por debajo del máximo
+    # guardado (los escritores antiguos insertan sin avanzarlo). La transacción
+    # BEGIN IMMEDIATE de _run serializa la asignación del orden.
+    next_order = conn.execute("SELECT COALESCE(MAX(message_order), 0) + 1 FROM chat_history WHERE user_phone = ?",
+                              (p_user_phone,)).fetchone()[0]
+    conn.execute("""
+        INSERT INTO chat_message_counters (user_phone, last_order) VALUES (?, ?)
+        ON CONFLICT (user_phone) DO UPDATE SET last_order = max(last_order + 1, excluded.last_order)
+    """, (p_user_phone, next_order))
+    order = conn.execute("SELECT last_order FROM chat_message_counters WHERE user_phone = ?",
+                         (p_user_phone,)).fetchone()[0]
+    try:
+        cursor = conn.execute("INSERT INTO chat_history (user_phone, role, content, message_order, session_id) VALUES (?, ?, ?, ?, ?)",
+                              (p_user_phone, p_role, p_content, order, p_session_id))
+    except sqlite3.IntegrityError as e:
+        raise LocalSupabaseError(str(e), code="23505")
+    return [{"id": cursor.lastrowid, "message_order": order}]
+
+
+def _rpc_insert_chat_messages(conn: sqlite3.Connection, p_messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    inserted = []
+    for message in p_messages:
+        row = _rpc_insert_chat_message(conn, message["user_phone"], message["role"], message["content"],
+                                       message.get("session_id"))[0]
+        inserted.append({"id": row["id"], "user_phone": message["user_phone"], "message_order": row["message_order"]})
+    return inserted
+
+
+RPC_FUNCTIONS: Dict[str, Callable] = {
+    "get_user_stats": _rpc_get_user_stats,
+    "insert_chat_message": _rpc_insert_chat_message,
+    "insert_chat_messages": _rpc_insert_chat_messages,
+}
+
+
+class LocalSupabaseClient:
+    """Cliente síncrono compatible con el subconjunto de supabase.Client usado en el proyecto"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+
+    def table(self, name: str) -> QueryBuilder:
+        return QueryBuilder(self, name)
+
+    def rpc(self, function: str, params: Dict[str, Any] = None) -> RPCBuilder:
+        if function not in RPC_FUNCTIONS:
+            raise LocalSupabaseError(f"Could not find the function public.{function}", code="PGRST202")
+        return RPCBuilder(self, RPC_FUNCTIONS[function], params or {})
+
+    def _run(self, operation: Callable[[sqlite3.Connection], APIResponse]) -> APIResponse:
+        # Cada operación es atómica, como una petición a PostgREST
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class _AsyncQuery:
+    """Envuelve un builder para que execute() sea awaitable, como en supabase.AsyncClient"""
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if name == "execute":
+            return lambda: asyncio.to_thread(attr)
+        if callable(attr):
+            def chain(*args, **kwargs):
+                result = attr(*args, **kwargs)
+                return self if result is self._builder else result
+            return chain
+        return attr
+
+
+class AsyncLocalSupabaseClient:
+    """Versión asíncrona sobre la misma base SQLite"""
+
+    def __init__(self, client: LocalSupabaseClient):
+        self._client = client
+
+    def table(self, name: str) -> _AsyncQuery:
+        return _AsyncQuery(self._client.table(name))
+
+    def rpc(self, function: str, params: Dict[str, Any] = None) -> _AsyncQuery:
+        return _AsyncQuery(self._client.rpc(function, params))
+
+
+def is_local_url(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith("sqlite:")
+
+
+def create_client(url: str) -> LocalSupabaseClient:
+    """Crear el cliente desde una URL al estilo SQLAlchemy:
+    sqlite:///epigen.db (relativa), sqlite:////data/epigen.db (absoluta), sqlite:// (memoria)"""
+    path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else url[len("sqlite://"):]
+    return LocalSupabaseClient(path or ":memory:")
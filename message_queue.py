@@ -0,0 +1,200 @@
+"""
+Módulo para procesar mensajes entrantes de WhatsApp en segundo plano.
+El webhook solo valida y encola el mensaje; un pool de workers lo procesa
+y envía la respuesta, exponiendo métricas de profundidad y tiempo de espera.
+
+Cada worker atiende su propio carril (lane). El remitente se asigna a un
+carril por hash, de modo que los mensajes de un mismo usuario se procesan
+estrictamente en orden mientras usuarios distintos avanzan en paralelo.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, List, Optional
+from loguru import logger
+
+
+def lane_index(key: str, num_lanes: int) -> int:
+    """Carril estable para una clave (mismo resultado entre procesos y reinicios)"""
+    return zlib.crc32(key.encode("utf-8")) % num_lanes
+
+
+class SenderLocks:
+    """Un lock por remitente para serializar el procesamiento síncrono de un mismo usuario.
+    Cada lock se elimina cuando nadie lo está usando, así que remitentes distintos
+    nunca compiten entre sí."""
+
+    def __init__(self):
+        self._locks: Dict[str, list] = {}
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, sender: str):
+        with self._guard:
+            entry = self._locks.get(sender)
+            if entry is None:
+                entry = self._locks[sender] = [threading.Lock(), 0]
+            entry[1] += 1
+
+        entry[0].acquire()
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[sender]
+
+
+class AsyncSenderLocks:
+    """Equivalente de SenderLocks para corrutinas (punto de entrada ASGI)"""
+
+    def __init__(self):
+        self._locks: Dict[str, list] = {}
+
+    @asynccontextmanager
+    async def hold(self, sender: str):
+        entry = self._locks.get(sender)
+        if entry is None:
+            entry = self._locks[sender] = [asyncio.Lock(), 0]
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[sender]
+
+
+class MessageQueue:
+    """Cola de trabajo en memoria con un carril ordenado por worker"""
+
+    def __init__(self, handler: Callable[[str, str], Any], num_workers: int = 4, max_size: int = 1000):
+        self.handler = handler
+        self.num_workers = max(1, int(num_workers))
+        self.max_size = max(0, int(max_size))
+        # El límite total se reparte entre carriles
+        lane_size = -(-self.max_size // self.num_workers) if self.max_size else 0
+        self._lanes: List["queue.Queue[Optional[tuple]]"] = [
+            queue.Queue(maxsize=lane_size) for _ in range(self.num_workers)
+        ]
+        self._workers = []
+        self._lock = threading.Lock()
+        self._running = False
+
+        # Métricas
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._busy_workers = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._last_wait = 0.0
+
+    def start(self):
+        """Arrancar un worker por carril"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+
+        for i, lane in enumerate(self._lanes):
+            worker = threading.Thread(target=self._worker_loop, args=(lane,), name=f"message-lane-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        logger.info(f"Message queue started with {self.num_workers} ordered lanes (max size: {self.max_size or 'unbounded'})")
+
+    def stop(self, timeout: float = 5.0):
+        """Detener los workers esperando a que terminen los mensajes en curso"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+
+        for lane in self._lanes:
+            lane.put(None)
+
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+
+        self._workers = []
+        logger.info("Message queue stopped")
+
+    def submit(self, sender: str, message_text: str) -> bool:
+        """Encolar un mensaje en el carril del remitente. Devuelve False si está lleno o detenido"""
+        if not self._running:
+            return False
+
+        lane = self._lanes[lane_index(sender, self.num_workers)]
+        try:
+            lane.put_nowait((sender, message_text, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            logger.warning(f"Message lane full, rejecting message from {sender}")
+            return False
+
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def _worker_loop(self, lane: "queue.Queue[Optional[tuple]]"):
+        while True:
+            item = lane.get()
+            if item is None:
+                lane.task_done()
+                break
+
+            sender, message_text, enqueued_at = item
+            wait = time.monotonic() - enqueued_at
+
+            with self._lock:
+                self._busy_workers += 1
+                self._total_wait += wait
+                self._last_wait = wait
+                self._max_wait = max(self._max_wait, wait)
+
+            try:
+                self.handler(sender, message_text)
+                with self._lock:
+                    self._processed += 1
+            except Exception as e:
+                logger.error(f"Error processing queued message from {sender}: {str(e)}")
+                with self._lock:
+                    self._failed += 1
+            finally:
+                with self._lock:
+                    self._busy_workers -= 1
+                lane.task_done()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Métricas de la cola: profundidad, tiempos de espera y contadores"""
+        lane_depths = [lane.qsize() for lane in self._lanes]
+        with self._lock:
+            started = self._processed + self._failed + self._busy_workers
+            avg_wait = (self._total_wait / started) if started else 0.0
+            return {
+                "running": self._running,
+                "workers": self.num_workers,
+                "busy_workers": self._busy_workers,
+                "queue_depth": sum(lane_depths),
+                "lane_depths": lane_depths,
+                "max_size": self.max_size,
+                "enqueued": self._enqueued,
+                "processed": self._processed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(avg_wait * 1000, 2),
+                "max_wait_ms": round(self._max_wait * 1000, 2),
+                "last_wait_ms": round(self._last_wait * 1000, 2)
+            }
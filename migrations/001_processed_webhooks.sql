@@ -0,0 +1,14 @@
+-- Registro compartido de idMessage ya procesados (deduplicación del webhook).
+-- Necesario solo con WEBHOOK_DEDUP_BACKEND=supabase.
+CREATE TABLE IF NOT EXISTS processed_webhooks (
+    id_message TEXT PRIMARY KEY,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS processed_webhooks_created_at_idx
+    ON processed_webhooks (created_at);
+
+-- La aplicación borra las filas más viejas que WEBHOOK_DEDUP_TTL (3600 s por
+-- defecto) al registrar mensajes, como mucho cada WEBHOOK_DEDUP_PRUNE_INTERVAL.
+-- Equivalente manual o con pg_cron:
+-- DELETE FROM processed_webhooks WHERE created_at < now() - interval '1 hour';
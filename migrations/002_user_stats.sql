@@ -0,0 +1,21 @@
+-- Estadísticas de un usuario en una sola consulta (db_utils.get_user_stats_rpc).
+-- Devuelve el mismo formato que las tres consultas de db_utils.get_user_stats.
+CREATE INDEX IF NOT EXISTS chat_history_user_phone_order_idx
+    ON chat_history (user_phone, message_order);
+
+CREATE OR REPLACE FUNCTION get_user_stats(p_user_phone TEXT)
+RETURNS TABLE (
+    total_messages BIGINT,
+    first_interaction TIMESTAMPTZ,
+    last_interaction TIMESTAMPTZ
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        (SELECT count(*) FROM chat_history WHERE user_phone = p_user_phone),
+        (SELECT created_at FROM chat_history WHERE user_phone = p_user_phone
+            ORDER BY message_order ASC LIMIT 1),
+        (SELECT created_at FROM chat_history WHERE user_phone = p_user_phone
+            ORDER BY message_order DESC LIMIT 1);
+$$;
+
+GRANT EXECUTE ON FUNCTION get_user_stats(TEXT) TO anon, authenticated;
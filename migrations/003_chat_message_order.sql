@@ -0,0 +1,79 @@
+-- Asignación atómica de message_order (db_utils.save_message_to_supabase).
+-- Sustituye el SELECT max + INSERT por una sola llamada: el contador por usuario
+-- se incrementa con un upsert que bloquea su fila, así que dos mensajes
+-- simultáneos del mismo usuario nunca reciben el mismo orden.
+
+-- 1. Renumerar los órdenes duplicados que hayan dejado las carreras anteriores
+--    (se conserva el orden existente y se desempata por id)
+WITH renumbered AS (
+    SELECT id, row_number() OVER (PARTITION BY user_phone ORDER BY message_order, id) AS new_order
+    FROM chat_history
+)
+UPDATE chat_history AS c
+SET message_order = r.new_order
+FROM renumbered AS r
+WHERE c.id = r.id AND c.message_order IS DISTINCT FROM r.new_order;
+
+-- 2. El orden pasa a ser único por usuario (reemplaza el índice de 002_user_stats.sql)
+CREATE UNIQUE INDEX IF NOT EXISTS chat_history_user_phone_order_key
+    ON chat_history (user_phone, message_order);
+DROP INDEX IF EXISTS chat_history_user_phone_order_idx;
+
+-- 3. Último orden asignado por usuario, inicializado con los mensajes existentes
+CREATE TABLE IF NOT EXISTS chat_message_counters (
+    user_phone TEXT PRIMARY KEY,
+    last_order BIGINT NOT NULL
+);
+
+INSERT INTO chat_message_counters (user_phone, last_order)
+SELECT user_phone, max(message_order) FROM chat_history GROUP BY user_phone
+ON CONFLICT (user_phone) DO UPDATE
+    SET last_order = GREATEST(chat_message_counters.last_order, EXCLUDED.last_order);
+
+GRANT SELECT, INSERT, UPDATE ON chat_message_counters TO anon, authenticated;
+
+-- 4. Insertar un mensaje con el siguiente orden en una sola llamada.
+--    El orden nunca queda por debajo del máximo ya guardado: los procesos que aún
+--    escriben con SELECT max + INSERT (sin esta migración al arrancar) no avanzan el
+--    contador, y sin el GREATEST la siguiente llamada chocaría con su mensaje. Si uno
+--    de esos escritores ocupa el orden entre la lectura y el INSERT, se recalcula.
+CREATE OR REPLACE FUNCTION insert_chat_message(
+    p_user_phone TEXT,
+    p_role TEXT,
+    p_content TEXT,
+    p_session_id TEXT DEFAULT NULL
+)
+RETURNS TABLE (id BIGINT, message_order BIGINT)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_next BIGINT;
+    v_order BIGINT;
+    v_attempt INT := 0;
+BEGIN
+    LOOP
+        v_attempt := v_attempt + 1;
+
+        SELECT COALESCE(max(h.message_order), 0) + 1 INTO v_next
+        FROM chat_history AS h WHERE h.user_phone = p_user_phone;
+
+        INSERT INTO chat_message_counters AS c (user_phone, last_order)
+        VALUES (p_user_phone, v_next)
+        ON CONFLICT (user_phone) DO UPDATE SET last_order = GREATEST(c.last_order + 1, EXCLUDED.last_order)
+        RETURNING c.last_order INTO v_order;
+
+        BEGIN
+            RETURN QUERY
+            INSERT INTO chat_history AS h (user_phone, role, content, message_order, session_id)
+            VALUES (p_user_phone, p_role, p_content, v_order, p_session_id)
+            RETURNING h.id::BIGINT, h.message_order::BIGINT;
+            RETURN;
+        EXCEPTION WHEN unique_violation THEN
+            IF v_attempt >= 3 THEN
+                RAISE;
+            END IF;
+        END;
+    END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION insert_chat_message(TEXT, TEXT, TEXT, TEXT) TO anon, authenticated;
@@ -0,0 +1,25 @@
+-- Inserción por lotes para la escritura diferida de chat_history (db_utils.ChatWriteBuffer).
+-- Requiere 003_chat_message_order.sql. Los mensajes se insertan en el orden del
+-- arreglo y en una sola transacción, cada uno con el siguiente message_order de su usuario.
+CREATE OR REPLACE FUNCTION insert_chat_messages(p_messages JSONB)
+RETURNS TABLE (id BIGINT, user_phone TEXT, message_order BIGINT)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_message JSONB;
+BEGIN
+    FOR v_message IN
+        SELECT m.value FROM jsonb_array_elements(p_messages) WITH ORDINALITY AS m(value, idx) ORDER BY m.idx
+    LOOP
+        RETURN QUERY
+        SELECT r.id, v_message->>'user_phone', r.message_order
+        FROM insert_chat_message(
+            v_message->>'user_phone',
+            v_message->>'role',
+            v_message->>'content',
+            v_message->>'session_id'
+        ) AS r;
+    END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION insert_chat_messages(JSONB) TO anon, authenticated;
@@ -0,0 +1,395 @@
+"""
+Módulo para despachar los mensajes salientes de WhatsApp con límite de ritmo.
+Todos los envíos pasan por una cola con dos prioridades: las respuestas a
+usuarios (interactivas) siempre salen antes que los recordatorios programados.
+Un token bucket limita los envíos por segundo a Green API, de modo que una
+ráfaga de recordatorios (p. ej. todos los de las 22:00) se reparte en el
+tiempo sin superar el límite de la instancia ni retrasar las conversaciones.
+ReminderBatcher suaviza esos picos antes de la cola: agrupa los recordatorios
+que vencen juntos y los libera repartidos en un margen de tiempo configurable.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+from loguru import logger
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REMINDER = 1
+PRIORITY_NAMES = ("interactive", "reminder")
+
+
+class TokenBucket:
+    """Token bucket: `rate` tokens por segundo con una reserva de hasta `burst`.
+    No es thread-safe por sí mismo; el dispatcher lo usa con su lock tomado."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(0.001, float(rate))
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consumir un token. Devuelve 0 si lo había o los segundos hasta el siguiente"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def refund(self):
+        self._tokens = min(self.burst, self._tokens + 1)
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class _Outbound:
+    __slots__ = ("recipient", "message", "priority", "enqueued_at", "future")
+
+    def __init__(self, recipient: str, message: str, priority: int):
+        self.recipient = recipient
+        self.message = message
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.future: Future = Future()
+
+
+class _PriorityStats:
+    __slots__ = ("enqueued", "sent", "failed", "dropped", "expired", "total_delay", "max_delay", "last_delay")
+
+    def __init__(self):
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.expired = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+        self.last_delay = 0.0
+
+
+class OutboundDispatcher:
+    """Cola de envíos con prioridades, token bucket y un pool de workers.
+    Los workers solo sacan un mensaje cuando hay token, así que una respuesta
+    interactiva que llega durante una ráfaga toma el siguiente token disponible.
+    Los recordatorios se descartan si la cola de recordatorios está llena o si
+    llevan esperando más de max_delay_seconds; las respuestas nunca se descartan."""
+
+    def __init__(self, send_func: Callable[[str, str], Any], rate_per_second: float = 5.0, burst: int = 10,
+                 num_workers: int = 4, max_backlog: int = 10000, max_delay_seconds: float = 600):
+        self.send_func = send_func
+        self.num_workers = max(1, int(num_workers))
+        self.max_backlog = max(0, int(max_backlog))
+        self.max_delay_seconds = float(max_delay_seconds)
+        self._bucket = TokenBucket(rate_per_second, burst)
+        self._queues: List[Deque[_Outbound]] = [deque() for _ in PRIORITY_NAMES]
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._running = False
+
+        # Métricas
+        self._stats = [_PriorityStats() for _ in PRIORITY_NAMES]
+        self._throttled = 0
+        self._busy_workers = 0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"outbound-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        logger.info(f"Outbound dispatcher started: {self._bucket.rate}/s (burst {self._bucket.burst:.0f}), "
+                    f"{self.num_workers} workers")
+
+    def stop(self, timeout: float = 5.0):
+        """Detener los workers; los mensajes aún en cola se resuelven con None"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            pending = [item for lane in self._queues for item in lane]
+            for lane in self._queues:
+                lane.clear()
+            self._cond.notify_all()
+
+        for item in pending:
+            item.future.set_result(None)
+        for worker in self._workers:
+            worker.join(timeout=timeout)
+        self._workers = []
+
+    def submit(self, recipient: str, message: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[Future]:
+        """Encolar un mensaje. Devuelve un Future con la respuesta de Green API,
+        o None si el recordatorio se descartó por cola llena"""
+        item = _Outbound(recipient, message, priority)
+        with self._cond:
+            stats = self._stats[priority]
+            lane = self._queues[priority]
+            if priority != PRIORITY_INTERACTIVE and self.max_backlog and len(lane) >= self.max_backlog:
+                stats.dropped += 1
+                logger.warning(f"Outbound {PRIORITY_NAMES[priority]} backlog full, dropping message to {recipient}")
+                return None
+            if not self._running:
+                item.future.set_result(None)
+                return item.future
+            lane.append(item)
+            stats.enqueued += 1
+            self._cond.notify()
+        return item.future
+
+    def send(self, recipient: str, message: str, priority: int = PRIORITY_INTERACTIVE,
+             timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Encolar y esperar el resultado (para respuestas que deben salir en orden)"""
+        future = self.submit(recipient, message, priority)
+        if future is None:
+            return None
+        return future.result(timeout)
+
+    def _next_item(self) -> Optional[_Outbound]:
+        """Siguiente mensaje con token disponible, por prioridad (con _cond tomado)"""
+        while self._running:
+            lane = next((lane for lane in self._queues if lane), None)
+            if lane is None:
+                self._cond.wait()
+                continue
+
+            wait = self._bucket.take()
+            if wait > 0:
+                self._throttled += 1
+                self._cond.wait(wait)
+                continue
+
+            item = lane.popleft()
+            delay = time.monotonic() - item.enqueued_at
+            stats = self._stats[item.priority]
+            if item.priority != PRIORITY_INTERACTIVE and self.max_delay_seconds and delay > self.max_delay_seconds:
+                # Recordatorio demasiado atrasado: no se envía y el token vuelve al bucket
+                stats.expired += 1
+                self._bucket.refund()
+                item.future.set_result(None)
+                logger.warning(f"Dropping {PRIORITY_NAMES[item.priority]} message to {item.recipient} "
+                               f"after {delay:.0f}s in queue")
+                continue
+
+            stats.total_delay += delay
+            stats.max_delay = max(stats.max_delay, delay)
+            stats.last_delay = delay
+            self._busy_workers += 1
+            return item
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                item = self._next_item()
+            if item is None:
+                return
+
+            result = None
+            try:
+                result = self.send_func(item.recipient, item.message)
+            except Exception as e:
+                logger.error(f"Error sending outbound message to {item.recipient}: {str(e)}")
+            finally:
+                with self._cond:
+                    self._busy_workers -= 1
+                    stats = self._stats[item.priority]
+                    if result is not None:
+                        stats.sent += 1
+                    else:
+                        stats.failed += 1
+                item.future.set_result(result)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Backlog, retrasos en cola y descartes por prioridad"""
+        with self._cond:
+            priorities = {}
+            for priority, name in enumerate(PRIORITY_NAMES):
+                stats = self._stats[priority]
+                started = stats.sent + stats.failed
+                priorities[name] = {
+                    "backlog": len(self._queues[priority]),
+                    "enqueued": stats.enqueued,
+                    "sent": stats.sent,
+                    "failed": stats.failed,
+                    "dropped": stats.dropped,
+                    "expired": stats.expired,
+                    "avg_delay_ms": round(stats.total_delay / started * 1000, 1) if started else 0.0,
+                    "max_delay_ms": round(stats.max_delay * 1000, 1),
+                    "last_delay_ms": round(stats.last_delay * 1000, 1)
+                }
+            return {
+                "running": self._running,
+                "rate_per_second": self._bucket.rate,
+                "burst": self._bucket.burst,
+                "tokens": round(self._bucket.tokens, 2),
+                "workers": self.num_workers,
+                "busy_workers": self._busy_workers,
+                "throttled_waits": self._throttled,
+                "max_backlog": self.max_backlog,
+                "priorities": priorities
+            }
+
+
+class ReminderBatcher:
+    """Suavizado de picos de recordatorios (p. ej. todos los de las 22:00).
+    Agrupa los recordatorios que vencen dentro de una ventana corta y reparte su
+    envío de forma uniforme en jitter_budget_seconds, en lugar de enviarlos todos
+    en el mismo segundo. Un lote pequeño no se estira: el espaciado nunca supera
+    1/min_rate segundos. Los lotes siguientes continúan donde acabó el anterior."""
+
+    def __init__(self, send_func: Callable[[str, str], Any], window_seconds: float = 1.0,
+                 jitter_budget_seconds: float = 30.0, min_rate: float = 10.0, num_workers: int = 4):
+        self.send_func = send_func
+        self.window_seconds = max(0.0, float(window_seconds))
+        self.jitter_budget_seconds = max(0.0, float(jitter_budget_seconds))
+        self.min_rate = max(0.001, float(min_rate))
+        self.num_workers = max(1, int(num_workers))
+        self._pending: List[tuple] = []
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # Métricas
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._max_batch = 0
+        self._last_batch = 0
+        self._last_spread = 0.0
+        self._released = 0
+        self._failed = 0
+        self._release_delays: Deque[float] = deque(maxlen=1000)
+        self._send_latencies: Deque[float] = deque(maxlen=1000)
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._stopped.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="reminder-batch")
+        self._thread = threading.Thread(target=self._run, name="reminder-batcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Reminder batcher started: {self.window_seconds}s window, "
+                    f"{self.jitter_budget_seconds}s jitter budget")
+
+    def stop(self, timeout: float = 5.0):
+        """Detener; los recordatorios aún no liberados se envían de inmediato"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
+    def submit(self, user_phone: str, message: str):
+        """Recordatorio vencido (llamado desde el hilo del scheduler, no bloquea)"""
+        with self._cond:
+            if self._running:
+                self._pending.append((user_phone, message, time.monotonic()))
+                self._cond.notify()
+                return
+        # Batcher detenido (p. ej. durante el apagado): envío directo
+        self._send(user_phone, message, time.monotonic())
+
+    def _run(self):
+        next_release = time.monotonic()
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if self._running:
+                    # Esperar a que se cierre la ventana del primer recordatorio pendiente
+                    window_end = self._pending[0][2] + self.window_seconds
+                    while self._running and time.monotonic() < window_end:
+                        self._cond.wait(window_end - time.monotonic())
+                batch, self._pending = self._pending, []
+                running = self._running
+
+            if not batch:
+                return
+            next_release = self._release(batch, max(next_release, time.monotonic()), paced=running)
+            if not running:
+                return
+
+    def _release(self, batch: List[tuple], start: float, paced: bool = True) -> float:
+        """Liberar un lote espaciado uniformemente; devuelve el instante en que termina"""
+        spacing = min(self.jitter_budget_seconds / len(batch), 1 / self.min_rate) if paced else 0.0
+        with self._lock:
+            self._batches += 1
+            self._max_batch = max(self._max_batch, len(batch))
+            self._last_batch = len(batch)
+            self._last_spread = spacing * len(batch)
+
+        for i, (user_phone, message, due_at) in enumerate(batch):
+            delay = start + i * spacing - time.monotonic()
+            if delay > 0 and paced:
+                self._stopped.wait(delay)
+                paced = not self._stopped.is_set()
+            self._executor.submit(self._send, user_phone, message, due_at)
+        return start + len(batch) * spacing
+
+    def _send(self, user_phone: str, message: str, due_at: float):
+        started = time.monotonic()
+        result = None
+        try:
+            result = self.send_func(user_phone, message)
+        except Exception as e:
+            logger.error(f"Error sending batched reminder to {user_phone}: {str(e)}")
+        finished = time.monotonic()
+        with self._lock:
+            self._released += 1
+            if result is None:
+                self._failed += 1
+            self._release_delays.append(started - due_at)
+            self._send_latencies.append(finished - started)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Tamaño de los lotes, retraso hasta la liberación y latencia de envío (p50/p99)"""
+        # _pending lo protege _cond, no el lock de métricas
+        with self._cond:
+            pending = len(self._pending)
+        with self._lock:
+            release_delays = sorted(self._release_delays)
+            send_latencies = sorted(self._send_latencies)
+            metrics = {
+                "window_seconds": self.window_seconds,
+                "jitter_budget_seconds": self.jitter_budget_seconds,
+                "pending": pending,
+                "batches": self._batches,
+                "max_batch": self._max_batch,
+                "last_batch": self._last_batch,
+                "last_spread_seconds": round(self._last_spread, 2),
+                "released": self._released,
+                "failed": self._failed
+            }
+
+        def percentile(values: List[float], pct: float) -> float:
+            if not values:
+                return 0.0
+            return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 1)
+
+        metrics.update({
+            "release_delay_p50_ms": percentile(release_delays, 0.50),
+            "release_delay_p99_ms": percentile(release_delays, 0.99),
+            "send_latency_p50_ms": percentile(send_latencies, 0.50),
+            "send_latency_p99_ms": percentile(send_latencies, 0.99)
+        })
+        return metrics
@@ -0,0 +1,329 @@
+"""
+Motor de recordatorios alternativo a APScheduler (REMINDER_ENGINE=heap).
+Con APScheduler cada recordatorio es un Job completo (trigger, executor,
+argumentos, metadatos) y el scheduler despierta y busca en su jobstore por
+cada disparo. Aquí cada recordatorio es un registro compacto dentro de un
+montículo ordenado por próximo disparo: un solo hilo duerme hasta el primero,
+saca de una vez todos los que vencieron y los entrega en lotes a un pool de
+hilos. Expone la misma interfaz que ReminderJobRegistry.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from loguru import logger
+
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from reminder_jobs import reminder_job_id
+
+
+# ==================== SCHEDULES ====================
+
+class _Daily:
+    """Disparo diario a hora:minuto en una zona horaria (CronTrigger(hour=, minute=))"""
+    __slots__ = ("timezone", "hour", "minute")
+
+    def __init__(self, timezone, hour: int, minute: int):
+        self.timezone = timezone
+        self.hour = hour
+        self.minute = minute
+
+    def next_after(self, ts: float) -> Optional[float]:
+        now = datetime.fromtimestamp(ts, self.timezone)
+        day = now.date()
+        while True:
+            naive = datetime(day.year, day.month, day.day, self.hour, self.minute)
+            localize = getattr(self.timezone, "localize", None)
+            candidate = localize(naive) if localize else naive.replace(tzinfo=self.timezone)
+            if candidate.timestamp() > ts:
+                return candidate.timestamp()
+            day += timedelta(days=1)
+
+
+class _TriggerSchedule:
+    """Cualquier otro trigger de APScheduler (camino lento, sin compactar)"""
+    __slots__ = ("trigger",)
+
+    def __init__(self, trigger):
+        self.trigger = trigger
+
+    def next_after(self, ts: float) -> Optional[float]:
+        previous = datetime.fromtimestamp(ts, self.trigger.timezone)
+        next_time = self.trigger.get_next_fire_time(previous, previous + timedelta(microseconds=1))
+        return next_time.timestamp() if next_time else None
+
+
+_CRON_DAILY_FIELDS = {"hour", "minute"}
+
+
+def _daily_from_cron(trigger: CronTrigger) -> Optional[Tuple[Any, int, int]]:
+    """(zona, hora, minuto) si el CronTrigger es un simple disparo diario"""
+    if trigger.start_date or trigger.end_date or trigger.jitter:
+        return None
+    fields = {f.name: f for f in trigger.fields}
+    if any(not f.is_default for name, f in fields.items() if name not in _CRON_DAILY_FIELDS | {"second"}):
+        return None
+    try:
+        second = int(str(fields["second"]))
+        hour = int(str(fields["hour"]))
+        minute = int(str(fields["minute"]))
+    except ValueError:
+        return None
+    if second != 0:
+        return None
+    return trigger.timezone, hour, minute
+
+
+# ==================== ENGINE ====================
+
+class _Timer:
+    """Registro compacto de un recordatorio programado"""
+    __slots__ = ("user_phone", "reminder_id", "reminder_type", "func", "args", "schedule", "due", "cancelled")
+
+    def __init__(self, user_phone: str, reminder_id: str, reminder_type: str, func: Callable,
+                 args: Tuple[Any, ...], schedule, due: float):
+        self.user_phone = user_phone
+        self.reminder_id = reminder_id
+        self.reminder_type = reminder_type
+        self.func = func
+        self.args = args
+        # float = intervalo en segundos; si no, objeto con next_after(ts)
+        self.schedule = schedule
+        self.due = due
+        self.cancelled = False
+
+    @property
+    def job_id(self) -> str:
+        return reminder_job_id(self.reminder_type, self.user_phone, self.reminder_id)
+
+    def next_due(self, now: float) -> Optional[float]:
+        """Siguiente disparo posterior a now; los disparos perdidos se agrupan en uno"""
+        if isinstance(self.schedule, float):
+            if self.due > now:
+                return self.due
+            missed = int((now - self.due) // self.schedule) + 1
+            return self.due + missed * self.schedule
+        return self.schedule.next_after(max(self.due, now))
+
+
+class ReminderHeapEngine:
+    """Programador de recordatorios sobre un montículo de registros compactos.
+    Las cancelaciones son perezosas (se marcan y se descartan al salir del
+    montículo), y el montículo se reconstruye si acumula demasiadas."""
+
+    def __init__(self, workers: int = 10, batch_size: int = 64, max_sleep_seconds: float = 30.0):
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.max_sleep_seconds = float(max_sleep_seconds)
+
+        self._heap: List[Tuple[float, int, _Timer]] = []
+        self._by_user: Dict[str, Dict[str, _Timer]] = {}
+        self._count = 0
+        self._cancelled_in_heap = 0
+        self._seq = itertools.count()
+        self._daily: Dict[Tuple[Any, int, int], _Daily] = {}
+
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # Métricas
+        self._fired = 0
+        self._batches = 0
+        self._max_batch = 0
+        self._errors = 0
+        self._last_lag_ms = 0.0
+        self._max_lag_ms = 0.0
+        self._compactions = 0
+
+    # ---------- ciclo de vida ----------
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reminder-engine")
+        self._thread = threading.Thread(target=self._run, name="reminder-engine", daemon=True)
+        self._thread.start()
+        logger.info(f"Reminder heap engine started ({self.workers} workers)")
+
+    def stop(self, wait: bool = True):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+
+    # ---------- interfaz de ReminderJobRegistry ----------
+
+    def add(self, user_phone: str, reminder_id, reminder_type: str, func: Callable, trigger, args: List[Any]) -> str:
+        """Programar (o reemplazar) un recordatorio. Acepta los triggers de APScheduler
+        que usa la app; el primer disparo lo calcula el propio trigger."""
+        first = trigger.get_next_fire_time(None, datetime.now(getattr(trigger, "timezone", None) or timezone.utc))
+        if first is None:
+            raise ValueError(f"Trigger {trigger} never fires")
+
+        key = str(reminder_id)
+        timer = _Timer(user_phone, key, reminder_type, func, tuple(args), self._schedule_for(trigger), first.timestamp())
+        with self._cond:
+            user_timers = self._by_user.setdefault(user_phone, {})
+            previous = user_timers.get(key)
+            if previous is not None:
+                self._cancel(previous)
+            user_timers[key] = timer
+            self._count += 1
+            wake = not self._heap or timer.due < self._heap[0][0]
+            heapq.heappush(self._heap, (timer.due, next(self._seq), timer))
+            if wake:
+                self._cond.notify()
+        return timer.job_id
+
+    def remove(self, user_phone: str, reminder_id) -> bool:
+        with self._cond:
+            user_timers = self._by_user.get(user_phone)
+            timer = user_timers.pop(str(reminder_id), None) if user_timers else None
+            if timer is None:
+                return False
+            if not user_timers:
+                del self._by_user[user_phone]
+            self._cancel(timer)
+            self._maybe_compact()
+        return True
+
+    def remove_user(self, user_phone: str) -> int:
+        with self._cond:
+            user_timers = self._by_user.pop(user_phone, {})
+            for timer in user_timers.values():
+                self._cancel(timer)
+            self._maybe_compact()
+        return len(user_timers)
+
+    def jobs_for_user(self, user_phone: str) -> Dict[str, str]:
+        with self._cond:
+            return {reminder_id: timer.job_id for reminder_id, timer in self._by_user.get(user_phone, {}).items()}
+
+    def count(self) -> int:
+        with self._cond:
+            return self._count
+
+    def next_runs(self, limit: int = 10) -> List[Dict[str, str]]:
+        """Los próximos `limit` disparos (ID de job y fecha)"""
+        with self._cond:
+            entries = heapq.nsmallest(limit, (e for e in self._heap if not e[2].cancelled))
+        return [{"id": timer.job_id, "next_run": str(datetime.fromtimestamp(due).astimezone())}
+                for due, _, timer in entries]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "engine": "heap",
+                "jobs": self._count,
+                "heap_size": len(self._heap),
+                "daily_schedules": len(self._daily),
+                "workers": self.workers,
+                "fired": self._fired,
+                "batches": self._batches,
+                "max_batch": self._max_batch,
+                "errors": self._errors,
+                "last_lag_ms": round(self._last_lag_ms, 1),
+                "max_lag_ms": round(self._max_lag_ms, 1),
+                "compactions": self._compactions
+            }
+
+    # ---------- interno ----------
+
+    def _schedule_for(self, trigger):
+        if isinstance(trigger, IntervalTrigger) and not trigger.end_date and not trigger.jitter:
+            return float(trigger.interval_length)
+        if isinstance(trigger, CronTrigger):
+            daily_key = _daily_from_cron(trigger)
+            if daily_key is not None:
+                # Un objeto por (zona, hora, minuto), compartido entre recordatorios
+                with self._cond:
+                    daily = self._daily.get(daily_key)
+                    if daily is None:
+                        daily = self._daily[daily_key] = _Daily(*daily_key)
+                return daily
+        return _TriggerSchedule(trigger)
+
+    def _cancel(self, timer: _Timer):
+        """Con _cond tomado"""
+        timer.cancelled = True
+        self._count -= 1
+        self._cancelled_in_heap += 1
+
+    def _maybe_compact(self):
+        """Con _cond tomado: reconstruir si más de la mitad del montículo está cancelado"""
+        if self._cancelled_in_heap > 1024 and self._cancelled_in_heap * 2 > len(self._heap):
+            self._heap = [e for e in self._heap if not e[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_in_heap = 0
+            self._compactions += 1
+
+    def _pop_due(self) -> List[_Timer]:
+        """Esperar al siguiente vencimiento y sacar todos los vencidos (con _cond tomado)"""
+        while self._running:
+            now = time.time()
+            if self._heap and self._heap[0][0] <= now:
+                break
+            timeout = self.max_sleep_seconds
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - now)
+            self._cond.wait(timeout)
+        if not self._running:
+            return []
+
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, timer = heapq.heappop(self._heap)
+            if timer.cancelled:
+                self._cancelled_in_heap -= 1
+                continue
+            due.append(timer)
+
+            lag_ms = (now - timer.due) * 1000
+            self._last_lag_ms = lag_ms
+            self._max_lag_ms = max(self._max_lag_ms, lag_ms)
+
+            next_due = timer.next_due(now)
+            if next_due is None:
+                self._by_user.get(timer.user_phone, {}).pop(timer.reminder_id, None)
+                self._count -= 1
+                continue
+            timer.due = next_due
+            heapq.heappush(self._heap, (next_due, next(self._seq), timer))
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = self._pop_due()
+                if not self._running:
+                    return
+                self._fired += len(due)
+                if due:
+                    self._batches += 1
+                    self._max_batch = max(self._max_batch, len(due))
+
+            for start in range(0, len(due), self.batch_size):
+                self._executor.submit(self._fire_batch, due[start:start + self.batch_size])
+
+    def _fire_batch(self, timers: List[_Timer]):
+        for timer in timers:
+            try:
+                timer.func(*timer.args)
+            except Exception as e:
+                with self._cond:
+                    self._errors += 1
+                logger.error(f"Error running reminder {timer.job_id}: {str(e)}")
@@ -0,0 +1,125 @@
+"""
+Módulo para registrar los jobs de recordatorios del scheduler.
+Indexa cada job por (usuario, ID de recordatorio) y por usuario, de modo que
+borrar un recordatorio o todos los de un usuario no recorre todos los jobs y
+no puede afectar a otro usuario por una coincidencia parcial del ID del job.
+"""
+
+import threading
+from itertools import islice
+from typing import Any, Callable, Dict, List, Set, Tuple
+from loguru import logger
+
+from apscheduler.events import EVENT_JOB_REMOVED
+from apscheduler.jobstores.base import JobLookupError
+
+
+def reminder_job_id(reminder_type: str, user_phone: str, reminder_id) -> str:
+    """ID del job en el scheduler (mismo formato que antes del registro)"""
+    return f"{reminder_type}_{user_phone}_{reminder_id}"
+
+
+class ReminderJobRegistry:
+    """Índice de jobs de recordatorios sincronizado con el scheduler de APScheduler.
+    Los jobs eliminados por otras vías (p. ej. scheduler.remove_job) se retiran del
+    índice mediante el evento EVENT_JOB_REMOVED."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._jobs: Dict[Tuple[str, str], str] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._by_job_id: Dict[str, Tuple[str, str]] = {}
+        scheduler.add_listener(self._on_job_removed, EVENT_JOB_REMOVED)
+
+    def add(self, user_phone: str, reminder_id, reminder_type: str, func: Callable, trigger, args: List[Any]) -> str:
+        """Programar (o reemplazar) el job de un recordatorio y registrarlo"""
+        job_id = reminder_job_id(reminder_type, user_phone, reminder_id)
+        self.scheduler.add_job(
+            func=func,
+            trigger=trigger,
+            args=args,
+            id=job_id,
+            replace_existing=True
+        )
+
+        key = (user_phone, str(reminder_id))
+        with self._lock:
+            previous = self._jobs.get(key)
+            if previous is not None and previous != job_id:
+                self._by_job_id.pop(previous, None)
+            self._jobs[key] = job_id
+            self._by_job_id[job_id] = key
+            self._by_user.setdefault(user_phone, set()).add(key[1])
+
+        if previous is not None and previous != job_id:
+            # Mismo recordatorio con otro tipo: el job anterior sobra.
+            # Fuera del lock: el scheduler avisa a _on_job_removed en este hilo
+            self._remove_from_scheduler(previous)
+        return job_id
+
+    def remove(self, user_phone: str, reminder_id) -> bool:
+        """Quitar el job de un recordatorio. Devuelve False si no estaba programado"""
+        with self._lock:
+            job_id = self._unregister((user_phone, str(reminder_id)))
+        if job_id is None:
+            return False
+        self._remove_from_scheduler(job_id)
+        return True
+
+    def remove_user(self, user_phone: str) -> int:
+        """Quitar todos los jobs de un usuario. Devuelve cuántos se quitaron"""
+        with self._lock:
+            job_ids = [self._unregister((user_phone, reminder_id))
+                       for reminder_id in list(self._by_user.get(user_phone, ()))]
+        for job_id in job_ids:
+            self._remove_from_scheduler(job_id)
+        return len(job_ids)
+
+    def jobs_for_user(self, user_phone: str) -> Dict[str, str]:
+        """ID de recordatorio -> ID de job de un usuario"""
+        with self._lock:
+            return {reminder_id: self._jobs[(user_phone, reminder_id)]
+                    for reminder_id in self._by_user.get(user_phone, ())}
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+    def next_runs(self, limit: int = 10) -> List[Dict[str, str]]:
+        """ID y próxima ejecución de hasta `limit` jobs"""
+        with self._lock:
+            job_ids = list(islice(self._by_job_id, limit))
+        jobs = [self.scheduler.get_job(job_id) for job_id in job_ids]
+        return [{"id": job.id, "next_run": str(job.next_run_time)} for job in jobs if job]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {"engine": "apscheduler", "jobs": self.count()}
+
+    def _unregister(self, key: Tuple[str, str]):
+        """Con _lock tomado"""
+        job_id = self._jobs.pop(key, None)
+        if job_id is None:
+            return None
+        self._by_job_id.pop(job_id, None)
+        reminder_ids = self._by_user.get(key[0])
+        if reminder_ids is not None:
+            reminder_ids.discard(key[1])
+            if not reminder_ids:
+                del self._by_user[key[0]]
+        return job_id
+
+    def _remove_from_scheduler(self, job_id: str):
+        try:
+            self.scheduler.remove_job(job_id)
+            logger.info(f"Removed scheduler job {job_id}")
+        except JobLookupError:
+            pass
+        except Exception as e:
+            logger.error(f"Error removing scheduler job {job_id}: {str(e)}")
+
+    def _on_job_removed(self, event):
+        with self._lock:
+            key = self._by_job_id.get(event.job_id)
+            if key is not None:
+                self._unregister(key)
@@ -0,0 +1,100 @@
+"""
+Modelo compacto de recordatorio.
+Las filas de Supabase llegan como dicts con todas las columnas y una copia
+propia de cada texto; ReminderRecord guarda solo los campos que usan el
+scheduler y los listados, en __slots__, con el mensaje, el tipo y el teléfono
+internados: los recordatorios con la misma plantilla de mensaje comparten un
+único string en vez de una copia por job programado.
+"""
+
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+import reminder_utils
+
+# Columnas que necesita ReminderRecord.from_row (nickname y display_name son opcionales)
+REMINDER_RECORD_COLUMNS = ("id", "user_phone", "reminder_type", "message", "interval_minutes",
+                           "cron_expression", "nickname", "display_name")
+
+# Nombre por defecto en los listados cuando no hay nickname ni display_name
+_TYPE_LABELS = {
+    "water": "Agua",
+    "supplement": "Suplemento",
+    "sleep": "Dormir",
+    "meditation": "Meditación",
+    "exercise": "Ejercicio"
+}
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _name(value: Optional[str]) -> Optional[str]:
+    return value if value and value != "None" else None
+
+
+class ReminderRecord:
+    """Recordatorio activo: lo mínimo para programarlo y mostrarlo"""
+    __slots__ = ("id", "user_phone", "reminder_type", "message", "interval_minutes",
+                 "cron_expression", "nickname", "display_name")
+
+    def __init__(self, id: int, user_phone: str, reminder_type: str, message: str,
+                 interval_minutes: Optional[float] = None, cron_expression: Optional[str] = None,
+                 nickname: Optional[str] = None, display_name: Optional[str] = None):
+        self.id = id
+        self.user_phone = _intern(user_phone)
+        self.reminder_type = _intern(reminder_type)
+        self.message = _intern(message)
+        self.interval_minutes = float(interval_minutes) if interval_minutes else None
+        self.cron_expression = _intern(cron_expression) if cron_expression else None
+        self.nickname = _name(nickname)
+        self.display_name = _name(display_name)
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "ReminderRecord":
+        """Crear desde una fila de la tabla reminders (nickname/display_name opcionales)"""
+        return cls(
+            row["id"], row["user_phone"], row["reminder_type"], row["message"],
+            row.get("interval_minutes"), row.get("cron_expression"),
+            row.get("nickname"), row.get("display_name")
+        )
+
+    def daily_time(self) -> Optional[Tuple[int, int]]:
+        """(hora, minuto) de un recordatorio con cron_expression, o None"""
+        if not self.cron_expression:
+            return None
+        parts = self.cron_expression.split()
+        if len(parts) < 2:
+            return None
+        return int(parts[1]), int(parts[0])
+
+    def trigger(self):
+        """Trigger de APScheduler del recordatorio, o None si no tiene horario válido"""
+        if self.interval_minutes:
+            return IntervalTrigger(minutes=self.interval_minutes)
+        daily = self.daily_time()
+        if daily:
+            return CronTrigger(hour=daily[0], minute=daily[1])
+        return None
+
+    def job_args(self) -> Tuple[str, str]:
+        """Argumentos de send_reminder (strings internados, compartidos entre jobs)"""
+        return self.user_phone, self.message
+
+    def label(self) -> str:
+        """Nombre para mostrar: nickname > display_name > tipo"""
+        return self.nickname or self.display_name or _TYPE_LABELS.get(self.reminder_type, self.reminder_type.capitalize())
+
+    def schedule_text(self) -> str:
+        """Frecuencia legible: intervalo o hora del día"""
+        if self.interval_minutes:
+            return reminder_utils.format_interval_text(self.interval_minutes)
+        if self.cron_expression:
+            parts = self.cron_expression.split()
+            if len(parts) >= 2:
+                return f"{parts[1]}:{parts[0].zfill(2)}"
+        return "horario específico"
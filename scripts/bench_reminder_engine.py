@@ -0,0 +1,200 @@
+"""
+Benchmark de los motores de recordatorios (REMINDER_ENGINE=apscheduler|heap).
+Para cada tamaño programa N recordatorios y mide la memoria Python por
+recordatorio y el tiempo de alta. Los recordatorios son de intervalo diario
+(interval) o a una hora fija "HH:MM" (cron, CronTrigger como los de
+ReminderRecord, con pocas horas compartidas por muchos usuarios como en
+producción). Salen de filas decodificadas de JSON, como las devuelve
+Supabase, y se programan desde el dict (rows) o desde ReminderRecord (records).
+Después programa una ráfaga de recordatorios que vencen en el mismo instante
+(como las 22:00 de los atajos) y mide el retraso de disparo p50/p99/máx y
+cuántos llegaron a ejecutarse; con cron la ráfaga es un CronTrigger al
+siguiente minuto completo (hasta un minuto de espera por caso). Cada
+combinación corre en un subproceso.
+
+Uso: python scripts/bench_reminder_engine.py [--sizes 10000,100000,1000000]
+                                             [--engines apscheduler,heap] [--payloads rows,records]
+                                             [--triggers interval,cron] [--burst 5000]
+"""
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytz
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from reminder_engine import ReminderHeapEngine
+from reminder_jobs import ReminderJobRegistry
+from reminder_record import ReminderRecord
+
+TIMEZONE = pytz.timezone("America/Mexico_City")
+MESSAGE = "💊 Es hora de tomar tu suplemento"
+SUPPLEMENTS = ["Vitamina D3", "Omega 3", "Magnesio", "Zinc", "Valeriana", "Vitamina C", "Colágeno", "Probióticos"]
+# Horas "HH:MM" habituales de los recordatorios diarios: muchos usuarios por hora
+DAILY_TIMES = [(7, 0), (8, 0), (8, 30), (9, 0), (12, 0), (13, 0), (14, 0), (18, 0), (20, 0), (21, 0), (22, 0), (22, 30)]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_engine(name: str):
+    if name == "heap":
+        engine = ReminderHeapEngine()
+        engine.start()
+        return engine, engine.stop
+    scheduler = BackgroundScheduler(timezone=TIMEZONE)
+    scheduler.start()
+    return ReminderJobRegistry(scheduler), lambda: scheduler.shutdown(wait=False)
+
+
+def make_rows(size: int, trigger: str) -> list:
+    """Filas activas como las devuelve PostgREST: cada string es una copia propia"""
+    def schedule(i: int) -> dict:
+        if trigger == "cron":
+            hour, minute = DAILY_TIMES[i % len(DAILY_TIMES)]
+            return {"interval_minutes": None, "cron_expression": f"{minute} {hour} * * *"}
+        return {"interval_minutes": 1440, "cron_expression": None}
+
+    rows = [dict({
+        "id": i,
+        "user_phone": f"5215{i // 3:08d}",
+        "reminder_type": "supplement",
+        "message": f"💊 Es hora de tomar tu {SUPPLEMENTS[i % len(SUPPLEMENTS)]}",
+        "display_name": f"Recordatorio de {SUPPLEMENTS[i % len(SUPPLEMENTS)]}",
+        "nickname": SUPPLEMENTS[i % len(SUPPLEMENTS)],
+        "is_active": True,
+        "created_at": "2025-01-01T00:00:00+00:00"
+    }, **schedule(i)) for i in range(size)]
+    return json.loads(json.dumps(rows))
+
+
+def row_trigger(row: dict):
+    """Trigger construido desde el dict, como antes de ReminderRecord"""
+    if row["interval_minutes"]:
+        return IntervalTrigger(minutes=row["interval_minutes"])
+    minute, hour = row["cron_expression"].split()[:2]
+    return CronTrigger(hour=int(hour), minute=int(minute))
+
+
+def run_case(engine_name: str, payload: str, trigger: str, size: int, burst: int) -> dict:
+    lags = []
+    lock = threading.Lock()
+
+    def noop(user_phone, message):
+        pass
+
+    def record_lag(due_ts, message):
+        lag = time.time() - due_ts
+        with lock:
+            lags.append(lag)
+
+    tracemalloc.start()
+    engine, stop = make_engine(engine_name)
+    base, _ = tracemalloc.get_traced_memory()
+    rows = make_rows(size, trigger)
+
+    started = time.perf_counter()
+    for row in rows:
+        if payload == "records":
+            record = ReminderRecord.from_row(row)
+            engine.add(record.user_phone, record.id, record.reminder_type, noop, record.trigger(), record.job_args())
+        else:
+            engine.add(row["user_phone"], row["id"], row["reminder_type"], noop, row_trigger(row),
+                       [row["user_phone"], row["message"]])
+    add_seconds = time.perf_counter() - started
+    # Las filas se descartan tras programarlas: solo cuenta lo que retienen los jobs
+    del rows, row
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Ráfaga: todos vencen en el mismo instante, tras terminar de programarlos
+    due = datetime.now(TIMEZONE) + timedelta(seconds=2 + burst / 20000)
+    if trigger == "cron":
+        due = due.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    for i in range(burst):
+        phone = f"5299{i:08d}"
+        if trigger == "cron":
+            burst_trigger = CronTrigger(hour=due.hour, minute=due.minute, timezone=TIMEZONE)
+        else:
+            burst_trigger = IntervalTrigger(hours=24, start_date=due)
+        engine.add(phone, i, "burst", record_lag, burst_trigger, [due.timestamp(), MESSAGE])
+
+    deadline = due.timestamp() + 30
+    while time.time() < deadline:
+        with lock:
+            if len(lags) >= burst:
+                break
+        time.sleep(0.05)
+    stop()
+
+    with lock:
+        fired = list(lags)
+    return {
+        "engine": engine_name,
+        "payload": payload,
+        "trigger": trigger,
+        "reminders": size,
+        "bytes_per_reminder": round((current - base) / size) if size else 0,
+        "add_us_per_reminder": round(add_seconds / size * 1e6, 1) if size else 0,
+        "burst": burst,
+        "burst_fired": len(fired),
+        "lag_p50_ms": round(percentile(fired, 50) * 1000, 1),
+        "lag_p99_ms": round(percentile(fired, 99) * 1000, 1),
+        "lag_max_ms": round(max(fired) * 1000, 1) if fired else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--engines", default="apscheduler,heap")
+    parser.add_argument("--payloads", default="rows,records")
+    parser.add_argument("--triggers", default="interval,cron")
+    parser.add_argument("--burst", type=int, default=5000)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        engine_name, payload, trigger, size = args.case.split(":")
+        print(json.dumps(run_case(engine_name, payload, trigger, int(size), args.burst)))
+        return
+
+    columns = ["engine", "payload", "trigger", "reminders", "bytes_per_reminder", "add_us_per_reminder",
+               "burst", "burst_fired", "lag_p50_ms", "lag_p99_ms", "lag_max_ms"]
+    print("  ".join(f"{c:>19}" for c in columns))
+    cases = [(size, trigger, engine_name, payload) for size in (int(s) for s in args.sizes.split(","))
+             for trigger in args.triggers.split(",")
+             for engine_name in args.engines.split(",") for payload in args.payloads.split(",")]
+    for size, trigger, engine_name, payload in cases:
+        # Subproceso por caso: la memoria y los hilos de un caso no afectan al siguiente
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--case", f"{engine_name}:{payload}:{trigger}:{size}",
+             "--burst", str(args.burst)],
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            print(f"{engine_name} {payload} {trigger} {size}: failed\n{result.stderr[-2000:]}")
+            continue
+        row = json.loads(result.stdout.strip().splitlines()[-1])
+        print("  ".join(f"{row[c]:>19}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
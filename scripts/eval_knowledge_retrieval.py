@@ -0,0 +1,75 @@
+"""
+Evaluación de la recuperación de conocimiento (KNOWLEDGE_MODE=retrieval).
+Compara, para un conjunto de preguntas de ejemplo, el tamaño del prompt y la
+cobertura de datos esperados entre el prompt completo y las top-k secciones.
+
+Uso: python scripts/eval_knowledge_retrieval.py [--top-k 4]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import knowledge_base
+import knowledge_index
+
+# Pregunta -> fragmentos del conocimiento que la respuesta necesita
+EVAL_CASES = [
+    ("¿Qué test me sirve para prevenir diabetes e infartos?", ["HbA1c", "NT-proBNP"]),
+    ("¿Dónde compro vitamina D3?", ["Vitamina D3 5000 iU", "https://mercadolibre.com/sec/19aKKqZ"]),
+    ("Quiero tomar zinc, ¿qué me recomiendas?", ["Zinc 50 mg", "https://mercadolibre.com/sec/343x6EX"]),
+    ("¿Qué incluye el test epigenético?", ["97%", "microbiota intestinal"]),
+    ("¿Cómo debo hacer el ayuno?", ["14 horas", "te verde, cafe negro y agua"]),
+    ("¿Dónde están ubicados?", ["Avenida de los Insurgentes 601"]),
+    ("¿Cuál es su página web o WhatsApp?", ["https://epigen.mx/", "5544918977"]),
+    ("Tengo problemas de sueño, ¿algún suplemento?", ["Valeriana 1000mg"]),
+    ("¿Qué suplemento tomo en ayunas para parásitos?", ["Desparasitante", "Semillas de calabaza"]),
+    ("¿Qué es la prueba NT-proBNP?", ["insuficiencia cardíaca"]),
+    ("Quiero bajar de peso, soy mujer", ["Test perdida de peso (Mujer)"]),
+    ("¿Dónde consigo omega 3?", ["Omega 3 de 1000 mg"]),
+]
+
+
+def approx_tokens(text: str) -> int:
+    # Aproximación habitual para texto en español: ~4 caracteres por token
+    return len(text) // 4
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, default=4)
+    args = parser.parse_args()
+
+    full_prompt = knowledge_base.get_system_message()
+    full_covered = 0
+    retrieval_covered = 0
+    total_facts = 0
+    retrieval_sizes = []
+
+    print(f"Index: {len(knowledge_index.KNOWLEDGE_INDEX.sections)} sections, top-k = {args.top_k}\n")
+    print(f"{'question':<58} {'chars':>7} {'facts':>6}")
+
+    for question, facts in EVAL_CASES:
+        knowledge = knowledge_index.build_knowledge_context(question, args.top_k)
+        prompt = knowledge_base.get_system_message(knowledge=knowledge)
+        retrieval_sizes.append(len(prompt))
+
+        found = sum(1 for fact in facts if fact in prompt)
+        total_facts += len(facts)
+        retrieval_covered += found
+        full_covered += sum(1 for fact in facts if fact in full_prompt)
+
+        print(f"{question[:58]:<58} {len(prompt):>7} {found:>3}/{len(facts):<2}")
+
+    avg_size = sum(retrieval_sizes) / len(retrieval_sizes)
+    print()
+    print(f"{'mode':<12} {'avg chars':>10} {'~tokens':>8} {'coverage':>9}")
+    print(f"{'full':<12} {len(full_prompt):>10} {approx_tokens(full_prompt):>8} {full_covered / total_facts:>9.0%}")
+    print(f"{'retrieval':<12} {avg_size:>10.0f} {approx_tokens(' ' * int(avg_size)):>8} {retrieval_covered / total_facts:>9.0%}")
+    print(f"\nPrompt size reduction: {1 - avg_size / len(full_prompt):.0%}")
+
+
+if __name__ == "__main__":
+    main()
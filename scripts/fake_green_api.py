@@ -0,0 +1,239 @@
+"""
+Green API local para pruebas de carga sin tocar el servicio real.
+
+serve: servidor HTTP que imita el endpoint sendMessage de Green API con
+latencia, tasa de errores y límite de peticiones por segundo configurables.
+Apunta la app a él con GREEN_API_BASE_URL=http://127.0.0.1:8090. GET /stats
+devuelve los contadores (enviados, errores, 429) y la latencia servida.
+
+emit: envía webhooks incomingMessageReceived al /webhook de la app a un ritmo
+dado, desde varios remitentes, y resume los códigos de estado y la latencia.
+
+Uso: python scripts/fake_green_api.py serve [--port 8090] [--latency-ms 80] [--jitter-ms 40]
+                                            [--error-rate 0.01] [--rate-limit 20] [--burst 20]
+     python scripts/fake_green_api.py emit [--webhook-url http://127.0.0.1:7860/webhook]
+                                           [--count 200] [--rate 20] [--senders 50] [--text "Hola"]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from outbound_dispatcher import TokenBucket
+
+SEND_MESSAGE_PATH = re.compile(r"^/waInstance[^/]+/sendMessage/[^/]+$")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 1)
+
+
+# ==================== FAKE SERVER ====================
+
+class FakeGreenApi:
+    """Estado compartido del servidor: configuración, límite de ritmo y contadores"""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float, rate_limit: float, burst: int):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self._bucket = TokenBucket(rate_limit, burst) if rate_limit > 0 else None
+        self._lock = threading.Lock()
+        self.counts = {"sent": 0, "errors": 0, "throttled": 0, "bad_requests": 0}
+        self.per_second = {}
+        self._latencies = []
+
+    def admit(self) -> float:
+        """0 si la petición entra en el límite; si no, segundos para el Retry-After"""
+        if not self._bucket:
+            return 0.0
+        with self._lock:
+            return self._bucket.take()
+
+    def count(self, key: str, latency: float = None):
+        with self._lock:
+            self.counts[key] += 1
+            if key == "sent":
+                second = int(time.time())
+                self.per_second[second] = self.per_second.get(second, 0) + 1
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def stats(self):
+        with self._lock:
+            peak = max(self.per_second.values()) if self.per_second else 0
+            return dict(self.counts, peak_sent_per_second=peak,
+                        latency_p50_ms=percentile(self._latencies, 0.50),
+                        latency_p99_ms=percentile(self._latencies, 0.99))
+
+
+def make_handler(fake: FakeGreenApi):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, fake.stats())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b""
+            if not SEND_MESSAGE_PATH.match(self.path):
+                self._reply(404, {"error": "not found"})
+                return
+
+            try:
+                payload = json.loads(raw or b"{}")
+            except ValueError:
+                payload = {}
+            if not payload.get("chatId") or not payload.get("message"):
+                fake.count("bad_requests")
+                self._reply(400, {"error": "chatId and message are required"})
+                return
+
+            retry_after = fake.admit()
+            if retry_after > 0:
+                fake.count("throttled")
+                self._reply(429, {"error": "Too Many Requests"}, {"Retry-After": f"{retry_after:.2f}"})
+                return
+
+            latency = max(0.0, random.gauss(fake.latency, fake.jitter)) if fake.jitter else fake.latency
+            time.sleep(latency)
+            if random.random() < fake.error_rate:
+                fake.count("errors", latency)
+                self._reply(500, {"error": "Internal Server Error"})
+                return
+
+            fake.count("sent", latency)
+            self._reply(200, {"idMessage": uuid.uuid4().hex.upper()[:20]})
+
+    return Handler
+
+
+def serve(args):
+    fake = FakeGreenApi(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit, args.burst)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    server.daemon_threads = True
+    print(f"Fake Green API on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms}±{args.jitter_ms} ms, error rate {args.error_rate}, "
+          f"rate limit {args.rate_limit or 'none'}/s)")
+    print(f"Set GREEN_API_BASE_URL=http://{args.host}:{args.port}; stats at /stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(fake.stats()))
+
+
+# ==================== WEBHOOK EMITTER ====================
+
+def incoming_message_webhook(sender: str, text: str) -> dict:
+    """Webhook incomingMessageReceived de un mensaje de texto, como lo envía Green API"""
+    return {
+        "typeWebhook": "incomingMessageReceived",
+        "instanceData": {"idInstance": 0, "wid": "0@c.us", "typeInstance": "whatsapp"},
+        "timestamp": int(time.time()),
+        "idMessage": uuid.uuid4().hex.upper()[:20],
+        "senderData": {"chatId": f"{sender}@c.us", "sender": f"{sender}@c.us", "senderName": "Load test"},
+        "messageData": {"typeMessage": "textMessage", "textMessageData": {"textMessage": text}}
+    }
+
+
+def emit(args):
+    session = requests.Session()
+    senders = [f"5210000{i:05d}" for i in range(args.senders)]
+    statuses = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def post(i: int):
+        payload = incoming_message_webhook(senders[i % len(senders)], args.text)
+        started = time.perf_counter()
+        try:
+            status = str(session.post(args.webhook_url, json=payload, timeout=args.timeout).status_code)
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for i in range(args.count):
+            # Ritmo constante: el mensaje i sale en started + i / rate
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(post, i)
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "sent": args.count,
+        "seconds": round(elapsed, 2),
+        "statuses": statuses,
+        "latency_p50_ms": percentile(latencies, 0.50),
+        "latency_p99_ms": percentile(latencies, 0.99)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Fake Green API sendMessage endpoint")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8090)
+    serve_parser.add_argument("--latency-ms", type=float, default=80)
+    serve_parser.add_argument("--jitter-ms", type=float, default=40)
+    serve_parser.add_argument("--error-rate", type=float, default=0.0)
+    serve_parser.add_argument("--rate-limit", type=float, default=0, help="Requests per second (0: unlimited)")
+    serve_parser.add_argument("--burst", type=int, default=20)
+    serve_parser.set_defaults(func=serve)
+
+    emit_parser = commands.add_parser("emit", help="Send incoming-message webhooks to the app")
+    emit_parser.add_argument("--webhook-url", default="http://127.0.0.1:7860/webhook")
+    emit_parser.add_argument("--count", type=int, default=200)
+    emit_parser.add_argument("--rate", type=float, default=20, help="Webhooks per second")
+    emit_parser.add_argument("--senders", type=int, default=50)
+    emit_parser.add_argument("--concurrency", type=int, default=16)
+    emit_parser.add_argument("--text", default="Hola")
+    emit_parser.add_argument("--timeout", type=float, default=60)
+    emit_parser.set_defaults(func=emit)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
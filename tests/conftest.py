@@ -0,0 +1,54 @@
+"""
+Fixtures comunes: las pruebas de base de datos usan local_supabase (SQLite en
+memoria) en lugar de Supabase, así que no necesitan red ni credenciales.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_utils
+import local_supabase
+
+
+class FlakyClient(local_supabase.LocalSupabaseClient):
+    """Stand-in que puede simular Supabase caído (error sin código) o que rechace
+    ciertos mensajes (error con código de Postgres, como una fila inválida)"""
+
+    def __init__(self):
+        super().__init__(":memory:")
+        self.offline = False
+        self.rejected_contents = set()
+
+    def table(self, name: str):
+        if self.offline:
+            raise ConnectionError("Supabase unreachable")
+        return super().table(name)
+
+    def rpc(self, function: str, params=None):
+        if self.offline:
+            raise ConnectionError("Supabase unreachable")
+        params = params or {}
+        contents = [m["content"] for m in params.get("p_messages", [])] + [params.get("p_content")]
+        if self.rejected_contents.intersection(contents):
+            raise local_supabase.LocalSupabaseError("invalid byte sequence for encoding", code="22021")
+        return super().rpc(function, params)
+
+
+@pytest.fixture
+def supabase():
+    return FlakyClient()
+
+
+@pytest.fixture(autouse=True)
+def reset_db_utils():
+    """Las pruebas no deben heredar buffers, cachés ni RPCs marcados como ausentes"""
+    yield
+    db_utils.enable_write_behind(None)
+    db_utils.enable_history_cache(None)
+    db_utils.enable_reminder_cache(None)
+    db_utils._missing_rpcs.clear()
+
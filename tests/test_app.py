@@ -0,0 +1,128 @@
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("SUPABASE_URL", "sqlite://")
+
+import app
+import asgi_app
+import db_utils
+import local_supabase
+
+SENDER = "5215550001"
+
+
+class Chunk:
+    def __init__(self, text):
+        self._text = text
+
+    @property
+    def text(self):
+        if isinstance(self._text, Exception):
+            raise self._text
+        return self._text
+
+
+# El segundo fragmento falla cuando el primer párrafo ya se envió
+CHUNKS = ["El magnesio ayuda a dormir mejor.\n\nTambién", ValueError("stream reset")]
+
+
+class FakeChat:
+    def send_message(self, message, stream=False):
+        return (Chunk(text) for text in CHUNKS)
+
+    async def send_message_async(self, message, stream=False):
+        async def chunks():
+            for text in CHUNKS:
+                yield Chunk(text)
+        return chunks()
+
+
+class FakeModel:
+    def start_chat(self, history):
+        return FakeChat()
+
+
+@pytest.fixture
+def streaming(monkeypatch):
+    """app con streaming activo, un modelo que se corta a la mitad y envíos registrados"""
+    sent = []
+    monkeypatch.setattr(app, "GEMINI_STREAMING", True)
+    monkeypatch.setattr(app, "STREAM_MIN_CHUNK_CHARS", 10)
+    monkeypatch.setattr(app, "get_generation_model", lambda: (FakeModel(), False))
+    monkeypatch.setattr(app, "detect_message_intent", lambda sender, text: ("conversation", None))
+    monkeypatch.setattr(app, "supabase", local_supabase.LocalSupabaseClient(":memory:"))
+    monkeypatch.setattr(app, "send_whatsapp_message", lambda recipient, message: sent.append(message) or {"idMessage": str(len(sent))})
+    return sent
+
+
+def assistant_turns():
+    history = db_utils.get_chat_history_from_supabase(app.supabase, SENDER, limit=20)
+    return [m["content"] for m in history if m["role"] == "assistant"]
+
+
+def test_interrupted_stream_sends_follow_up_and_keeps_delivered_text(streaming):
+    app.handle_incoming_message(SENDER, "¿qué mejora el sueño?")
+
+    assert streaming == ["El magnesio ayuda a dormir mejor.", app.STREAM_INTERRUPTED_MESSAGE]
+    assert assistant_turns()[-1] == "El magnesio ayuda a dormir mejor."
+
+
+def test_interrupted_async_stream_sends_follow_up_and_keeps_delivered_text(streaming, monkeypatch):
+    async def send(recipient, message):
+        streaming.append(message)
+        return {"idMessage": str(len(streaming))}
+
+    monkeypatch.setattr(asgi_app, "async_supabase", local_supabase.AsyncLocalSupabaseClient(app.supabase))
+    monkeypatch.setattr(asgi_app, "send_whatsapp_message_async", send)
+    asyncio.run(asgi_app.handle_incoming_message_async(SENDER, "¿qué mejora el sueño?"))
+
+    assert streaming == ["El magnesio ayuda a dormir mejor.", app.STREAM_INTERRUPTED_MESSAGE]
+    assert assistant_turns()[-1] == "El magnesio ayuda a dormir mejor."
+
+
+class RecordingContext(db_utils.PendingUserContext):
+    def __init__(self, calls):
+        super().__init__()
+        self.calls = calls
+
+    def result(self):
+        self.calls.append("context")
+        return super().result()
+
+    def cancel(self):
+        self.calls.append("cancel")
+
+
+@pytest.fixture
+def context_calls(monkeypatch):
+    """Orden en que process_message lanza y consume las lecturas del mensaje"""
+    calls = []
+    read_history = db_utils.get_chat_history_from_supabase
+
+    def history(*args, **kwargs):
+        calls.append("history")
+        return read_history(*args, **kwargs)
+
+    monkeypatch.setattr(app, "supabase", local_supabase.LocalSupabaseClient(":memory:"))
+    db_utils.save_message_to_supabase(app.supabase, SENDER, "user", "hola")
+    monkeypatch.setattr(db_utils, "start_user_context", lambda supabase, sender: calls.append("start") or RecordingContext(calls))
+    monkeypatch.setattr(db_utils, "get_chat_history_from_supabase", history)
+    return calls
+
+
+def test_user_context_is_read_alongside_history(context_calls, monkeypatch):
+    monkeypatch.setattr(app, "detect_message_intent", lambda sender, text: ("conversation", None))
+    monkeypatch.setattr(app, "generate_ai_response_with_context", lambda *args, **kwargs: "Hola")
+
+    assert app.process_message(SENDER, "hola") == "Hola"
+    assert context_calls == ["start", "history", "context"]
+
+
+def test_user_context_is_discarded_for_reminder_intents(context_calls, monkeypatch):
+    monkeypatch.setattr(app, "detect_message_intent", lambda sender, text: ("reminder_request", {}))
+    monkeypatch.setattr(app, "handle_reminder_intent", lambda sender, intent, payload: "Listo")
+
+    assert app.process_message(SENDER, "recuérdame tomar agua") == "Listo"
+    assert context_calls == ["start", "history", "cancel"]
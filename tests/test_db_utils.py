@@ -0,0 +1,356 @@
+import glob
+import json
+
+import pytest
+
+import db_utils
+from db_utils import ChatWriteBuffer
+from user_cache import ReminderCache
+
+
+def chat_rows(supabase, user_phone):
+    result = supabase.table("chat_history").select("role, content, message_order").eq("user_phone", user_phone).order("message_order").execute()
+    return result.data
+
+
+# ==================== USER STATS ====================
+
+def test_user_stats_rpc_matches_three_queries(supabase):
+    assert db_utils.get_user_stats_rpc(supabase, "521") == db_utils.get_user_stats(supabase, "521") == {
+        "total_messages": 0, "first_interaction": None, "last_interaction": None
+    }
+
+    for content in ("hola", "¿cómo duermo mejor?", "gracias"):
+        db_utils._insert_message(supabase, "521", "user", content)
+    db_utils._insert_message(supabase, "522", "user", "otro usuario")
+
+    stats = db_utils.get_user_stats_rpc(supabase, "521")
+    assert stats == db_utils.get_user_stats(supabase, "521")
+    assert stats["total_messages"] == 3
+    assert stats["first_interaction"] <= stats["last_interaction"]
+
+
+def test_user_stats_rpc_falls_back_without_migration(supabase):
+    db_utils._insert_message(supabase, "521", "user", "hola")
+    expected = db_utils.get_user_stats(supabase, "521")
+    db_utils._missing_rpcs.add("get_user_stats")
+
+    assert db_utils.get_user_stats_rpc(supabase, "521") == expected
+    assert db_utils.load_user_context(supabase, "521").user_stats == expected
+
+
+# ==================== MESSAGE ORDER ====================
+
+def test_message_order_continues_after_legacy_insert(supabase):
+    db_utils._insert_message(supabase, "521", "user", "hola")
+    db_utils._save_message_legacy(supabase, "521", "assistant", "hola, ¿en qué te ayudo?")
+    assert db_utils._insert_message(supabase, "521", "user", "gracias") is not None
+
+    assert [row["message_order"] for row in chat_rows(supabase, "521")] == [1, 2, 3]
+
+
+# ==================== CHAT WRITE-BEHIND ====================
+
+def make_buffer(supabase, tmp_path, **kwargs):
+    # Intervalo largo: los volcados solo ocurren cuando la prueba llama a flush()
+    options = {"flush_interval_ms": 60000, "max_batch": 50}
+    options.update(kwargs)
+    return ChatWriteBuffer(supabase, str(tmp_path / "chat_journal.jsonl"), **options)
+
+
+def crash(buffer):
+    """Detener el buffer como una caída del proceso: sin volcar lo pendiente"""
+    buffer._running = False
+    buffer._wakeup.set()
+    buffer._thread.join()
+    buffer._journal.close()
+
+
+def journal_segments(tmp_path):
+    return sorted(glob.glob(str(tmp_path / "chat_journal.jsonl.0*")))
+
+
+def test_flush_inserts_in_append_order(supabase, tmp_path):
+    buffer = make_buffer(supabase, tmp_path)
+    buffer.start()
+    for i in range(5):
+        buffer.append("521", "user", f"mensaje {i}")
+    assert buffer.flush() == 5
+    buffer.stop()
+
+    assert [row["content"] for row in chat_rows(supabase, "521")] == [f"mensaje {i}" for i in range(5)]
+    assert buffer.get_metrics()["pending"] == 0
+
+
+def test_recovery_replays_only_unflushed_messages(supabase, tmp_path):
+    buffer = make_buffer(supabase, tmp_path)
+    buffer.start()
+    for i in range(3):
+        buffer.append("521", "user", f"mensaje {i}")
+    buffer.flush()
+    supabase.offline = True
+    buffer.append("521", "user", "mensaje 3")
+    buffer.append("521", "user", "mensaje 4")
+    assert buffer.flush() == 0
+    crash(buffer)
+
+    supabase.offline = False
+    recovered = make_buffer(supabase, tmp_path)
+    recovered.start()
+    assert recovered.get_metrics()["recovered"] == 2
+    # Las secuencias nuevas siguen a las recuperadas
+    assert recovered.append("521", "user", "mensaje 5") == 6
+    recovered.stop()
+
+    assert [row["content"] for row in chat_rows(supabase, "521")] == [f"mensaje {i}" for i in range(6)]
+
+
+def test_flushed_segments_are_deleted_without_rewriting(supabase, tmp_path):
+    buffer = make_buffer(supabase, tmp_path, segment_size=2)
+    buffer.start()
+    for i in range(5):
+        buffer.append("521", "user", f"mensaje {i}")
+    assert len(journal_segments(tmp_path)) == 3
+
+    buffer.flush()
+    with open(buffer.checkpoint_path, encoding="utf-8") as checkpoint:
+        assert checkpoint.read() == "5"
+    # Solo queda el segmento activo, vacío
+    segments = journal_segments(tmp_path)
+    assert len(segments) == 1
+    with open(segments[0], encoding="utf-8") as segment:
+        assert segment.read() == ""
+    buffer.stop()
+
+
+def test_rejected_message_is_dead_lettered_and_does_not_block(supabase, tmp_path):
+    supabase.rejected_contents.add("\x00")
+    buffer = make_buffer(supabase, tmp_path, max_attempts=2)
+    buffer.start()
+    buffer.append("521", "user", "antes")
+    buffer.append("521", "user", "\x00")
+    buffer.append("521", "user", "después")
+
+    assert buffer.flush() == 1
+    assert buffer.flush() == 1
+    buffer.stop()
+
+    assert [row["content"] for row in chat_rows(supabase, "521")] == ["antes", "después"]
+    with open(buffer.dead_letter_path, encoding="utf-8") as dead:
+        dead_entries = [json.loads(line) for line in dead]
+    assert [entry["content"] for entry in dead_entries] == ["\x00"]
+    assert dead_entries[0]["attempts"] == 2
+    metrics = buffer.get_metrics()
+    assert metrics["dead_lettered"] == 1
+    assert metrics["pending"] == 0
+
+
+def test_network_failure_keeps_messages_pending(supabase, tmp_path):
+    buffer = make_buffer(supabase, tmp_path, max_attempts=1)
+    buffer.start()
+    supabase.offline = True
+    buffer.append("521", "user", "hola")
+    buffer.flush()
+    buffer.flush()
+
+    # Sin respuesta de Supabase no cuenta como rechazo: nunca va al dead letter
+    metrics = buffer.get_metrics()
+    assert metrics["pending"] == 1
+    assert metrics["dead_lettered"] == 0
+    supabase.offline = False
+    buffer.stop()
+    assert [row["content"] for row in chat_rows(supabase, "521")] == ["hola"]
+
+
+def test_append_refuses_when_pending_is_full(supabase, tmp_path):
+    buffer = make_buffer(supabase, tmp_path, max_batch=2, max_pending=2)
+    buffer.start()
+    supabase.offline = True
+    assert buffer.append("521", "user", "uno") is not None
+    assert buffer.append("521", "user", "dos") is not None
+    assert buffer.append("521", "user", "tres") is None
+
+    metrics = buffer.get_metrics()
+    assert metrics["pending"] == 2
+    assert metrics["dropped"] == 1
+    supabase.offline = False
+    buffer.stop()
+
+
+def test_save_message_returns_queued_marker(supabase, tmp_path):
+    buffer = make_buffer(supabase, tmp_path)
+    buffer.start()
+    db_utils.enable_write_behind(buffer)
+
+    assert db_utils.save_message_to_supabase(supabase, "521", "user", "hola") == db_utils.MESSAGE_QUEUED
+    buffer.stop()
+
+
+def test_history_includes_pending_repeated_turns(supabase, tmp_path):
+    buffer = make_buffer(supabase, tmp_path)
+    buffer.start()
+    db_utils.enable_write_behind(buffer)
+
+    turns = [("user", "gracias"), ("assistant", "De nada"), ("user", "gracias"), ("assistant", "De nada")]
+    for role, content in turns[:2]:
+        db_utils.save_message_to_supabase(supabase, "521", role, content)
+    buffer.flush()
+    for role, content in turns[2:]:
+        db_utils.save_message_to_supabase(supabase, "521", role, content)
+
+    history = db_utils.get_chat_history_from_supabase(supabase, "521", limit=20)
+    assert [(m["role"], m["content"]) for m in history] == turns
+    assert db_utils.get_chat_history_from_supabase(supabase, "521", limit=3) == [
+        {"role": role, "content": content} for role, content in turns[1:]
+    ]
+    buffer.stop()
+
+
+def test_flushed_during_read_detects_overlap(supabase, tmp_path):
+    buffer = make_buffer(supabase, tmp_path)
+    buffer.start()
+    buffer.append("521", "user", "hola")
+    pending = buffer.pending_for("521")
+    assert not buffer.flushed_during_read(pending)
+
+    buffer.flush()
+    assert buffer.flushed_during_read(pending)
+    assert buffer.pending_for("521") == []
+    buffer.stop()
+
+
+def test_merge_pending_messages_keeps_last_limit():
+    history = [{"role": "user", "content": "hola"}, {"role": "assistant", "content": "hola"}]
+    pending = [{"seq": 7, "role": "user", "content": "hola", "user_phone": "521"}]
+
+    assert db_utils.merge_pending_messages(history, pending, 2) == [
+        {"role": "assistant", "content": "hola"},
+        {"role": "user", "content": "hola"},
+    ]
+    assert len(db_utils.merge_pending_messages(history, pending, 0)) == 3
+
+
+# ==================== SCHEMA CAPABILITIES ====================
+
+def fresh_schema(monkeypatch):
+    capabilities = db_utils.SchemaCapabilities()
+    monkeypatch.setattr(db_utils, "schema", capabilities)
+    return capabilities
+
+
+def drop_reminder_column(supabase, column):
+    supabase._conn.execute(f"ALTER TABLE reminders DROP COLUMN {column}")
+
+
+def test_optional_columns_are_probed_once(supabase, monkeypatch):
+    capabilities = fresh_schema(monkeypatch)
+    drop_reminder_column(supabase, "nickname")
+
+    assert not capabilities.has_column(supabase, "reminders", "nickname")
+    assert capabilities.has_column(supabase, "reminders", "display_name")
+    # Ya comprobadas: no vuelven a consultar la base
+    supabase.offline = True
+    assert not capabilities.has_column(supabase, "reminders", "nickname")
+    assert capabilities.has_column(supabase, "reminders", "display_name")
+
+
+def test_failed_probe_is_not_cached(supabase, monkeypatch):
+    capabilities = fresh_schema(monkeypatch)
+    drop_reminder_column(supabase, "nickname")
+    supabase.offline = True
+    assert capabilities.has_column(supabase, "reminders", "nickname")
+
+    supabase.offline = False
+    assert not capabilities.has_column(supabase, "reminders", "nickname")
+
+
+def test_reminder_insert_skips_missing_column(supabase, monkeypatch):
+    fresh_schema(monkeypatch)
+    drop_reminder_column(supabase, "nickname")
+
+    reminder_id = db_utils.save_reminder_supabase(supabase, "521", "water", "Toma agua", display_name="Agua",
+                                                  interval_minutes=60, nickname="Agua de la mañana")
+    row = supabase.table("reminders").select("*").eq("id", reminder_id).execute().data[0]
+    assert row["display_name"] == "Agua"
+    assert "nickname" not in row
+
+
+def test_column_dropped_after_probe_is_retried_without_it(supabase, monkeypatch):
+    capabilities = fresh_schema(monkeypatch)
+    assert capabilities.has_column(supabase, "reminders", "nickname")
+    drop_reminder_column(supabase, "nickname")
+
+    assert db_utils.save_reminder_supabase(supabase, "521", "water", "Toma agua", interval_minutes=60,
+                                           nickname="Agua de la mañana") is not None
+    assert not capabilities.has_column(supabase, "reminders", "nickname")
+
+
+# ==================== BULK REMINDERS ====================
+
+def test_save_reminders_returns_ids_in_request_order(supabase):
+    reminders = [
+        {"user_phone": "521", "reminder_type": "supplement", "message": "Vitamina D", "cron_expression": "0 8 * * *"},
+        {"user_phone": "521", "reminder_type": "water", "message": "Toma agua", "interval_minutes": 0},
+        {"user_phone": "521", "reminder_type": "supplement", "message": "Magnesio", "cron_expression": "30 21 * * *",
+         "nickname": "Magnesio noche"},
+        {"user_phone": "522", "reminder_type": "water", "message": "Toma agua", "interval_minutes": 90},
+    ]
+    ids = db_utils.save_reminders_supabase(supabase, reminders)
+
+    assert ids[1] is None
+    assert None not in ids[:1] + ids[2:]
+    rows = {row["id"]: row for row in supabase.table("reminders").select("*").execute().data}
+    assert len(rows) == 3
+    assert rows[ids[0]]["message"] == "Vitamina D"
+    assert rows[ids[2]]["nickname"] == "Magnesio noche"
+    assert rows[ids[3]]["interval_minutes"] == 90
+
+
+def test_save_reminders_updates_reminder_cache(supabase):
+    cache = ReminderCache()
+    db_utils.enable_reminder_cache(cache)
+    assert db_utils.get_user_reminders_supabase(supabase, "521") == []
+
+    ids = db_utils.save_reminders_supabase(supabase, [
+        {"user_phone": "521", "reminder_type": "supplement", "message": "Vitamina D", "cron_expression": f"0 {hour} * * *"}
+        for hour in (8, 14, 20)
+    ])
+    assert [reminder["id"] for reminder in cache.get("521")] == ids
+
+
+def test_save_reminders_failure_returns_none_for_all(supabase):
+    supabase.offline = True
+    ids = db_utils.save_reminders_supabase(supabase, [
+        {"user_phone": "521", "reminder_type": "water", "message": "Toma agua", "interval_minutes": 60}
+    ] * 2)
+
+    assert ids == [None, None]
+
+
+# ==================== REMINDERS ====================
+
+def add_reminders(supabase, count):
+    supabase.table("reminders").insert([
+        {"user_phone": f"52{i}", "reminder_type": "agua", "message": "Toma agua", "interval_minutes": 60, "is_active": True}
+        for i in range(count)
+    ]).execute()
+
+
+def test_iter_active_reminder_pages_walks_all_pages(supabase):
+    add_reminders(supabase, 25)
+    pages = list(db_utils.iter_active_reminder_pages(supabase, page_size=10))
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    ids = [row["id"] for page in pages for row in page]
+    assert ids == sorted(set(ids))
+
+
+def test_iter_active_reminder_pages_raises_after_retries(supabase):
+    add_reminders(supabase, 25)
+    pages = db_utils.iter_active_reminder_pages(supabase, page_size=10, retries=1)
+    assert len(next(pages)) == 10
+
+    supabase.offline = True
+    with pytest.raises(ConnectionError):
+        next(pages)
+    assert db_utils.load_reminders_supabase(supabase) == []
@@ -0,0 +1,77 @@
+import time
+
+from dedup_cache import TTLDedupCache, WebhookDeduplicator
+
+
+def test_add_if_absent_rejects_repeated_key():
+    cache = TTLDedupCache(ttl_seconds=60, max_size=10)
+
+    assert cache.add_if_absent("msg-1")
+    assert not cache.add_if_absent("msg-1")
+    assert cache.add_if_absent("msg-2")
+
+
+def test_expired_key_is_accepted_again():
+    cache = TTLDedupCache(ttl_seconds=0.05, max_size=10)
+    cache.add_if_absent("msg-1")
+    time.sleep(0.1)
+
+    assert cache.add_if_absent("msg-1")
+
+
+def test_size_is_bounded_by_evicting_oldest():
+    cache = TTLDedupCache(ttl_seconds=60, max_size=3)
+    for i in range(5):
+        cache.add_if_absent(f"msg-{i}")
+
+    assert len(cache) == 3
+    assert cache.add_if_absent("msg-0")
+    assert not cache.add_if_absent("msg-4")
+
+
+def test_release_allows_retry():
+    dedup = WebhookDeduplicator(TTLDedupCache())
+
+    assert not dedup.is_duplicate("msg-1")
+    assert dedup.is_duplicate("msg-1")
+    dedup.release("msg-1")
+    assert not dedup.is_duplicate("msg-1")
+    assert not dedup.is_duplicate(None)
+
+    metrics = dedup.get_metrics()
+    assert metrics["accepted"] == 2
+    assert metrics["duplicates"] == 1
+
+
+def test_shared_backend_detects_duplicates_across_workers(supabase):
+    first = WebhookDeduplicator(TTLDedupCache(), supabase)
+    second = WebhookDeduplicator(TTLDedupCache(), supabase)
+
+    assert not first.is_duplicate("msg-1")
+    assert second.is_duplicate("msg-1")
+    first.release("msg-1")
+    assert not second.is_duplicate("msg-1")
+
+
+def test_backend_failure_does_not_drop_messages(supabase):
+    dedup = WebhookDeduplicator(TTLDedupCache(), supabase)
+    supabase.offline = True
+
+    assert not dedup.is_duplicate("msg-1")
+
+
+def claimed_ids(supabase):
+    return {row["id_message"] for row in supabase.table("processed_webhooks").select("id_message").execute().data}
+
+
+def test_shared_table_is_pruned_past_the_ttl_once_per_interval(supabase):
+    supabase.table("processed_webhooks").insert({"id_message": "old-1", "created_at": "2020-01-01T00:00:00+00:00"}).execute()
+    dedup = WebhookDeduplicator(TTLDedupCache(ttl_seconds=3600), supabase, prune_interval_seconds=600)
+
+    assert not dedup.is_duplicate("msg-1")
+    assert claimed_ids(supabase) == {"msg-1"}
+
+    supabase.table("processed_webhooks").insert({"id_message": "old-2", "created_at": "2020-01-01T00:00:00+00:00"}).execute()
+    assert not dedup.is_duplicate("msg-2")
+    assert claimed_ids(supabase) == {"msg-1", "msg-2", "old-2"}
+    assert dedup.get_metrics()["pruned"] == 1
@@ -0,0 +1,98 @@
+import gemini_utils
+from gemini_utils import ContextCache, ParagraphChunker
+
+PARAGRAPHS = [
+    ("*Hidratación*\nToma un vaso de agua al despertar y otro antes de cada comida. " * 3).strip(),
+    "- Evita bebidas azucaradas\n- Lleva una botella contigo",
+    ("*Sueño*\nIntenta dormir a la misma hora todos los días, incluso el fin de semana. " * 4).strip(),
+    "¿Quieres que te programe un recordatorio?",
+]
+TEXT = "\n\n".join(PARAGRAPHS)
+
+
+def stream(chunker, text, step):
+    chunks = []
+    for start in range(0, len(text), step):
+        chunks.extend(chunker.feed(text[start:start + step]))
+    last = chunker.flush()
+    if last:
+        chunks.append(last)
+    return chunks
+
+
+def test_chunks_are_whole_paragraphs_and_keep_all_text():
+    chunks = stream(ParagraphChunker(min_chars=100), TEXT, 7)
+
+    assert "\n\n".join(chunks) == TEXT
+    for chunk in chunks:
+        assert chunk.split("\n\n")[0] in PARAGRAPHS
+        assert chunk.split("\n\n")[-1] in PARAGRAPHS
+
+
+def test_chunks_reach_min_chars_except_the_last():
+    chunks = stream(ParagraphChunker(min_chars=200), TEXT, 5)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) >= 200 for chunk in chunks[:-1])
+
+
+def test_chunking_does_not_depend_on_stream_boundaries():
+    expected = stream(ParagraphChunker(min_chars=150), TEXT, len(TEXT))
+
+    for step in (1, 3, 64):
+        assert stream(ParagraphChunker(min_chars=150), TEXT, step) == expected
+
+
+def test_paragraph_is_held_until_the_next_one_starts():
+    chunker = ParagraphChunker(min_chars=10)
+
+    assert chunker.feed("Primer párrafo completo.\n\n") == []
+    assert chunker.feed("Segundo") == ["Primer párrafo completo."]
+    assert chunker.flush() == "Segundo"
+    assert chunker.flush() is None
+
+
+class FakeCachedContent:
+    name = "cachedContents/epigen"
+
+    def delete(self):
+        pass
+
+
+class FlakyContextCache(ContextCache):
+    """ContextCache sin red: crea el contenido una vez y luego falla si `failing`"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = False
+        self.calls = 0
+
+    def _refresh_or_create(self, api_key, system_instruction, model_name, generation_config,
+                           safety_settings, current):
+        self.calls += 1
+        if self.failing:
+            raise ConnectionError("Gemini unreachable")
+        return FakeCachedContent(), "cached-model"
+
+
+def test_refresh_failure_keeps_the_valid_cache(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(gemini_utils.time, "time", lambda: clock[0])
+    cache = FlakyContextCache(ttl_seconds=100, refresh_margin_seconds=20, retry_after_seconds=60)
+    assert cache.get_model("key", "prompt") == "cached-model"
+
+    # Dentro del margen de renovación la renovación falla, pero el caché aún vale 10s
+    cache.failing = True
+    clock[0] += 90
+    assert cache.get_model("key", "prompt") == "cached-model"
+    assert cache.get_model("key", "prompt") == "cached-model"
+    assert cache.calls == 2
+    assert not cache.get_stats()["fallback_active"]
+
+    # Se reintenta más adelante; ya expirado, se vuelve al prompt completo
+    clock[0] += 5
+    assert cache.get_model("key", "prompt") == "cached-model"
+    assert cache.calls == 3
+    clock[0] += 10
+    assert cache.get_model("key", "prompt") is None
+    assert cache.get_stats()["fallback_active"]
@@ -0,0 +1,128 @@
+import asyncio
+
+import httpx
+import requests
+
+from green_api import AsyncGreenApiClient, GreenApiClient
+
+SENT = {"idMessage": "BAE5F4886F6F2D05"}
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = body if body is not None else {}
+
+    def json(self):
+        return self._body
+
+
+def sync_client(responses, **kwargs):
+    """GreenApiClient cuya sesión devuelve (o lanza) las respuestas dadas, en orden"""
+    client = GreenApiClient("1101", "token", backoff_base=0, **kwargs)
+    calls = []
+
+    def post(url, json=None, timeout=None):
+        calls.append(json)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client.session.post = post
+    return client, calls
+
+
+def test_retries_429_honouring_retry_after():
+    client, calls = sync_client([FakeResponse(429, headers={"Retry-After": "0"}), FakeResponse(503), FakeResponse(200, SENT)])
+
+    assert client.send_message("521", "hola") == SENT
+    assert len(calls) == 3
+    assert calls[0] == {"chatId": "521@c.us", "message": "hola"}
+    metrics = client.get_metrics()
+    assert metrics["retries"] == 2
+    assert metrics["status_counts"] == {"429": 1, "503": 1, "200": 1}
+
+
+def test_gives_up_after_max_retries_with_last_response():
+    client, calls = sync_client([FakeResponse(429, {"message": "Too Many Requests"})] * 3, max_retries=2)
+
+    assert client.send_message("521", "hola") == {"message": "Too Many Requests"}
+    assert len(calls) == 3
+
+
+def test_connection_errors_are_retried():
+    client, calls = sync_client([requests.exceptions.ConnectionError("reset"), FakeResponse(200, SENT)])
+
+    assert client.send_message("521", "hola") == SENT
+    assert client.get_metrics()["errors"] == 1
+
+
+def test_read_timeout_is_not_retried():
+    client, calls = sync_client([requests.exceptions.ReadTimeout("slow"), FakeResponse(200, SENT)])
+
+    # Green API pudo haber enviado el mensaje: reintentar lo duplicaría
+    assert client.send_message("521", "hola") is None
+    assert len(calls) == 1
+
+
+def test_client_errors_are_not_retried():
+    client, calls = sync_client([FakeResponse(400, {"message": "Validation failed"}), FakeResponse(200, SENT)])
+
+    assert client.send_message("521", "hola") == {"message": "Validation failed"}
+    assert len(calls) == 1
+
+
+def run_async(responses, messages, **kwargs):
+    """Enviar `messages` con AsyncGreenApiClient sobre un transporte simulado"""
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.005)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def send():
+        client = AsyncGreenApiClient("1101", "token", backoff_base=0, **kwargs)
+        await client.start()
+        await client._client.aclose()
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await client.send_many(messages), client.get_metrics()
+        finally:
+            await client.aclose()
+
+    results, metrics = asyncio.run(send())
+    return results, metrics, calls
+
+
+def test_async_client_retries_429_and_connection_errors():
+    results, metrics, calls = run_async(
+        [httpx.Response(429, headers={"Retry-After": "0"}), httpx.ConnectError("reset"), httpx.Response(200, json=SENT)],
+        [("521", "hola")]
+    )
+
+    assert results == [SENT]
+    assert len(calls) == 3
+    assert metrics["retries"] == 2
+    assert calls[0].url.path == "/waInstance1101/sendMessage/token"
+
+
+def test_async_client_read_timeout_is_not_retried():
+    results, metrics, calls = run_async([httpx.ReadTimeout("slow"), httpx.Response(200, json=SENT)], [("521", "hola")])
+
+    assert results == [None]
+    assert len(calls) == 1
+
+
+def test_async_client_bounds_requests_in_flight():
+    results, metrics, calls = run_async([httpx.Response(200, json=SENT) for _ in range(20)],
+                                        [("521", str(i)) for i in range(20)], max_in_flight=3)
+
+    assert results == [SENT] * 20
+    assert metrics["peak_in_flight"] == 3
+    assert metrics["in_flight"] == 0
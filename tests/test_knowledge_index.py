@@ -0,0 +1,46 @@
+from knowledge_index import KnowledgeIndex, split_sections, tokenize
+
+TEXT = """# Datos de Epigen
+Teléfono: 55 1234 5678
+
+# Productos
+## Vitamina D
+La vitamina D ayuda a la absorción del calcio. Tomar con alimentos.
+
+## Magnesio
+El magnesio mejora la calidad del sueño y la relajación muscular.
+
+# Test epigenético
+El test analiza marcadores de metilación a partir de una muestra de saliva.
+"""
+
+
+def test_tokenize_normalizes_accents_stopwords_and_suffixes():
+    assert tokenize("¿Cómo mejora la RELAJACIÓN?") == tokenize("como mejora relajacion")
+    assert "la" not in tokenize("la vitamina")
+    assert tokenize("relajaciones") == tokenize("relajación")
+
+
+def test_sections_follow_headers_and_respect_max_chars():
+    sections = split_sections(TEXT, "knowledge_content")
+
+    assert [s["title"] for s in sections] == ["Datos de Epigen", "Productos > Vitamina D", "Productos > Magnesio",
+                                              "Test epigenético"]
+    long_text = "# Largo\n" + "\n\n".join("párrafo " * 20 for _ in range(10))
+    assert all(len(s["text"]) <= 400 for s in split_sections(long_text, "x", max_chars=400))
+
+
+def test_search_ranks_the_relevant_section_first():
+    index = KnowledgeIndex(split_sections(TEXT, "knowledge_content"))
+
+    assert index.search("¿qué mejora el sueño?", top_k=1)[0]["title"] == "Productos > Magnesio"
+    assert index.search("muestra de saliva")[0]["title"] == "Test epigenético"
+    assert index.search("criptomonedas") == []
+
+
+def test_context_keeps_pinned_sections_in_original_order():
+    index = KnowledgeIndex(split_sections(TEXT, "knowledge_content"))
+    context = index.build_context("calcio", top_k=1)
+
+    assert context.index("## Datos de Epigen") < context.index("## Productos > Vitamina D")
+    assert "Magnesio" not in context
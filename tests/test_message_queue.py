@@ -0,0 +1,78 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+from message_queue import MessageQueue, SenderLocks, lane_index
+
+
+def test_lane_index_is_stable_and_in_range():
+    lanes = [lane_index(f"52155{i:05d}", 4) for i in range(1000)]
+
+    assert set(lanes) == {0, 1, 2, 3}
+    assert lanes == [lane_index(f"52155{i:05d}", 4) for i in range(1000)]
+
+
+def test_messages_from_one_sender_are_processed_in_order():
+    processed = defaultdict(list)
+    lock = threading.Lock()
+
+    def handler(sender, message_text):
+        time.sleep(random.random() / 1000)
+        with lock:
+            processed[sender].append(int(message_text))
+
+    queue = MessageQueue(handler, num_workers=4, max_size=0)
+    queue.start()
+    senders = [f"521{i}" for i in range(8)]
+    for n in range(50):
+        for sender in senders:
+            assert queue.submit(sender, str(n))
+    queue.stop(timeout=30)
+
+    assert {sender: processed[sender] for sender in senders} == {sender: list(range(50)) for sender in senders}
+    assert queue.get_metrics()["processed"] == 400
+
+
+def test_submit_rejects_when_stopped_or_full():
+    release = threading.Event()
+    queue = MessageQueue(lambda sender, text: release.wait(5), num_workers=1, max_size=1)
+    assert not queue.submit("521", "hola")
+
+    queue.start()
+    assert queue.submit("521", "uno")
+    # Esperar a que el worker tome el primero y el carril quede vacío
+    deadline = time.monotonic() + 5
+    while queue.get_metrics()["busy_workers"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.submit("521", "dos")
+    assert not queue.submit("521", "tres")
+    assert queue.get_metrics()["rejected"] == 1
+
+    release.set()
+    queue.stop()
+
+
+def test_sender_locks_serialize_one_sender_and_are_cleaned_up():
+    locks = SenderLocks()
+    active = defaultdict(int)
+    overlaps = []
+    guard = threading.Lock()
+
+    def work(sender):
+        with locks.hold(sender):
+            with guard:
+                active[sender] += 1
+                overlaps.append(active[sender])
+            time.sleep(0.005)
+            with guard:
+                active[sender] -= 1
+
+    threads = [threading.Thread(target=work, args=(f"521{i % 3}",)) for i in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(overlaps) == 1
+    assert locks._locks == {}
@@ -0,0 +1,164 @@
+import threading
+import time
+
+from outbound_dispatcher import PRIORITY_INTERACTIVE, PRIORITY_REMINDER, OutboundDispatcher, ReminderBatcher, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=10, burst=3)
+
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = bucket.take()
+    assert 0 < wait <= 0.1
+
+    bucket.refund()
+    assert bucket.take() == 0.0
+
+
+class BlockingSender:
+    """send_func que retiene el primer envío hasta release(), para llenar la cola"""
+
+    def __init__(self):
+        self.sent = []
+        self.started = threading.Event()
+        self._release = threading.Event()
+
+    def __call__(self, recipient, message):
+        self.started.set()
+        self._release.wait(5)
+        self.sent.append(message)
+        return {"idMessage": message}
+
+    def release(self):
+        self._release.set()
+
+
+def start_dispatcher(sender, **kwargs):
+    options = {"rate_per_second": 1000, "burst": 100, "num_workers": 1}
+    options.update(kwargs)
+    dispatcher = OutboundDispatcher(sender, **options)
+    dispatcher.start()
+    dispatcher.submit("521", "primero", PRIORITY_REMINDER)
+    assert sender.started.wait(5)
+    return dispatcher
+
+
+def test_interactive_messages_skip_queued_reminders():
+    sender = BlockingSender()
+    dispatcher = start_dispatcher(sender)
+
+    reminders = [dispatcher.submit("521", f"recordatorio {i}", PRIORITY_REMINDER) for i in range(3)]
+    reply = dispatcher.submit("522", "respuesta", PRIORITY_INTERACTIVE)
+    sender.release()
+
+    assert reply.result(5) == {"idMessage": "respuesta"}
+    for future in reminders:
+        future.result(5)
+    assert sender.sent == ["primero", "respuesta", "recordatorio 0", "recordatorio 1", "recordatorio 2"]
+    dispatcher.stop()
+
+
+def test_full_reminder_backlog_drops_reminders_only():
+    sender = BlockingSender()
+    dispatcher = start_dispatcher(sender, max_backlog=1)
+
+    assert dispatcher.submit("521", "recordatorio 0", PRIORITY_REMINDER) is not None
+    assert dispatcher.submit("521", "recordatorio 1", PRIORITY_REMINDER) is None
+    assert dispatcher.submit("522", "respuesta 0", PRIORITY_INTERACTIVE) is not None
+    assert dispatcher.submit("522", "respuesta 1", PRIORITY_INTERACTIVE) is not None
+    sender.release()
+    dispatcher.stop()
+
+    priorities = dispatcher.get_metrics()["priorities"]
+    assert priorities["reminder"]["dropped"] == 1
+    assert priorities["interactive"]["dropped"] == 0
+
+
+def test_late_reminders_expire_and_refund_the_token():
+    sender = BlockingSender()
+    dispatcher = start_dispatcher(sender, max_delay_seconds=0.05)
+
+    late = dispatcher.submit("521", "recordatorio", PRIORITY_REMINDER)
+    reply = dispatcher.submit("522", "respuesta", PRIORITY_INTERACTIVE)
+    time.sleep(0.1)
+    sender.release()
+
+    assert late.result(5) is None
+    assert reply.result(5) == {"idMessage": "respuesta"}
+    assert "recordatorio" not in sender.sent
+    assert dispatcher.get_metrics()["priorities"]["reminder"]["expired"] == 1
+    dispatcher.stop()
+
+
+def test_rate_limit_spaces_sends():
+    sent_at = []
+    dispatcher = OutboundDispatcher(lambda recipient, message: sent_at.append(time.monotonic()) or {},
+                                    rate_per_second=20, burst=1, num_workers=2)
+    dispatcher.start()
+    futures = [dispatcher.submit("521", str(i)) for i in range(5)]
+    for future in futures:
+        future.result(5)
+    dispatcher.stop()
+
+    # 1 token de reserva y 20/s: los 4 siguientes tardan al menos ~0.2 s
+    assert sent_at[-1] - sent_at[0] >= 0.15
+
+
+class RecordingSender:
+    def __init__(self, expected):
+        self.sent = []
+        self.done = threading.Event()
+        self._expected = expected
+        self._lock = threading.Lock()
+
+    def __call__(self, recipient, message):
+        with self._lock:
+            self.sent.append((time.monotonic(), message))
+            if len(self.sent) == self._expected:
+                self.done.set()
+        return {"idMessage": message}
+
+
+def test_batcher_spreads_a_burst_over_the_jitter_budget():
+    sender = RecordingSender(10)
+    batcher = ReminderBatcher(sender, window_seconds=0.05, jitter_budget_seconds=0.2, min_rate=10)
+    batcher.start()
+    for i in range(10):
+        batcher.submit(f"52{i}", f"recordatorio {i}")
+
+    assert sender.done.wait(5)
+    batcher.stop()
+    times = sorted(sent_at for sent_at, _ in sender.sent)
+    assert times[-1] - times[0] >= 0.15
+    metrics = batcher.get_metrics()
+    assert (metrics["batches"], metrics["last_batch"], metrics["released"]) == (1, 10, 10)
+    assert metrics["last_spread_seconds"] == 0.2
+
+
+def test_batcher_does_not_stretch_small_batches():
+    sender = RecordingSender(2)
+    batcher = ReminderBatcher(sender, window_seconds=0.01, jitter_budget_seconds=30, min_rate=20)
+    batcher.start()
+    batcher.submit("521", "agua")
+    batcher.submit("522", "agua")
+
+    # Espaciado acotado por min_rate (0.05 s), no 15 s
+    assert sender.done.wait(2)
+    batcher.stop()
+    assert batcher.get_metrics()["last_spread_seconds"] == 0.1
+
+
+def test_batcher_stop_sends_pending_reminders_immediately():
+    sender = RecordingSender(3)
+    batcher = ReminderBatcher(sender, window_seconds=60, jitter_budget_seconds=60, min_rate=0.1)
+    batcher.start()
+    for i in range(3):
+        batcher.submit(f"52{i}", f"recordatorio {i}")
+    started = time.monotonic()
+    batcher.stop()
+
+    assert sender.done.is_set()
+    assert time.monotonic() - started < 2
+    # Detenido: los siguientes salen directamente
+    batcher.submit("529", "tarde")
+    assert sender.sent[-1][1] == "tarde"
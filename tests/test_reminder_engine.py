@@ -0,0 +1,93 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytz
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from reminder_engine import ReminderHeapEngine, _Daily
+
+TIMEZONE = pytz.timezone("America/Mexico_City")
+
+
+def hourly():
+    return IntervalTrigger(hours=1, timezone=TIMEZONE)
+
+
+def noop():
+    pass
+
+
+def test_add_replace_and_remove():
+    engine = ReminderHeapEngine()
+    job_id = engine.add("521", 7, "agua", noop, hourly(), [])
+    assert engine.add("521", 7, "agua", noop, hourly(), []) == job_id
+    engine.add("521", 8, "medicina", noop, hourly(), [])
+
+    assert engine.count() == 2
+    assert set(engine.jobs_for_user("521")) == {"7", "8"}
+    assert engine.remove("521", 7)
+    assert not engine.remove("521", 7)
+    assert engine.remove_user("521") == 1
+    assert engine.count() == 0
+    assert engine.next_runs() == []
+
+
+def test_cancelled_timers_are_compacted():
+    engine = ReminderHeapEngine()
+    for i in range(3000):
+        engine.add(f"52{i}", i, "agua", noop, hourly(), [])
+    for i in range(2000):
+        engine.remove(f"52{i}", i)
+
+    metrics = engine.get_metrics()
+    assert metrics["compactions"] >= 1
+    assert metrics["jobs"] == 1000
+    assert metrics["heap_size"] < 2000
+
+
+def test_daily_cron_schedules_are_shared():
+    engine = ReminderHeapEngine()
+    for i in range(100):
+        engine.add(f"52{i}", i, "medicina", noop, CronTrigger(hour=8, minute=30, timezone=TIMEZONE), [])
+    engine.add("999", 1, "medicina", noop, CronTrigger(hour=21, minute=0, timezone=TIMEZONE), [])
+    engine.add("999", 2, "medicina", noop, CronTrigger(day_of_week="mon", hour=8, minute=30, timezone=TIMEZONE), [])
+
+    assert engine.get_metrics()["daily_schedules"] == 2
+    timers = engine._by_user["999"]
+    assert isinstance(timers["1"].schedule, _Daily)
+    assert not isinstance(timers["2"].schedule, _Daily)
+
+
+def test_daily_matches_cron_trigger_across_dst():
+    new_york = pytz.timezone("America/New_York")
+    trigger = CronTrigger(hour=8, minute=30, timezone=new_york)
+    daily = _Daily(new_york, 8, 30)
+
+    # Semana del cambio al horario de verano (10 de marzo de 2024)
+    previous = new_york.localize(datetime(2024, 3, 7, 12, 0))
+    for _ in range(7):
+        expected = trigger.get_next_fire_time(None, previous + timedelta(microseconds=1))
+        assert daily.next_after(previous.timestamp()) == expected.timestamp()
+        previous = expected
+
+
+def test_due_timers_fire_and_cancelled_ones_do_not():
+    fired = []
+    done = threading.Event()
+
+    def record(name):
+        fired.append(name)
+        done.set()
+
+    engine = ReminderHeapEngine(max_sleep_seconds=0.1)
+    engine.start()
+    engine.add("521", 1, "agua", record, IntervalTrigger(seconds=1, timezone=TIMEZONE), ["cancelado"])
+    engine.add("522", 2, "agua", record, IntervalTrigger(seconds=1, timezone=TIMEZONE), ["activo"])
+    engine.remove("521", 1)
+
+    assert done.wait(5)
+    engine.stop()
+    assert set(fired) == {"activo"}
+    # Los intervalos se reprograman tras disparar
+    assert engine.count() == 1
@@ -0,0 +1,70 @@
+import pytest
+import pytz
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from reminder_jobs import ReminderJobRegistry, reminder_job_id
+
+TIMEZONE = pytz.timezone("America/Mexico_City")
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = BackgroundScheduler(timezone=TIMEZONE)
+    scheduler.start(paused=True)
+    yield scheduler
+    scheduler.shutdown(wait=False)
+
+
+def hourly():
+    return IntervalTrigger(hours=1, timezone=TIMEZONE)
+
+
+def noop(*args):
+    pass
+
+
+def scheduled_ids(scheduler):
+    return {job.id for job in scheduler.get_jobs()}
+
+
+def test_jobs_are_indexed_by_user_and_reminder(scheduler):
+    registry = ReminderJobRegistry(scheduler)
+    registry.add("521", 1, "water", noop, hourly(), ["521", "Toma agua"])
+    registry.add("521", 2, "sleep", noop, hourly(), ["521", "A dormir"])
+
+    assert registry.jobs_for_user("521") == {"1": "water_521_1", "2": "sleep_521_2"}
+    assert registry.count() == 2
+    assert {run["id"] for run in registry.next_runs()} == {"water_521_1", "sleep_521_2"}
+
+
+def test_remove_user_does_not_touch_users_with_a_common_prefix(scheduler):
+    registry = ReminderJobRegistry(scheduler)
+    registry.add("521", 1, "water", noop, hourly(), [])
+    registry.add("5211", 1, "water", noop, hourly(), [])
+    registry.add("52", 11, "water", noop, hourly(), [])
+
+    assert registry.remove_user("521") == 1
+    assert scheduled_ids(scheduler) == {reminder_job_id("water", "5211", 1), reminder_job_id("water", "52", 11)}
+    assert not registry.remove("521", 1)
+    assert registry.remove("52", 11)
+    assert scheduled_ids(scheduler) == {reminder_job_id("water", "5211", 1)}
+
+
+def test_changing_the_type_replaces_the_previous_job(scheduler):
+    registry = ReminderJobRegistry(scheduler)
+    registry.add("521", 1, "water", noop, hourly(), [])
+    registry.add("521", 1, "supplement", noop, hourly(), [])
+
+    assert scheduled_ids(scheduler) == {"supplement_521_1"}
+    assert registry.jobs_for_user("521") == {"1": "supplement_521_1"}
+    assert registry.count() == 1
+
+
+def test_jobs_removed_from_the_scheduler_leave_the_index(scheduler):
+    registry = ReminderJobRegistry(scheduler)
+    registry.add("521", 1, "water", noop, hourly(), [])
+    scheduler.remove_job("water_521_1")
+
+    assert registry.count() == 0
+    assert registry.jobs_for_user("521") == {}
@@ -0,0 +1,60 @@
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from reminder_record import ReminderRecord
+
+
+def row(**overrides):
+    values = {"id": 7, "user_phone": "521", "reminder_type": "supplement", "message": "Toma tu vitamina D",
+              "interval_minutes": None, "cron_expression": "5 8 * * *"}
+    values.update(overrides)
+    return values
+
+
+def test_from_row_keeps_only_scheduling_fields():
+    record = ReminderRecord.from_row(row(timezone="America/Mexico_City", is_active=True))
+
+    assert not hasattr(record, "__dict__")
+    assert (record.id, record.user_phone, record.reminder_type) == (7, "521", "supplement")
+    assert record.nickname is None and record.display_name is None
+
+
+def test_messages_are_shared_between_records():
+    first = ReminderRecord.from_row(row(message="".join(["Toma ", "agua"])))
+    second = ReminderRecord.from_row(row(id=8, message="".join(["Toma a", "gua"])))
+
+    assert first.message is second.message
+    assert first.job_args() == ("521", "Toma agua")
+
+
+def test_daily_reminder_trigger_and_text():
+    record = ReminderRecord.from_row(row())
+
+    assert record.daily_time() == (8, 5)
+    trigger = record.trigger()
+    assert isinstance(trigger, CronTrigger)
+    assert {f.name: str(f) for f in trigger.fields}["hour"] == "8"
+    assert record.schedule_text() == "8:05"
+
+
+def test_interval_reminder_trigger_and_text():
+    record = ReminderRecord.from_row(row(reminder_type="water", interval_minutes=90, cron_expression=None))
+
+    assert record.daily_time() is None
+    assert isinstance(record.trigger(), IntervalTrigger)
+    assert record.trigger().interval_length == 5400
+    assert record.schedule_text() == "cada 1.5 horas"
+
+
+def test_reminder_without_schedule_has_no_trigger():
+    record = ReminderRecord.from_row(row(cron_expression=None))
+
+    assert record.trigger() is None
+    assert record.schedule_text() == "horario específico"
+
+
+def test_label_prefers_nickname_then_display_name_then_type():
+    assert ReminderRecord.from_row(row(nickname="Vitamina", display_name="Suplemento D")).label() == "Vitamina"
+    assert ReminderRecord.from_row(row(nickname="None", display_name="Suplemento D")).label() == "Suplemento D"
+    assert ReminderRecord.from_row(row()).label() == "Suplemento"
+    assert ReminderRecord.from_row(row(reminder_type="stretch")).label() == "Stretch"
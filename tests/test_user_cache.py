@@ -0,0 +1,95 @@
+import time
+
+import db_utils
+from user_cache import ConversationCache, ReminderCache
+
+
+def messages(*contents):
+    return [{"role": "user", "content": content} for content in contents]
+
+
+def test_load_is_served_from_cache():
+    cache = ConversationCache()
+    token = cache.begin_load("521")
+    cache.finish_load("521", token, messages("hola", "adiós"), complete=True)
+
+    assert cache.get("521", 20) == messages("hola", "adiós")
+    assert cache.get("521", 1) == messages("adiós")
+
+
+def test_load_raced_by_append_is_not_stored():
+    cache = ConversationCache()
+    token = cache.begin_load("521")
+    cache.append("521", "user", "nuevo")
+    cache.finish_load("521", token, messages("hola"), complete=True)
+
+    assert cache.get("521", 20) is None
+    assert cache.get_metrics()["stale_loads"] == 1
+
+
+def test_load_raced_by_invalidate_is_not_stored():
+    cache = ReminderCache()
+    token = cache.begin_load("521")
+    cache.invalidate("521")
+    cache.finish_load("521", token, [{"id": 1}])
+
+    assert cache.get("521") is None
+    assert cache.get_metrics()["stale_loads"] == 1
+
+
+def test_concurrent_loads_only_fresh_token_is_stored():
+    cache = ConversationCache()
+    old = cache.begin_load("521")
+    cache.append("521", "user", "nuevo")
+    fresh = cache.begin_load("521")
+    cache.finish_load("521", fresh, messages("hola", "nuevo"), complete=True)
+    cache.finish_load("521", old, messages("hola"), complete=True)
+
+    assert cache.get("521", 20) == messages("hola", "nuevo")
+
+
+def test_append_trims_and_marks_incomplete():
+    cache = ConversationCache(max_messages=2)
+    token = cache.begin_load("521")
+    cache.finish_load("521", token, messages("uno"), complete=True)
+    cache.append("521", "user", "dos")
+    cache.append("521", "user", "tres")
+
+    assert cache.get("521", 2) == messages("dos", "tres")
+    # Se descartó "uno": pedir más de lo guardado obliga a ir a la base
+    assert cache.get("521", 3) is None
+
+
+def test_entries_expire_after_ttl():
+    cache = ReminderCache(ttl_seconds=0.05)
+    token = cache.begin_load("521")
+    cache.finish_load("521", token, [{"id": 1}])
+    time.sleep(0.1)
+
+    assert cache.get("521") is None
+
+
+def test_reminder_write_through(supabase):
+    cache = ReminderCache()
+    db_utils.enable_reminder_cache(cache)
+    assert db_utils.get_user_reminders_supabase(supabase, "521") == []
+
+    reminder_id = db_utils.save_reminder_supabase(supabase, "521", "agua", "Toma agua", interval_minutes=60)
+    assert [r["id"] for r in cache.get("521")] == [reminder_id]
+    assert db_utils.deactivate_reminder_supabase(supabase, "521", reminder_id)
+    assert cache.get("521") == []
+    assert db_utils.get_user_reminders_supabase(supabase, "521") == []
+
+
+def test_history_cache_tracks_saved_messages(supabase):
+    cache = ConversationCache()
+    db_utils.enable_history_cache(cache)
+    db_utils.save_message_to_supabase(supabase, "521", "user", "hola")
+    assert db_utils.get_chat_history_from_supabase(supabase, "521") == messages("hola")
+
+    db_utils.save_message_to_supabase(supabase, "521", "assistant", "¡Hola!")
+    assert cache.get("521", 20) == [{"role": "user", "content": "hola"}, {"role": "assistant", "content": "¡Hola!"}]
+
+    supabase.offline = True
+    db_utils.save_message_to_supabase(supabase, "521", "user", "¿sigues ahí?")
+    assert cache.get("521", 20) is None
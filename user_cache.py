@@ -0,0 +1,278 @@
+"""
+Módulo de cachés en memoria por usuario.
+ConversationCache guarda los mensajes recientes de cada teléfono para no releer
+chat_history de Supabase en cada mensaje: se llena al leer, se actualiza con
+cada mensaje guardado por este proceso y se invalida si una escritura falla.
+ReminderCache hace lo mismo con los recordatorios activos, actualizada por las
+funciones de escritura de recordatorios (write-through).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class _PerUserCache:
+    """Base común: LRU por teléfono con TTL desde la última actividad y control de
+    lecturas en curso, para que una lectura que compitió con una escritura no
+    deje en caché datos anteriores a esa escritura."""
+
+    def __init__(self, max_users: int, ttl_seconds: float):
+        self.max_users = max(1, int(max_users))
+        self.ttl_seconds = float(ttl_seconds)
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        # Lecturas en curso por teléfono: [lecturas, generación]
+        self._loads: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._evictions = 0
+        self._stale_loads = 0
+
+    def begin_load(self, user_phone: str) -> int:
+        """Registrar una lectura de Supabase; el token detecta escrituras durante la lectura"""
+        with self._lock:
+            load = self._loads.setdefault(user_phone, [0, 0])
+            load[0] += 1
+            return load[1]
+
+    def invalidate(self, user_phone: str):
+        """Olvidar los datos del usuario (p. ej. si falló una escritura)"""
+        with self._lock:
+            self._bump_generation(user_phone)
+            if self._remove(user_phone):
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            for user_phone in list(self._loads):
+                self._bump_generation(user_phone)
+            for user_phone in list(self._entries):
+                self._remove(user_phone)
+
+    def _lookup(self, user_phone: str):
+        """Entrada vigente del usuario (marcándola como usada) o None; con _lock tomado"""
+        entry = self._entries.get(user_phone)
+        if entry is not None and time.monotonic() - entry.touched_at > self.ttl_seconds:
+            self._remove(user_phone)
+            entry = None
+        if entry is not None:
+            entry.touched_at = time.monotonic()
+            self._entries.move_to_end(user_phone)
+        return entry
+
+    def _end_load(self, user_phone: str, token: int, has_result: bool) -> bool:
+        """Cerrar una lectura; True si su resultado puede guardarse. Con _lock tomado"""
+        load = self._loads.get(user_phone)
+        if load is None:
+            return False
+        stale = load[1] != token
+        load[0] -= 1
+        if load[0] == 0:
+            del self._loads[user_phone]
+        if stale and has_result:
+            self._stale_loads += 1
+        return has_result and not stale
+
+    def _store(self, user_phone: str, entry):
+        self._remove(user_phone)
+        self._entries[user_phone] = entry
+        self._entry_added(entry)
+        self._evict()
+
+    def _bump_generation(self, user_phone: str):
+        load = self._loads.get(user_phone)
+        if load is not None:
+            load[1] += 1
+
+    def _remove(self, user_phone: str) -> bool:
+        entry = self._entries.pop(user_phone, None)
+        if entry is None:
+            return False
+        self._entry_removed(entry)
+        return True
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_users or self._over_limit()):
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    # Ganchos para límites de memoria adicionales
+    def _entry_added(self, entry):
+        pass
+
+    def _entry_removed(self, entry):
+        pass
+
+    def _over_limit(self) -> bool:
+        return False
+
+    def _base_metrics(self) -> Dict[str, Any]:
+        lookups = self._hits + self._misses
+        return {
+            "enabled": True,
+            "users": len(self._entries),
+            "max_users": self.max_users,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            "invalidations": self._invalidations,
+            "evictions": self._evictions,
+            "stale_loads": self._stale_loads
+        }
+
+
+class _HistoryEntry:
+    __slots__ = ("messages", "complete", "chars", "touched_at")
+
+    def __init__(self, messages: List[Dict[str, str]], complete: bool):
+        self.messages = messages
+        # True si messages contiene todo el historial del usuario
+        self.complete = complete
+        self.chars = sum(len(m["content"]) for m in messages)
+        self.touched_at = time.monotonic()
+
+
+class ConversationCache(_PerUserCache):
+    """LRU de historial reciente por teléfono, acotado por usuarios, mensajes y caracteres.
+    El TTL cuenta desde la última lectura o escritura del usuario en este proceso y
+    limita cuánto tiempo pueden pasar desapercibidos mensajes escritos por otros procesos."""
+
+    def __init__(self, max_users: int = 1000, max_messages: int = 50, ttl_seconds: float = 600,
+                 max_total_chars: int = 5_000_000):
+        super().__init__(max_users, ttl_seconds)
+        self.max_messages = max(1, int(max_messages))
+        self.max_total_chars = max(0, int(max_total_chars))
+        self._total_chars = 0
+        self._appends = 0
+
+    def get(self, user_phone: str, limit: int) -> Optional[List[Dict[str, str]]]:
+        """Los últimos `limit` mensajes, o None si hay que leerlos de Supabase"""
+        with self._lock:
+            entry = self._lookup(user_phone)
+            if entry is None or (len(entry.messages) < limit and not entry.complete):
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            return [dict(m) for m in entry.messages[-limit:]] if limit else []
+
+    def finish_load(self, user_phone: str, token: int, messages: Optional[List[Dict[str, str]]] = None,
+                    complete: bool = False):
+        """Guardar el resultado de la lectura (o solo cerrarla si messages es None).
+        Se descarta si hubo escrituras del usuario mientras tanto."""
+        with self._lock:
+            if not self._end_load(user_phone, token, messages is not None):
+                return
+
+            complete = complete and len(messages) <= self.max_messages
+            messages = [{"role": m["role"], "content": m["content"]} for m in messages[-self.max_messages:]]
+            self._store(user_phone, _HistoryEntry(messages, complete))
+
+    def append(self, user_phone: str, role: str, content: str):
+        """Añadir un mensaje ya guardado; sin entrada en caché no hay nada que actualizar"""
+        with self._lock:
+            self._bump_generation(user_phone)
+            entry = self._lookup(user_phone)
+            if entry is None:
+                return
+
+            entry.messages.append({"role": role, "content": content})
+            entry.chars += len(content)
+            self._total_chars += len(content)
+            while len(entry.messages) > self.max_messages:
+                dropped = entry.messages.pop(0)
+                entry.chars -= len(dropped["content"])
+                self._total_chars -= len(dropped["content"])
+                entry.complete = False
+
+            self._appends += 1
+            self._evict()
+
+    def _entry_added(self, entry: _HistoryEntry):
+        self._total_chars += entry.chars
+
+    def _entry_removed(self, entry: _HistoryEntry):
+        self._total_chars -= entry.chars
+
+    def _over_limit(self) -> bool:
+        return bool(self.max_total_chars) and self._total_chars > self.max_total_chars
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = self._base_metrics()
+            metrics.update({
+                "max_messages": self.max_messages,
+                "total_chars": self._total_chars,
+                "max_total_chars": self.max_total_chars,
+                "appends": self._appends
+            })
+            return metrics
+
+
+class _ReminderEntry:
+    __slots__ = ("reminders", "touched_at")
+
+    def __init__(self, reminders: List[Dict[str, Any]]):
+        self.reminders = reminders
+        self.touched_at = time.monotonic()
+
+
+class ReminderCache(_PerUserCache):
+    """Recordatorios activos por teléfono. Las funciones de escritura de db_utils la
+    actualizan al confirmar cada cambio (write-through) y la invalidan si fallan."""
+
+    def __init__(self, max_users: int = 5000, ttl_seconds: float = 600):
+        super().__init__(max_users, ttl_seconds)
+        self._write_throughs = 0
+
+    def get(self, user_phone: str) -> Optional[List[Dict[str, Any]]]:
+        """Copia de los recordatorios activos, o None si hay que leerlos de Supabase"""
+        with self._lock:
+            entry = self._lookup(user_phone)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return [dict(r) for r in entry.reminders]
+
+    def finish_load(self, user_phone: str, token: int, reminders: Optional[List[Dict[str, Any]]] = None):
+        with self._lock:
+            if self._end_load(user_phone, token, reminders is not None):
+                self._store(user_phone, _ReminderEntry([dict(r) for r in reminders]))
+
+    def add(self, user_phone: str, reminder: Dict[str, Any]):
+        """Recordatorio recién creado (fila devuelta por el insert)"""
+        with self._lock:
+            self._bump_generation(user_phone)
+            entry = self._lookup(user_phone)
+            if entry is not None:
+                entry.reminders.append(dict(reminder))
+                self._write_throughs += 1
+
+    def remove(self, user_phone: str, reminder_id: int):
+        """Recordatorio desactivado"""
+        with self._lock:
+            self._bump_generation(user_phone)
+            entry = self._lookup(user_phone)
+            if entry is not None:
+                entry.reminders = [r for r in entry.reminders if r.get("id") != reminder_id]
+                self._write_throughs += 1
+
+    def remove_all(self, user_phone: str):
+        """Todos los recordatorios del usuario desactivados: el estado es conocido (vacío)"""
+        with self._lock:
+            self._bump_generation(user_phone)
+            self._store(user_phone, _ReminderEntry([]))
+            self._write_throughs += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = self._base_metrics()
+            metrics["write_throughs"] = self._write_throughs
+            return metrics